@@ -0,0 +1,185 @@
+"""
+Decide how many new batches the variation bot may start based on the load
+that bot-generated histories currently put on the Galaxy server.
+
+The load is estimated as the number of datasets waiting to be produced, i.e.
+in a new, queued or running state, across all recently updated histories
+with any of the configured tags. Jobs producing several datasets get
+counted several times, and the jobs needed for one batch get estimated the
+same way from completed variation histories.
+
+Galaxy schedules the steps of a workflow gradually, so right after their
+invocation variation histories hold only a fraction of their datasets. Each
+of them that is still being worked on counts with at least the estimated
+jobs of a batch, and so does each admitted batch that has no history yet,
+e.g. because its data is still being uploaded.
+"""
+
+import statistics
+import sys
+import time
+
+from galaxy_client import get_galaxy_instance, list_histories
+
+
+PENDING_STATES = ('new', 'upload', 'queued', 'running', 'setting_metadata')
+
+
+class AdmissionController():
+    """Keep the estimated number of outstanding jobs within a budget."""
+
+    def __init__(
+        self, gi, history_tags, job_budget,
+        jobs_per_batch=None, max_batches=1, window_days=7,
+        batch_history_tag=None
+    ):
+        self.gi = gi
+        self.history_tags = list(history_tags)
+        self.job_budget = job_budget
+        # used until a completed history with batch_history_tag is seen
+        self.default_jobs_per_batch = jobs_per_batch
+        self.max_batches = max_batches
+        self.window_days = window_days
+        self.batch_history_tag = batch_history_tag or self.history_tags[0]
+        self.last_estimate = {}
+
+    def _get_recent_histories(self, tag):
+        since = time.strftime(
+            '%Y-%m-%dT%H:%M:%S',
+            time.gmtime(time.time() - self.window_days * 86400)
+        )
+        return list_histories(
+            self.gi, {'tag': tag, 'update_time-gt': since},
+            keys=['id', 'state', 'state_details']
+        )
+
+    def estimate_load(self, unstarted_batches=0):
+        """Return the outstanding jobs and the estimated jobs per batch.
+
+        unstarted_batches is the number of admitted batches whose
+        histories do not exist yet.
+        """
+
+        outstanding = 0
+        batch_sizes = []
+        # datasets in batch histories that are still being worked on
+        batch_progress = []
+        seen = set()
+        for tag in self.history_tags:
+            for history in self._get_recent_histories(tag):
+                if history['id'] in seen:
+                    continue
+                seen.add(history['id'])
+                details = history.get('state_details') or {}
+                pending = sum(details.get(state, 0) for state in PENDING_STATES)
+                outstanding += pending
+                if tag != self.batch_history_tag:
+                    continue
+                total = sum(details.values())
+                if pending or not total:
+                    batch_progress.append(total)
+                else:
+                    batch_sizes.append(total)
+        if batch_sizes:
+            jobs_per_batch = statistics.median(batch_sizes)
+        else:
+            jobs_per_batch = self.default_jobs_per_batch
+        unscheduled = 0
+        if jobs_per_batch:
+            # jobs of started batches that Galaxy has not scheduled yet
+            unscheduled = sum(
+                max(0, jobs_per_batch - total) for total in batch_progress
+            ) + unstarted_batches * jobs_per_batch
+        self.last_estimate = {
+            'outstanding_jobs': outstanding + unscheduled,
+            'unscheduled_jobs': unscheduled,
+            'jobs_per_batch': jobs_per_batch,
+            'job_budget': self.job_budget,
+        }
+        return outstanding + unscheduled, jobs_per_batch
+
+    def admit(self, pending_batches, unstarted_batches=0):
+        """Return how many of the pending batches can be started now.
+
+        unstarted_batches is the number of batches admitted earlier whose
+        histories do not exist yet.
+        """
+
+        outstanding, jobs_per_batch = self.estimate_load(unstarted_batches)
+        free = self.job_budget - outstanding
+        if free <= 0:
+            return 0
+        if jobs_per_batch:
+            allowed = int(free // jobs_per_batch)
+        elif unstarted_batches:
+            return 0
+        else:
+            # nothing known about the cost of a batch yet => start slowly
+            allowed = 1
+        return max(0, min(allowed, self.max_batches, pending_batches))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'history_tags', nargs='+',
+        help='Tags of the histories whose outstanding jobs count towards '
+             'the job budget. Completed histories with the first tag are '
+             'used to estimate the number of jobs per batch.'
+    )
+    parser.add_argument(
+        '-b', '--job-budget', type=int, required=True,
+        help='Maximum number of outstanding jobs'
+    )
+    parser.add_argument(
+        '-j', '--jobs-per-batch', type=int,
+        help='Number of jobs per batch to assume if it cannot be estimated '
+             'from completed histories'
+    )
+    parser.add_argument(
+        '-m', '--max-batches', type=int, default=1,
+        help='Maximum number of batches to admit'
+    )
+    parser.add_argument(
+        '-p', '--pending', type=int,
+        help='Number of pending batches (default: assume enough)'
+    )
+    parser.add_argument(
+        '-u', '--unstarted', type=int, default=0,
+        help='Number of batches admitted before whose histories do not '
+             'exist yet, e.g. because their data is still being uploaded'
+    )
+    parser.add_argument(
+        '--window-days', type=float, default=7,
+        help='Only consider histories updated within this many days'
+    )
+    parser.add_argument(
+        '-g', '--galaxy-url', required=True,
+        help='URL of the Galaxy instance to run query against'
+    )
+    parser.add_argument(
+        '-a', '--api-key', required=True,
+        help='API key to use for authenticating on the Galaxy server'
+    )
+    args = parser.parse_args()
+
+    gi = get_galaxy_instance(args.galaxy_url, args.api_key)
+    controller = AdmissionController(
+        gi, args.history_tags, args.job_budget,
+        jobs_per_batch=args.jobs_per_batch,
+        max_batches=args.max_batches,
+        window_days=args.window_days
+    )
+    admitted = controller.admit(
+        args.max_batches if args.pending is None else args.pending,
+        args.unstarted
+    )
+    sys.stderr.write(
+        'Outstanding jobs: {outstanding_jobs} '
+        '(not scheduled yet: {unscheduled_jobs}); '
+        'estimated jobs per batch: {jobs_per_batch}; '
+        'job budget: {job_budget}\n'.format(**controller.last_estimate)
+    )
+    sys.stdout.write(f'{admitted}\n')
@@ -0,0 +1,311 @@
+"""
+Parse and validate the bot configuration stored in job yml templates.
+
+The "#key: value" lines of a template configure the bot using it, the
+complete template gets filled with information about the discovered
+histories, datasets and collections to become the job yml of a workflow
+run.
+
+Configurations are cached per template file and reparsed only if the file
+changes.
+"""
+
+import os
+import re
+import shlex
+import sys
+import threading
+
+from urllib.parse import urlparse
+
+from link_scheduler import POLICIES
+
+
+BOT_KINDS = ('variation', 'consensus', 'reporting', 'export')
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def _galaxy_id(value):
+    if not re.fullmatch(r'[0-9a-f]+', value):
+        raise ValueError('not a valid Galaxy ID')
+    return value
+
+
+def _url(value):
+    parsed = urlparse(value)
+    if parsed.scheme not in ('http', 'https') or not parsed.netloc:
+        raise ValueError('not a valid http(s) URL')
+    return value.rstrip('/')
+
+
+def _tag(value):
+    if re.search(r'\s', value):
+        raise ValueError('not a valid tag (tags cannot contain whitespace)')
+    return value
+
+
+def _regex(value):
+    try:
+        re.compile(value)
+    except re.error as e:
+        raise ValueError(
+            f'not a valid regular expression ({e}); special characters '
+            'like parentheses need to be escaped with a backslash'
+        )
+    return value
+
+
+def _proportion(value):
+    try:
+        proportion = float(value)
+    except ValueError:
+        raise ValueError('not a number')
+    if not 0 < proportion <= 1:
+        raise ValueError('needs to be between 0 and 1')
+    return proportion
+
+
+def _positive_int(value):
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValueError('not a whole number')
+    if number <= 0:
+        raise ValueError('needs to be greater than 0')
+    return number
+
+
+def _tags(value):
+    return value.split()
+
+
+def _schedule_policy(value):
+    if value not in POLICIES:
+        raise ValueError(
+            'not a scheduling policy; choose one of: ' + ', '.join(POLICIES)
+        )
+    return value
+
+
+FIELD_TYPES = {
+    'use_server': _url,
+    'use_workflow_id': _galaxy_id,
+    'pe_workflow_id': _galaxy_id,
+    'nested_pe_workflow_id': _galaxy_id,
+    'se_workflow_id': _galaxy_id,
+    'nested_se_workflow_id': _galaxy_id,
+    'history_for_downloads': _galaxy_id,
+    'new_history_tag': _tag,
+    'metadata_history_tag': _tag,
+    'bam_input_name': _regex,
+    'vcf_input_name': _regex,
+    'fasta_input_name': _regex,
+    'min_run_delta': _proportion,
+    'schedule_policy': _schedule_policy,
+    'job_budget': _positive_int,
+    'jobs_per_batch': _positive_int,
+    'max_batches_per_tick': _positive_int,
+    'max_parallel_downloads': _positive_int,
+    'load_history_tags': _tags,
+}
+
+REQUIRED_FIELDS = {
+    'variation': [
+        'use_server', 'new_history_base_name', 'new_history_tag',
+        'history_for_downloads', 'metadata_history_tag',
+        'metadata_collection_name', 'download_protocol', 'min_run_delta'
+    ],
+    'consensus': [
+        'use_server', 'use_workflow_id', 'new_history_name_suffix',
+        'new_history_tag', 'bam_input_name', 'vcf_input_name'
+    ],
+    'reporting': [
+        'use_server', 'use_workflow_id', 'new_history_name_suffix',
+        'new_history_tag', 'vcf_input_name'
+    ],
+    'export': [
+        'use_server', 'use_workflow_id', 'new_history_name_suffix',
+        'new_history_tag', 'bam_input_name', 'vcf_input_name',
+        'fasta_input_name'
+    ],
+}
+
+# the workflows the variation bot can choose from and the names of their
+# input collections
+VARIATION_WORKFLOWS = {
+    'pe_workflow_id': ['pe_collection_name'],
+    'nested_pe_workflow_id': [
+        'nested_pe_collection_name_fw', 'nested_pe_collection_name_rv'
+    ],
+    'se_workflow_id': ['se_collection_name'],
+    'nested_se_workflow_id': ['nested_se_collection_name'],
+}
+
+
+def parse_header(template):
+    """Return the "#key: value" lines of a template as a dict."""
+
+    header = {}
+    for line in template.splitlines():
+        m = re.fullmatch(r'#(\w+):(?: (.*))?', line)
+        if m:
+            header[m.group(1)] = (m.group(2) or '').strip()
+    return header
+
+
+def get_bot_kind(path):
+    """Determine the bot a template belongs to from its file name."""
+
+    kind = os.path.basename(path).split('-job', 1)[0]
+    if kind not in BOT_KINDS:
+        raise ConfigError(
+            f'Cannot determine the bot that {path} configures. Job yml '
+            'file names need to start with one of: ' + ', '.join(
+                f'{kind}-job' for kind in BOT_KINDS
+            )
+        )
+    return kind
+
+
+class BotConfig():
+    """The validated configuration and template of one bot.
+
+    Configuration values are available as attributes and through item
+    access. Values of empty fields are None.
+    """
+
+    def __init__(self, path, bot_kind=None):
+        self.path = path
+        self.bot_kind = bot_kind or get_bot_kind(path)
+        with open(path) as i:
+            self.template = i.read()
+        self.values = {}
+        errors = []
+        header = parse_header(self.template)
+        for key, value in header.items():
+            if not value:
+                self.values[key] = None
+            elif key in FIELD_TYPES:
+                try:
+                    self.values[key] = FIELD_TYPES[key](value)
+                except ValueError as e:
+                    errors.append(f'{key}: "{value}" is {e}')
+            else:
+                self.values[key] = value
+        for key in REQUIRED_FIELDS[self.bot_kind]:
+            if key not in header:
+                errors.append(f'{key}: missing')
+            elif not header[key]:
+                errors.append(f'{key}: no value')
+        if self.bot_kind == 'variation':
+            workflows = [
+                key for key in VARIATION_WORKFLOWS if self.values.get(key)
+            ]
+            if not workflows:
+                errors.append(
+                    'no workflow configured; set at least one of: ' +
+                    ', '.join(VARIATION_WORKFLOWS)
+                )
+            for key in workflows:
+                for name_key in VARIATION_WORKFLOWS[key]:
+                    if not self.values.get(name_key):
+                        errors.append(
+                            f'{name_key}: needs a value when {key} is set'
+                        )
+        if errors:
+            raise ConfigError(
+                f'Invalid {self.bot_kind} bot config in {path}:\n  ' +
+                '\n  '.join(errors)
+            )
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def __getattr__(self, key):
+        try:
+            return self.__dict__['values'][key]
+        except KeyError:
+            raise AttributeError(key)
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def render(self, **kwargs):
+        """Fill the template with the information passed as keywords.
+
+        These are typically the histories, and the datasets or collections,
+        discovered for the bot.
+        """
+
+        return self.template.format(**kwargs)
+
+    def to_shell(self):
+        """Return the configuration as shell variable assignments.
+
+        Variables are named like the configuration keys in upper case.
+        """
+
+        lines = []
+        for key, value in self.values.items():
+            if value is None:
+                value = ''
+            elif isinstance(value, list):
+                value = ' '.join(value)
+            lines.append(f'{key.upper()}={shlex.quote(str(value))}')
+        return '\n'.join(lines) + '\n'
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def load_config(path, bot_kind=None):
+    """Return the BotConfig for a template, reparsing it only if changed."""
+
+    mtime = os.stat(path).st_mtime_ns
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    config = BotConfig(path, bot_kind)
+    with _cache_lock:
+        _cache[path] = (mtime, config)
+    return config
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'job_yml', nargs='+',
+        help='Job yml template(s) to validate'
+    )
+    parser.add_argument(
+        '--bot', choices=BOT_KINDS,
+        help='Bot configured by the file(s) (default: determine from the '
+             'file name)'
+    )
+    parser.add_argument(
+        '--shell', action='store_true',
+        help='Print the configuration as shell variable assignments to be '
+             'eval-ed by the run_*.sh scripts'
+    )
+    args = parser.parse_args()
+
+    failed = False
+    for path in args.job_yml:
+        try:
+            config = BotConfig(path, args.bot)
+        except (ConfigError, OSError) as e:
+            sys.stderr.write(f'{e}\n')
+            failed = True
+            continue
+        if args.shell:
+            sys.stdout.write(config.to_shell())
+        else:
+            sys.stdout.write(f'{path}: OK\n')
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,267 @@
+"""
+Run the analysis bots continuously in a single long-running process.
+
+All bots configured for the same Galaxy server share one connection and one
+history listing, which a watcher thread refreshes every few seconds. Bots
+wake up as soon as a history gains their trigger tag, and otherwise run
+their tick at a fixed interval, like with the run_*.sh scripts and cron.
+
+With a handoff database, bots hand new histories over to downstream bots
+through it and wake them up right away, also in other processes using the
+same database. The history listing then only needs to be refreshed every
+few minutes to reconcile with the tags.
+"""
+
+import argparse
+import os
+import signal
+import threading
+
+from bot_config import ConfigError, load_config
+from bots import (
+    BOT_CLASSES, BotState, DownstreamBot, HistoryCache, load_bot
+)
+from galaxy_client import get_galaxy_instance
+from handoff_queue import HandoffQueue
+from instrumentation import configure
+
+
+def write_metrics(recorder):
+    try:
+        recorder.write_metrics()
+    except OSError as e:
+        print(f'Writing metrics failed: {e}', flush=True)
+
+
+def watch_histories(history_cache, poll_interval, stop_event, recorder):
+    while not stop_event.is_set():
+        try:
+            history_cache.refresh()
+        except Exception as e:
+            print(f'Refreshing the history listing failed: {e}', flush=True)
+        if recorder:
+            write_metrics(recorder)
+        stop_event.wait(poll_interval)
+
+
+def watch_handoffs(handoff_queue, bots, poll_interval, stop_event, recorder):
+    # wake up the bots for handoffs by bots of other processes
+    last_id = None
+    while not stop_event.wait(poll_interval):
+        # the history listing may be refreshed too rarely for this
+        write_metrics(recorder)
+        try:
+            new_id = handoff_queue.last_id()
+        except Exception as e:
+            print(f'Checking for new handoffs failed: {e}', flush=True)
+            continue
+        if new_id != last_id:
+            last_id = new_id
+            for bot in bots:
+                if bot.trigger_tag:
+                    bot.wake()
+
+
+def run_bot(bot, tick_interval, stop_event):
+    while not stop_event.is_set():
+        bot.wake_event.clear()
+        if bot.safe_tick() is not None and bot.retick_after_work:
+            # look for more work right away
+            continue
+        bot.wake_event.wait(bot.get_wait_time(tick_interval))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--job-yml-dir', default='job-yml-templates',
+        help='Folder with the configured job yml templates of the bots'
+    )
+    parser.add_argument(
+        '--bots', nargs='+', choices=list(BOT_CLASSES),
+        default=list(BOT_CLASSES),
+        help='Bots to run (default: all)'
+    )
+    parser.add_argument(
+        '--state-file', default='bot_state.json',
+        help='File to checkpoint the state of the bots to'
+    )
+    parser.add_argument(
+        '--poll-interval', type=float, default=10,
+        help='Seconds between checks for newly tagged histories: refreshes '
+             'of the history listing or, with --handoff-db, lookups in the '
+             'handoff database'
+    )
+    parser.add_argument(
+        '--handoff-db',
+        help='SQLite database through which bots hand new histories over to '
+             'downstream bots, in this and other bot processes using the '
+             'same file (default: hand over through tags only)'
+    )
+    parser.add_argument(
+        '--reconcile-interval', type=float, default=600,
+        help='With --handoff-db, seconds between refreshes of the history '
+             'listing, after which the bots look for tagged histories that '
+             'were not handed over through the database'
+    )
+    parser.add_argument(
+        '--tick-interval', type=float, default=300,
+        help='Maximum number of seconds a bot waits before looking for new '
+             'work again'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=4,
+        help='Maximum number of concurrent workflow runs per bot; should '
+             'not be lower than --max-claims'
+    )
+    parser.add_argument(
+        '--max-claims', type=int, default=4,
+        help='Maximum number of histories the consensus, reporting and '
+             'export bots claim per tick'
+    )
+    parser.add_argument(
+        '--lease-db',
+        help='SQLite database for deciding which bot gets to work on a '
+             'history or batch of links; all bot processes sharing the '
+             'same file, e.g. on a shared filesystem, can claim work without '
+             'waiting for concurrent claims (default: claim through tags '
+             'only)'
+    )
+    parser.add_argument(
+        '--lease-time', type=int, default=3600,
+        help='Seconds after which work claimed by a bot that stopped '
+             'unexpectedly can be claimed by other bots'
+    )
+    parser.add_argument(
+        '--claim-settle-time', type=float,
+        help='Without --lease-db, seconds to wait after claiming work before '
+             'checking for concurrent claims by other bots; needs to exceed '
+             'the time their Galaxy client may spend retrying a tag update '
+             '(default: that time for this daemon\'s client, about 11 '
+             'minutes)'
+    )
+    parser.add_argument(
+        '--trace-file',
+        help='File to append a JSON-lines trace of the stages of all bot '
+             'runs to (default: value of the BOT_TRACE_FILE environment '
+             'variable, if set)'
+    )
+    parser.add_argument(
+        '--metrics-file',
+        help='File to keep updated with metrics in the OpenMetrics text '
+             'format, including Galaxy API requests by endpoint'
+    )
+    parser.add_argument(
+        '--once', choices=list(BOT_CLASSES),
+        help='Run a single tick of the given bot, wait for the work it '
+             'started to finish, then exit'
+    )
+    parser.add_argument(
+        '-a', '--api-key', default=os.environ.get('API_KEY'),
+        help='API key to use for authenticating on the Galaxy servers '
+             '(default: value of the API_KEY environment variable)'
+    )
+    args = parser.parse_args()
+    if not args.api_key:
+        parser.error('No API key provided')
+
+    state = BotState(args.state_file)
+    recorder = configure(args.trace_file, args.metrics_file)
+    handoff_queue = HandoffQueue(args.handoff_db) if args.handoff_db else None
+    gis = {}
+    history_caches = {}
+    bots = []
+    bot_names = [args.once] if args.once else args.bots
+    for bot_name in bot_names:
+        config_path = os.path.join(
+            args.job_yml_dir, BOT_CLASSES[bot_name].template_name
+        )
+        if not os.path.exists(config_path):
+            print(f'No config found for {bot_name} bot at {config_path}')
+            continue
+        bot_class = BOT_CLASSES[bot_name]
+        try:
+            server = load_config(config_path, bot_name).use_server
+        except ConfigError as e:
+            # catch config errors before starting any bot
+            parser.exit(1, f'{e}\n')
+        if server not in gis:
+            # one connection per thread that may use it: the history
+            # watcher and every bot's tick and workflow runs
+            gis[server] = get_galaxy_instance(
+                server, args.api_key,
+                max_connections=1 + len(bot_names) * (args.workers + 1),
+                deduplicate=True
+            )
+            history_caches[server] = HistoryCache(gis[server])
+        bot_kwargs = {
+            'max_runs': args.workers,
+            'lease_db': args.lease_db,
+            'lease_time': args.lease_time,
+            'claim_settle_time': args.claim_settle_time,
+            'handoff_queue': handoff_queue,
+        }
+        if issubclass(bot_class, DownstreamBot):
+            bot_kwargs['max_claims'] = args.max_claims
+        bot = load_bot(
+            bot_name, gis[server], args.job_yml_dir, history_caches[server],
+            state, **bot_kwargs
+        )
+        history_caches[server].listeners.append(bot.on_history_change)
+        if handoff_queue:
+            handoff_queue.listeners.append(bot.on_handoff)
+        bots.append(bot)
+
+    if args.once:
+        for bot in bots:
+            bot.safe_tick()
+            bot.executor.shutdown(wait=True)
+        recorder.write_metrics()
+        raise SystemExit
+
+    stop_event = threading.Event()
+    if handoff_queue:
+        # metrics get written by the handoff watcher
+        listing_interval, listing_recorder = args.reconcile_interval, None
+    else:
+        listing_interval, listing_recorder = args.poll_interval, recorder
+    threads = [
+        threading.Thread(
+            target=watch_histories,
+            args=(
+                history_cache, listing_interval, stop_event, listing_recorder
+            ),
+            daemon=True
+        ) for history_cache in history_caches.values()
+    ] + [
+        threading.Thread(
+            target=run_bot, name=bot.name,
+            args=(bot, args.tick_interval, stop_event),
+            daemon=True
+        ) for bot in bots
+    ]
+    if handoff_queue:
+        threads.append(
+            threading.Thread(
+                target=watch_handoffs,
+                args=(
+                    handoff_queue, bots, args.poll_interval, stop_event,
+                    recorder
+                ),
+                daemon=True
+            )
+        )
+    # service managers stop the daemon with SIGTERM; treat it like Ctrl-C
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    for thread in threads:
+        thread.start()
+    try:
+        stop_event.wait()
+    except KeyboardInterrupt:
+        stop_event.set()
+    print('Stopping bots; waiting for active runs to finish ...')
+    for bot in bots:
+        bot.wake()
+        bot.executor.shutdown(wait=True)
+    state.save()
+    recorder.write_metrics()
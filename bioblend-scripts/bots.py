@@ -0,0 +1,832 @@
+"""
+The variation, consensus, reporting and export bots as Python objects.
+
+Each bot's tick does what one run of the corresponding run_*.sh script does,
+but all bots can share one Galaxy connection and one cached history listing
+instead of starting new Python processes and querying all histories for
+every step.
+"""
+
+import json
+import os
+import threading
+import time
+import traceback
+
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+
+import ftp_links_to_yaml
+from admission import AdmissionController
+from bot_config import ConfigError, load_config
+from check_history import history_is_complete
+from claims import get_lease_store
+from find_by_tags import filter_objects_by_tags
+from find_datasets import get_matching_datasets_from_histories
+from galaxy_client import list_histories
+from handoff_queue import HANDOFF_TIMEOUT
+from instrumentation import get_recorder
+from invoke_workflow import invoke_from_job
+from link_scheduler import (
+    collect_pending_batches,
+    format_metrics,
+    queue_metrics,
+    schedule_batches
+)
+from tag_history import update_dataset_tags, update_history_tags
+
+
+class HistoryCache():
+    """A shared listing of the histories of the user.
+
+    Refreshing the listing takes a single API request. Listeners get
+    notified about tags added to histories and about updated histories.
+    """
+
+    keys = ['id', 'name', 'tags', 'update_time']
+
+    def __init__(self, gi):
+        self.gi = gi
+        self.histories = {}
+        self.listeners = []
+        self._lock = threading.Lock()
+        self.last_refresh = None
+
+    def refresh(self):
+        with get_recorder().span('history_listing') as span:
+            listing = list_histories(self.gi, keys=self.keys)
+            span['histories'] = len(listing)
+        changes = []
+        with self._lock:
+            new_histories = {}
+            for history in listing:
+                old = self.histories.get(history['id'])
+                new_histories[history['id']] = history
+                if old is None:
+                    changes.append((history, set(history['tags'])))
+                elif old['update_time'] != history['update_time'] or (
+                    old['tags'] != history['tags']
+                ):
+                    changes.append(
+                        (history, set(history['tags']) - set(old['tags']))
+                    )
+            self.histories = new_histories
+            self.last_refresh = time.time()
+        for history, added_tags in changes:
+            for listener in self.listeners:
+                listener(history, added_tags)
+
+    def find(self, tags, exclude_tags=None):
+        """Return histories with all tags, most recently updated first."""
+
+        if self.last_refresh is None:
+            self.refresh()
+        with self._lock:
+            histories = sorted(
+                self.histories.values(),
+                key=lambda h: h['update_time'], reverse=True
+            )
+        return list(filter_objects_by_tags(tags, histories, exclude_tags=exclude_tags))
+
+    def set_tags(self, history_id, tags):
+        # keep the cache in sync with tag changes made by the bots
+        with self._lock:
+            if history_id in self.histories:
+                self.histories[history_id] = dict(
+                    self.histories[history_id], tags=list(tags)
+                )
+
+
+class BotState():
+    """Bot state kept in memory and checkpointed to a JSON file."""
+
+    def __init__(self, fname):
+        self.fname = fname
+        self._lock = threading.Lock()
+        self.data = {}
+        if fname and os.path.exists(fname):
+            with open(fname) as i:
+                self.data = json.load(i)
+            # runs that were active when the previous process stopped
+            # cannot be resumed, but should be visible for inspection
+            for bot_state in self.data.values():
+                bot_state.setdefault('interrupted', {}).update(
+                    bot_state.get('active', {})
+                )
+                bot_state['active'] = {}
+
+    def get(self, bot_name):
+        with self._lock:
+            return self.data.setdefault(bot_name, {'active': {}})
+
+    def update(self, bot_name, **values):
+        with self._lock:
+            self.data.setdefault(bot_name, {'active': {}}).update(values)
+        self.save()
+
+    def set_active(self, bot_name, key, info):
+        with self._lock:
+            bot_state = self.data.setdefault(bot_name, {'active': {}})
+            if info is None:
+                bot_state['active'].pop(key, None)
+            else:
+                bot_state['active'][key] = info
+        self.save()
+
+    def update_active(self, bot_name, key, **values):
+        with self._lock:
+            active = self.data.setdefault(bot_name, {'active': {}})['active']
+            if key in active:
+                active[key].update(values)
+        self.save()
+
+    def save(self):
+        if not self.fname:
+            return
+        with self._lock:
+            tmp = self.fname + '.tmp'
+            with open(tmp, 'w') as o:
+                json.dump(self.data, o, indent=2)
+            os.replace(tmp, self.fname)
+
+
+class Bot():
+    """Base class of all bots.
+
+    A bot's tick looks for data it can work on and, if it finds some, claims
+    it by changing tags and invokes its workflow on it.
+    """
+
+    name = None
+    # tag that makes the bot work on a history
+    trigger_tag = None
+    # whether to tick again right away after a tick that started work
+    retick_after_work = True
+
+    def __init__(
+        self, gi, config, history_cache, state, max_runs=4,
+        lease_db=None, lease_time=3600, claim_settle_time=None,
+        handoff_queue=None
+    ):
+        self.gi = gi
+        self.config = config
+        self.history_cache = history_cache
+        self.state = state
+        # optional HandoffQueue for handing new histories to downstream bots
+        self.handoff_queue = handoff_queue
+        self.recorder = get_recorder()
+        self.wake_event = threading.Event()
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_runs, thread_name_prefix=self.name
+        )
+        self.claim_prefix = f'{self.name}-bot-claim-'
+        self.leases = get_lease_store(
+            gi, self.claim_prefix, lease_db, duration=lease_time,
+            settle_time=claim_settle_time, on_update=self.on_tags_updated
+        )
+
+    def log(self, msg):
+        print(
+            '{0} [{1}] {2}'.format(
+                time.strftime('%Y-%m-%d %H:%M:%S'), self.name, msg
+            ),
+            flush=True
+        )
+
+    def wake(self):
+        self.wake_event.set()
+
+    def on_history_change(self, history, added_tags):
+        if self.trigger_tag and self.trigger_tag in added_tags:
+            self.wake()
+
+    def on_handoff(self, trigger_tag, history_id):
+        if self.trigger_tag and self.trigger_tag == trigger_tag:
+            self.wake()
+
+    def get_wait_time(self, tick_interval):
+        """Return the seconds to wait for the next tick unless woken."""
+
+        return tick_interval
+
+    def tick(self):
+        raise NotImplementedError
+
+    def safe_tick(self):
+        """Run one tick logging instead of raising errors."""
+
+        try:
+            # picks up changes to the config file without reparsing it
+            # on every tick
+            self.config = load_config(self.config.path, self.config.bot_kind)
+        except (ConfigError, OSError) as e:
+            self.log(f'Keeping the previous config: {e}')
+        try:
+            result = self.tick()
+        except Exception:
+            self.log('Tick failed:\n' + traceback.format_exc())
+            self.state.update(
+                self.name, last_tick=time.time(), last_result='error'
+            )
+            return None
+        self.state.update(
+            self.name, last_tick=time.time(), last_result=result
+        )
+        return result
+
+    def launch(self, key, func, *args):
+        """Run func in the background and track it as an active run."""
+
+        self.state.set_active(
+            self.name, key, {'started': time.time(), 'args': repr(args)}
+        )
+
+        def run():
+            try:
+                func(*args)
+            except Exception:
+                self.log(f'Run {key} failed:\n' + traceback.format_exc())
+            finally:
+                self.state.set_active(self.name, key, None)
+        return self.executor.submit(run)
+
+    def tag_history(self, history_id, add_tags=(), remove_tags=()):
+        tags = update_history_tags(self.gi, history_id, add_tags, remove_tags)
+        self.history_cache.set_tags(history_id, tags)
+
+    def hand_off(self, history_id, trigger_tags):
+        # tag a new history for downstream bots and, through the handoff
+        # queue, let them know right away
+        self.tag_history(history_id, trigger_tags)
+        if self.handoff_queue:
+            self.handoff_queue.publish(history_id, trigger_tags)
+
+    def on_tags_updated(self, resource, tags):
+        # tag changes made through the lease store
+        if not isinstance(resource, tuple):
+            self.history_cache.set_tags(resource, tags)
+
+    def run_workflow(self, workflow_id, job_yml, history_name, history_tag):
+        """Invoke a workflow in a new, tagged history.
+
+        Returns the new history's ID as soon as the workflow is invoked.
+        """
+
+        invocation = invoke_from_job(
+            self.gi, workflow_id, yaml.safe_load(job_yml),
+            history_name, [history_tag]
+        )
+        return invocation['history_id']
+
+
+class DownstreamBot(Bot):
+    """A bot working on histories that an upstream bot tagged for it.
+
+    Each tick claims up to max_claims histories and invokes the bot's
+    workflow on all of them concurrently.
+    With a handoff queue, the bot looks at the histories handed over to it
+    first and scans the history listing for tagged histories only once
+    after each refresh of the listing.
+    """
+
+    # config keys of the names of the input collections to look for
+    input_keys = []
+    # tags to put on the new history for the next bots
+    dest_bot_tags = []
+    template_name = None
+
+    def __init__(self, *args, max_claims=4, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_claims = max_claims
+        self.status_scheduling = f'{self.name}-bot-scheduling'
+        self.status_processing = f'{self.name}-bot-processing'
+        self.status_ok = f'{self.name}-bot-ok'
+        # the refresh time of the history listing last scanned completely
+        self.last_scanned_listing = None
+        # whether the last tick left handoffs in the queue
+        self.handoffs_left = False
+
+    def get_wait_time(self, tick_interval):
+        if self.handoffs_left:
+            # the workflow outputs that are the bot's inputs usually show up
+            # within seconds after the handoff, so check again soon
+            return min(tick_interval, 10)
+        return tick_interval
+
+    def match_inputs(self, history):
+        # Return the input collections of the bot found in the history.
+        input_names = [self.config[key] for key in self.input_keys]
+        for datasets in get_matching_datasets_from_histories(
+            self.gi, [history['id']], input_names,
+            visible=True, types=['dataset_collection'], max_matching=1
+        ):
+            return datasets
+        return None
+
+    def find_handed_over(self, max_matching):
+        # Return up to max_matching histories from the handoff queue that are
+        # still tagged for the bot and have all input collections, together
+        # with the matching collections.
+        candidates = []
+        done = []
+        self.handoffs_left = False
+        for handoff_id, history_id, created in self.handoff_queue.pending(
+            self.trigger_tag
+        ):
+            if len(candidates) >= max_matching:
+                self.handoffs_left = True
+                break
+            if history_id in [history['id'] for history, _ in candidates]:
+                done.append(handoff_id)
+                continue
+            history = self.gi.histories.show_history(history_id)
+            if self.trigger_tag in history['tags']:
+                datasets = self.match_inputs(history)
+                if datasets:
+                    candidates.append((history, datasets))
+                elif time.time() - created < HANDOFF_TIMEOUT:
+                    # keep the handoff for the next tick
+                    self.handoffs_left = True
+                    continue
+            # a history that is not claimed now will still be found by
+            # scanning the history listing
+            done.append(handoff_id)
+        self.handoff_queue.done(done)
+        return candidates
+
+    def find_inputs(self, max_matching):
+        # Return up to max_matching histories tagged for the bot that have
+        # all input collections, together with the matching collections.
+        candidates = []
+        if self.handoff_queue:
+            candidates = self.find_handed_over(max_matching)
+            if self.history_cache.last_refresh == self.last_scanned_listing:
+                # nothing new to reconcile with
+                return candidates
+        known = [history['id'] for history, _ in candidates]
+        histories = self.history_cache.find([self.trigger_tag])
+        listed_at = self.history_cache.last_refresh
+        for history in histories:
+            if len(candidates) >= max_matching:
+                return candidates
+            if history['id'] in known:
+                continue
+            datasets = self.match_inputs(history)
+            if datasets:
+                candidates.append((history, datasets))
+        self.last_scanned_listing = listed_at
+        return candidates
+
+    def claim(self, history_ids):
+        """Try to claim histories for processing by this bot.
+
+        The trigger tag of each history gets replaced with the scheduling
+        status tag and a lease tag, which stays on the history until the
+        bot is done with it.
+        Returns a dict of the leases on the successfully claimed histories.
+        """
+
+        return self.leases.acquire(
+            history_ids,
+            require_tags=[self.trigger_tag],
+            add_tags=[self.status_scheduling],
+            remove_tags=[self.trigger_tag]
+        )
+
+    def reclaim_expired(self):
+        # retrigger histories whose claiming bot stopped before invoking
+        # the workflow
+        for history in self.history_cache.find([self.status_scheduling]):
+            if self.leases.expired(history['tags']) and self.leases.reclaim(
+                history['id'], [self.trigger_tag], [self.status_scheduling]
+            ):
+                self.log(f'Reclaimed history {history["id"]}')
+
+    def tick(self):
+        self.reclaim_expired()
+        with self.recorder.span('discovery', bot=self.name) as span:
+            candidates = self.find_inputs(self.max_claims)
+            span['found'] = len(candidates)
+        if not candidates:
+            return None
+        with self.recorder.span('claim', bot=self.name) as span:
+            claimed = self.claim([history['id'] for history, _ in candidates])
+            span['sources'] = list(claimed)
+        for history, datasets in candidates:
+            if history['id'] not in claimed:
+                self.log(f'History {history["id"]} claimed by another run')
+                continue
+            # same history information as provided by find_datasets.py
+            history_info = self.gi.histories.show_history(history['id'])
+            job_yml = self.config.render(
+                histories=[history_info] * len(datasets),
+                datasets=datasets
+            )
+            self.log(f'Starting work on history {history["id"]}')
+            self.launch(
+                history['id'], self.process,
+                history_info, claimed[history['id']], job_yml
+            )
+        return list(claimed) or None
+
+    def process(self, source_history, lease, job_yml):
+        if not self.leases.confirm(lease):
+            self.log(
+                f'Lost the claim on history {source_history["id"]} '
+                'before invoking the workflow'
+            )
+            return
+        with self.recorder.span(
+            'invocation', bot=self.name, source=source_history['id']
+        ) as span:
+            dest_history_id = self.run_workflow(
+                self.config.use_workflow_id,
+                job_yml,
+                '{0} - {1}'.format(
+                    source_history['name'],
+                    self.config.new_history_name_suffix
+                ),
+                self.config.new_history_tag
+            )
+            span['dest'] = dest_history_id
+        # record the handoff of this run separately from all others
+        self.state.update_active(
+            self.name, source_history['id'], dest_history_id=dest_history_id
+        )
+        self.tag_history(
+            source_history['id'],
+            [self.status_processing], [self.status_scheduling]
+        )
+        with self.recorder.span(
+            'handoff', bot=self.name, source=source_history['id'],
+            dest=dest_history_id, tags=self.dest_bot_tags
+        ):
+            if self.dest_bot_tags:
+                # inform downstream bots
+                self.hand_off(dest_history_id, self.dest_bot_tags)
+            self.leases.release(
+                lease,
+                [self.status_ok],
+                [self.status_processing, self.status_scheduling]
+            )
+        self.log(
+            'Workflow invoked on history {0}; new history: {1}'
+            .format(source_history['id'], dest_history_id)
+        )
+
+
+class ConsensusBot(DownstreamBot):
+    name = 'consensus'
+    trigger_tag = 'bot-go-consensus'
+    input_keys = ['bam_input_name', 'vcf_input_name']
+    dest_bot_tags = ['bot-go-export']
+    template_name = 'consensus-job.yml'
+
+
+class ReportingBot(DownstreamBot):
+    # status tags of this bot are named "report-bot-*"
+    name = 'report'
+    trigger_tag = 'bot-go-report'
+    input_keys = ['vcf_input_name']
+    template_name = 'reporting-job.yml'
+
+
+class ExportBot(DownstreamBot):
+    name = 'export'
+    trigger_tag = 'bot-go-export'
+    input_keys = ['bam_input_name', 'vcf_input_name', 'fasta_input_name']
+    template_name = 'export-job.yml'
+
+
+class VariationBot(Bot):
+    """The bot uploading data from link files and starting its analysis."""
+
+    name = 'variation'
+    template_name = 'variation-job.yml'
+    signal_downloading = 'bot-downloading'
+    signal_processing = 'bot-processing'
+    signal_processed = 'bot-processed'
+    signal_failed = 'bot-failed'
+    dest_bot_tags = ['bot-go-report', 'bot-go-consensus']
+    input_collection = 'Input Collection'
+    # the load of started batches shows up on the server only gradually
+    retick_after_work = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # links datasets of the batches this bot is uploading or invoking the
+        # workflow on in the background
+        self.starting = set()
+        self._starting_lock = threading.Lock()
+
+    def on_history_change(self, history, added_tags):
+        # new link batches may have been added to any metadata history
+        if self.config.metadata_history_tag in history['tags']:
+            self.wake()
+
+    def find_links_collections(self):
+        history_ids = [
+            h['id'] for h in self.history_cache.find(
+                [self.config.metadata_history_tag]
+            )
+        ]
+        return (
+            collection
+            for datasets in get_matching_datasets_from_histories(
+                self.gi, history_ids,
+                [self.config.metadata_collection_name],
+                visible=True, types=['dataset_collection']
+            )
+            for collection in datasets
+        )
+
+    def previous_history_ready(self):
+        # not using the history cache, which may not know about the history
+        # created by the last run yet
+        previous = list_histories(
+            self.gi, {'tag': self.config.new_history_tag}
+        )
+        if not previous:
+            return True
+        try:
+            return history_is_complete(
+                self.gi, previous[0]['id'],
+                self.config.min_run_delta, None, verbose=False
+            )
+        except ZeroDivisionError:
+            # the previous history does not have any content yet
+            return False
+
+    def get_admission_controller(self):
+        return AdmissionController(
+            self.gi,
+            [self.config.new_history_tag] + [
+                tag for tag in self.config.get('load_history_tags') or []
+                if tag != self.config.new_history_tag
+            ],
+            self.config.job_budget,
+            jobs_per_batch=self.config.get('jobs_per_batch'),
+            max_batches=self.config.get('max_batches_per_tick') or 1
+        )
+
+    def count_downloads(self, collections):
+        # Count the batches being downloaded by any variation bot, including
+        # the ones this bot started but has not claimed yet, and make batches
+        # whose bot stopped renewing its lease pending again.
+        with self._starting_lock:
+            downloads = set(self.starting)
+        for batch in collect_pending_batches(
+            self.gi, collections, [self.signal_downloading]
+        ):
+            tags = batch['collection']['elements'][0]['object']['tags']
+            if self.leases.expired(tags):
+                # unless another bot was faster
+                if self.leases.reclaim(
+                    (batch['history_id'], batch['dataset_id']),
+                    remove_tags=[self.signal_downloading]
+                ):
+                    self.log(
+                        'Reclaimed links dataset {0} from a stopped download'
+                        .format(batch['dataset_id'])
+                    )
+                continue
+            downloads.add(batch['dataset_id'])
+        return len(downloads)
+
+    def tick(self):
+        collections = list(self.find_links_collections())
+        max_downloads = self.config.get('max_parallel_downloads') or 1
+        downloads = self.count_downloads(collections)
+        if downloads >= max_downloads:
+            self.log('Other runs are still downloading data')
+            return None
+        use_admission = bool(self.config.get('job_budget'))
+        if not use_admission and not self.previous_history_ready():
+            return None
+        with self.recorder.span('discovery', bot=self.name) as span:
+            with self._starting_lock:
+                starting = set(self.starting)
+            batches = [
+                batch for batch in collect_pending_batches(
+                    self.gi, collections
+                ) if batch['dataset_id'] not in starting
+            ]
+            span['found'] = len(batches)
+        metrics = queue_metrics(batches)
+        self.state.update(self.name, **metrics)
+        for key, value in metrics.items():
+            self.recorder.set_gauge(key, value, bot=self.name)
+        if not batches:
+            return None
+        self.log(format_metrics(metrics))
+        if use_admission:
+            # start as many batches as the server load allows
+            admission = self.get_admission_controller()
+            # batches being downloaded have no history yet
+            to_start = admission.admit(len(batches), downloads)
+            self.state.update(self.name, **admission.last_estimate)
+            for key, value in admission.last_estimate.items():
+                self.recorder.set_gauge(key, value, bot=self.name)
+            self.log(
+                'Outstanding jobs: {outstanding_jobs} (not scheduled yet: '
+                '{unscheduled_jobs}); estimated jobs per batch: '
+                '{jobs_per_batch}; job budget: {job_budget}'
+                .format(**admission.last_estimate)
+            )
+            if not to_start:
+                return None
+        else:
+            to_start = 1
+        # the batches get uploaded concurrently
+        to_start = min(to_start, max_downloads - downloads)
+        started = []
+        for batch in schedule_batches(
+            batches, self.config.get('schedule_policy') or 'fifo'
+        )[:to_start]:
+            with self._starting_lock:
+                self.starting.add(batch['dataset_id'])
+            self.launch(batch['dataset_id'], self.run_batch, batch)
+            started.append(batch['dataset_id'])
+        return started or None
+
+    def run_batch(self, batch):
+        try:
+            self.start_batch(batch)
+        finally:
+            with self._starting_lock:
+                self.starting.discard(batch['dataset_id'])
+
+    def start_batch(self, batch):
+        """Upload the data of a batch and invoke the workflow on it.
+
+        Returns False if another bot claimed the batch first.
+        """
+
+        collection = batch['collection']
+        element = collection['elements'][0]
+        source_history_id = collection['history_id']
+        links_dataset_id = element['object']['id']
+        history_info = self.gi.histories.show_history(source_history_id)
+        job_yml = self.config.render(
+            histories=[history_info], collections=[collection]
+        )
+        resource = (source_history_id, links_dataset_id)
+        with self.recorder.span(
+            'claim', bot=self.name, links=links_dataset_id
+        ) as span:
+            lease = self.leases.acquire(
+                [resource],
+                exclude_tags=[
+                    self.signal_downloading, self.signal_processing,
+                    self.signal_processed, self.signal_failed
+                ],
+                add_tags=[self.signal_downloading]
+            ).get(resource)
+            span['claimed'] = lease is not None
+        if lease is None:
+            self.log(
+                f'Links dataset {links_dataset_id} claimed by another run'
+            )
+            return False
+        self.log(
+            'Going to work on links in dataset {0} of history {1}'
+            .format(links_dataset_id, source_history_id)
+        )
+        # the start of the batch's end-to-end latency
+        self.recorder.event(
+            'batch_queued', batch['uploaded'], bot=self.name,
+            batch=batch['name'], links=links_dataset_id
+        )
+        try:
+            # the upload can take longer than a lease lasts
+            with self.leases.keep_alive(lease), self.recorder.span(
+                'upload', bot=self.name, batch=batch['name'],
+                links=links_dataset_id, links_size=batch['size']
+            ):
+                workflow_id, job_yml = self.add_input_data(
+                    links_dataset_id, job_yml
+                )
+        except Exception:
+            self.leases.release(
+                lease, [self.signal_failed], [self.signal_downloading]
+            )
+            raise
+        self.log('Data upload complete!')
+        if not self.leases.confirm(lease):
+            self.log(
+                f'Lost the claim on links dataset {links_dataset_id} '
+                'before invoking the workflow'
+            )
+            return False
+        self.leases.release(
+            lease, [self.signal_processing], [self.signal_downloading]
+        )
+        # Invoke the workflow right away so that the next tick can check
+        # the progress in the new history.
+        self.process(
+            source_history_id, links_dataset_id,
+            element['element_identifier'], workflow_id, job_yml
+        )
+        return True
+
+    def add_input_data(self, links_dataset_id, job_yml):
+        # Upload the linked data and add the input collection to the job
+        # yml, named as expected by the workflow that will analyze it.
+        # Returns the ID of that workflow and the completed job yml.
+        data_specs = self.gi.datasets.download_dataset(
+            links_dataset_id
+        ).decode('utf-8').splitlines()[1:]
+        links = ftp_links_to_yaml.LinkCollection(
+            data_specs, default_protocol=self.config.download_protocol
+        )
+        uploads = ftp_links_to_yaml.UploadManager(
+            links, self.gi, self.config.history_for_downloads, 20, 60
+        )
+        input_yml = ftp_links_to_yaml.records_to_yaml(
+            ftp_links_to_yaml.parse_fastq_links(links, uploads.upload_all()),
+            self.input_collection
+        )
+        if 'list:paired' in input_yml:
+            workflow_id = self.config.pe_workflow_id
+            replacements = {
+                self.input_collection: self.config.pe_collection_name
+            }
+        elif input_yml.count('list:list') == 2:
+            workflow_id = self.config.nested_pe_workflow_id
+            replacements = {
+                self.input_collection + '_fw':
+                    self.config.nested_pe_collection_name_fw,
+                self.input_collection + '_rv':
+                    self.config.nested_pe_collection_name_rv
+            }
+        elif input_yml.count('list:list') == 1:
+            workflow_id = self.config.nested_se_workflow_id
+            replacements = {
+                self.input_collection:
+                    self.config.nested_se_collection_name
+            }
+        else:
+            workflow_id = self.config.se_workflow_id
+            replacements = {
+                self.input_collection: self.config.se_collection_name
+            }
+        if not workflow_id:
+            raise ValueError(
+                'The variation bot config has no workflow for data like in '
+                f'links dataset {links_dataset_id}'
+            )
+        for old, new in replacements.items():
+            input_yml = input_yml.replace(old + ':', new + ':', 1)
+        return workflow_id, job_yml + '\n' + input_yml
+
+    def process(
+        self, source_history_id, links_dataset_id, batch_name,
+        workflow_id, job_yml
+    ):
+        with self.recorder.span(
+            'invocation', bot=self.name, batch=batch_name,
+            links=links_dataset_id
+        ) as span:
+            dest_history_id = self.run_workflow(
+                workflow_id,
+                job_yml,
+                '{0} {1}'.format(
+                    self.config.new_history_base_name, batch_name
+                ),
+                self.config.new_history_tag
+            )
+            span['dest'] = dest_history_id
+        with self.recorder.span(
+            'handoff', bot=self.name, batch=batch_name,
+            links=links_dataset_id, dest=dest_history_id,
+            tags=self.dest_bot_tags
+        ):
+            self.hand_off(dest_history_id, self.dest_bot_tags)
+            update_dataset_tags(
+                self.gi, source_history_id, links_dataset_id,
+                [self.signal_processed],
+                [self.signal_downloading, self.signal_processing]
+            )
+        self.log(
+            'Workflow invoked on links {0}; new history: {1}'
+            .format(links_dataset_id, dest_history_id)
+        )
+
+
+BOT_CLASSES = {
+    'variation': VariationBot,
+    'consensus': ConsensusBot,
+    'reporting': ReportingBot,
+    'export': ExportBot,
+}
+
+
+def load_bot(bot_name, gi, job_yml_dir, history_cache, state, **kwargs):
+    """Instantiate a bot with its config and template from job_yml_dir."""
+
+    bot_class = BOT_CLASSES[bot_name]
+    config = load_config(
+        os.path.join(job_yml_dir, bot_class.template_name), bot_name
+    )
+    return bot_class(gi, config, history_cache, state, **kwargs)
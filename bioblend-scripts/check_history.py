@@ -1,6 +1,6 @@
 import sys
 
-from bioblend import galaxy
+from galaxy_client import get_galaxy_instance
 
 
 TERMINAL_STATES = {
@@ -8,7 +8,9 @@ TERMINAL_STATES = {
 }
 
 
-def check_history(gi, history_id, proportion_terminal_required, ds_required):
+def history_is_complete(
+    gi, history_id, proportion_terminal_required, ds_required, verbose=True
+):
     # Get an approximation of the progress within a history.
     # Counts datasets and datasets in terminal states.
     # For collections, counts total jobs and jobs in terminal states.
@@ -34,15 +36,24 @@ def check_history(gi, history_id, proportion_terminal_required, ds_required):
             if state in item['job_state_summary']
         )
     proportion_terminal = terminal_datasets / total_datasets
-    sys.stdout.write(f'Proportion terminal: {proportion_terminal}\n')
+    if verbose:
+        sys.stdout.write(f'Proportion terminal: {proportion_terminal}\n')
     if proportion_terminal >= proportion_terminal_required:
         if not ds_required or any(
             items['name'] == ds_required for items in datasets
         ) or any(
             items['name'] == ds_required for items in collections
         ):
-            sys.stdout.write('Previous history complete!\n')
-            sys.exit(0)
+            return True
+    return False
+
+
+def check_history(gi, history_id, proportion_terminal_required, ds_required):
+    if history_is_complete(
+        gi, history_id, proportion_terminal_required, ds_required
+    ):
+        sys.stdout.write('Previous history complete!\n')
+        sys.exit(0)
     sys.stdout.write('Previous history not complete yet...\n')
     sys.exit(1)
 
@@ -80,7 +91,7 @@ if __name__ == '__main__':
         else:
             args.proportion_terminal = 0.0
 
-    gi = galaxy.GalaxyInstance(args.galaxy_url, args.api_key)
+    gi = get_galaxy_instance(args.galaxy_url, args.api_key)
     check_history(
         gi,
         args.history_id,
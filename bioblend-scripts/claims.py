@@ -0,0 +1,356 @@
+"""
+Claim histories and datasets for exclusive processing with expiring leases.
+
+A lease is a tag of the form "<prefix><nonce>-<expiry>" on the claimed
+history or dataset, where expiry is a Unix timestamp. Leases that have
+expired, because the bot holding them stopped or hung, can be reclaimed by
+any bot.
+
+Galaxy cannot update tags conditionally, so by default concurrent claims
+get resolved by adding the lease tag, waiting for concurrent claims to show
+up and verifying that the lowest live lease tag is our own. Since the tag
+updates of other bots can be retried by their Galaxy client, the wait has
+to last as long as those retries may take. Bots that share
+a filesystem can use a SQLite database instead to decide atomically which
+of them gets a lease.
+Bots on different machines rely on their clocks being roughly in sync to
+agree on when a lease expires.
+"""
+
+import contextlib
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+from galaxy_client import get_retry_window, unshared_requests
+from tag_history import update_dataset_tags, update_history_tags
+
+
+class Lease():
+    """A lease on a history ID or a (history ID, dataset ID) tuple."""
+
+    def __init__(self, resource, prefix, nonce, expires, tag=None):
+        self.resource = resource
+        self.nonce = nonce
+        self.expires = expires
+        self.tag = tag or f'{prefix}{nonce}-{expires}'
+
+    def live(self, now=None):
+        return self.expires > (time.time() if now is None else now)
+
+
+class TagLeases():
+    """Leases kept in tags and claimed by verifying tag updates."""
+
+    def __init__(
+        self, gi, prefix, duration=3600, settle_time=None, on_update=None
+    ):
+        self.gi = gi
+        self.prefix = prefix
+        self.duration = duration
+        # seconds to wait for concurrent tag updates before verifying a
+        # claim; by default as long as gi may take to update tags
+        if settle_time is None:
+            settle_time = get_retry_window(gi, 'PUT', '/api/histories/{id}')
+        self.settle_time = settle_time
+        # called with the resource and its new tags after every tag update
+        self.on_update = on_update
+
+    def _get_tags(self, resource):
+        if isinstance(resource, tuple):
+            return self.gi.histories.show_dataset(*resource)['tags']
+        return self.gi.histories.show_history(resource)['tags']
+
+    def _update_tags(self, resource, add_tags=(), remove_tags=()):
+        if isinstance(resource, tuple):
+            tags = update_dataset_tags(
+                self.gi, *resource, add_tags, remove_tags
+            )
+        else:
+            tags = update_history_tags(
+                self.gi, resource, add_tags, remove_tags
+            )
+        if self.on_update:
+            self.on_update(resource, tags)
+        return tags
+
+    def parse(self, resource, tags):
+        """Return the leases found in the tags of a resource."""
+
+        leases = []
+        for tag in tags:
+            if not tag.startswith(self.prefix):
+                continue
+            nonce, _, expires = tag[len(self.prefix):].rpartition('-')
+            if not (nonce and expires.isdigit()):
+                # treat malformed claim tags as expired, so they do not
+                # block the resource forever
+                nonce, expires = tag[len(self.prefix):], 0
+            leases.append(
+                Lease(resource, self.prefix, nonce, int(expires), tag)
+            )
+        return leases
+
+    def expired(self, tags):
+        """Check if tags carry leases that have all expired."""
+
+        leases = self.parse(None, tags)
+        return bool(leases) and not any(lease.live() for lease in leases)
+
+    def held(self, tags):
+        """Check if tags carry a live lease."""
+
+        return any(lease.live() for lease in self.parse(None, tags))
+
+    def _new_lease(self, resource):
+        return Lease(
+            resource, self.prefix, uuid.uuid4().hex[:12],
+            int(time.time() + self.duration)
+        )
+
+    def _reserve(self, lease):
+        # the lease gets decided on by verifying the tags
+        return True
+
+    def holds(self, lease, tags):
+        """Check if lease is the live lease with the lowest nonce in tags."""
+
+        live = sorted(
+            (
+                other for other in self.parse(lease.resource, tags)
+                if other.live()
+            ),
+            key=lambda other: other.nonce
+        )
+        return bool(live) and live[0].tag == lease.tag
+
+    def _check(self, pending):
+        acquired = {}
+        # a response to a request sent before our tag update is useless
+        with unshared_requests(self.gi):
+            for resource, lease in pending.items():
+                tags = self._get_tags(resource)
+                if self.holds(lease, tags):
+                    acquired[resource] = lease
+                elif lease.tag in tags:
+                    self._update_tags(resource, remove_tags=[lease.tag])
+        return acquired
+
+    def _verify(self, pending):
+        if not pending:
+            return {}
+        time.sleep(self.settle_time)
+        return self._check(pending)
+
+    def confirm(self, lease):
+        """Check that a lease is still held, e.g. right before starting
+        work that must not be done twice.
+
+        The tag of a lost lease gets removed.
+        """
+
+        return lease.resource in self._check({lease.resource: lease})
+
+    def acquire(
+        self, resources, require_tags=(), exclude_tags=(),
+        add_tags=(), remove_tags=()
+    ):
+        """Try to acquire leases on resources.
+
+        Resources that lack any of require_tags, carry any of exclude_tags
+        or are leased already are skipped. The tags of the others get
+        updated together with adding the lease tag; expired leases get
+        replaced.
+        Returns a dict of the leases acquired successfully by resource.
+        """
+
+        pending = {}
+        for resource in resources:
+            tags = self._get_tags(resource)
+            if not set(require_tags).issubset(tags):
+                continue
+            if set(exclude_tags).intersection(tags):
+                continue
+            leases = self.parse(resource, tags)
+            if any(lease.live() for lease in leases):
+                continue
+            lease = self._new_lease(resource)
+            if not self._reserve(lease):
+                continue
+            self._update_tags(
+                resource,
+                [lease.tag] + list(add_tags),
+                list(remove_tags) + [old.tag for old in leases]
+            )
+            pending[resource] = lease
+        return self._verify(pending)
+
+    def _extend(self, lease, new_lease):
+        return True
+
+    def renew(self, lease):
+        """Extend a lease; returns False if the lease has been lost."""
+
+        if lease.tag not in self._get_tags(lease.resource):
+            return False
+        new_lease = Lease(
+            lease.resource, self.prefix, lease.nonce,
+            int(time.time() + self.duration)
+        )
+        if new_lease.tag == lease.tag:
+            return True
+        if not self._extend(lease, new_lease):
+            return False
+        self._update_tags(lease.resource, [new_lease.tag], [lease.tag])
+        lease.expires, lease.tag = new_lease.expires, new_lease.tag
+        return True
+
+    @contextlib.contextmanager
+    def keep_alive(self, lease):
+        """Renew a lease in the background for the duration of the block.
+
+        The tags of the leased resource should not be changed from within
+        the block.
+        """
+
+        stop = threading.Event()
+
+        def renew():
+            while not stop.wait(self.duration / 3):
+                try:
+                    if not self.renew(lease):
+                        sys.stderr.write(
+                            f'Lost the lease on {lease.resource}\n'
+                        )
+                        return
+                except Exception as e:
+                    # try again before the lease expires
+                    sys.stderr.write(
+                        f'Renewing the lease on {lease.resource} failed: '
+                        f'{e}\n'
+                    )
+
+        renewer = threading.Thread(target=renew, daemon=True)
+        renewer.start()
+        try:
+            yield lease
+        finally:
+            stop.set()
+            renewer.join()
+
+    def _forget(self, resource, tags):
+        pass
+
+    def release(self, lease, add_tags=(), remove_tags=()):
+        """Remove the lease tag while updating the resource's tags."""
+
+        self._forget(lease.resource, [lease.tag])
+        return self._update_tags(
+            lease.resource, add_tags, list(remove_tags) + [lease.tag]
+        )
+
+    def reclaim(self, resource, add_tags=(), remove_tags=()):
+        """Remove the leases from a resource if all of them have expired.
+
+        The tags of the resource get updated together with removing the
+        leases, typically to make it available for processing again.
+        Returns True if the resource got reclaimed.
+        """
+
+        leases = self.parse(resource, self._get_tags(resource))
+        if not leases or any(lease.live() for lease in leases):
+            return False
+        old_tags = [lease.tag for lease in leases]
+        self._forget(resource, old_tags)
+        self._update_tags(
+            resource, add_tags, list(remove_tags) + old_tags
+        )
+        return True
+
+
+class SqliteLeases(TagLeases):
+    """Leases decided on through a SQLite database shared by the bots.
+
+    The lease tags are kept on the resources as with TagLeases, but no
+    waiting for concurrent claims is needed.
+    """
+
+    def __init__(self, gi, prefix, db_path, **kwargs):
+        super().__init__(gi, prefix, **kwargs)
+        self.db_path = db_path
+        with self._connect() as db:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS leases ('
+                'resource TEXT PRIMARY KEY, tag TEXT NOT NULL, '
+                'expires INTEGER NOT NULL)'
+            )
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # commits the transaction at the end of the block
+        with contextlib.closing(
+            sqlite3.connect(self.db_path, timeout=30)
+        ) as db:
+            with db:
+                yield db
+
+    def _key(self, resource):
+        if isinstance(resource, tuple):
+            resource = '/'.join(resource)
+        return self.prefix + resource
+
+    def _reserve(self, lease):
+        with self._connect() as db:
+            db.execute(
+                'DELETE FROM leases WHERE resource = ? AND expires <= ?',
+                (self._key(lease.resource), time.time())
+            )
+            inserted = db.execute(
+                'INSERT OR IGNORE INTO leases VALUES (?, ?, ?)',
+                (self._key(lease.resource), lease.tag, lease.expires)
+            ).rowcount
+        return inserted == 1
+
+    def _verify(self, pending):
+        return pending
+
+    def _check(self, pending):
+        with self._connect() as db:
+            return {
+                resource: lease for resource, lease in pending.items()
+                if db.execute(
+                    'SELECT 1 FROM leases '
+                    'WHERE resource = ? AND tag = ? AND expires > ?',
+                    (self._key(resource), lease.tag, time.time())
+                ).fetchone()
+            }
+
+    def _extend(self, lease, new_lease):
+        with self._connect() as db:
+            updated = db.execute(
+                'UPDATE leases SET tag = ?, expires = ? '
+                'WHERE resource = ? AND tag = ?',
+                (
+                    new_lease.tag, new_lease.expires,
+                    self._key(lease.resource), lease.tag
+                )
+            ).rowcount
+        return updated == 1
+
+    def _forget(self, resource, tags):
+        with self._connect() as db:
+            db.executemany(
+                'DELETE FROM leases WHERE resource = ? AND tag = ?',
+                [(self._key(resource), tag) for tag in tags]
+            )
+
+
+def get_lease_store(gi, prefix, db_path=None, **kwargs):
+    """Return a SQLite-backed lease store if db_path is given, else a
+    tag-based one."""
+
+    if db_path:
+        return SqliteLeases(gi, prefix, db_path, **kwargs)
+    return TagLeases(gi, prefix, **kwargs)
@@ -0,0 +1,188 @@
+"""
+Verify the availability of datasets on a Galaxy server by downloading them.
+
+Downloads run concurrently, interrupted downloads get resumed, and
+successfully verified datasets are recorded in a manifest inside the
+download directory, so that repeated checks only need to handle new data.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bioblend import ConnectionError
+
+
+class DataAvailabilityChecker():
+    """Check that datasets can be downloaded from a Galaxy instance.
+
+    gi needs to be created with galaxy_client.get_galaxy_instance, whose
+    pooled session is used for the downloads, too.
+    """
+
+    manifest_name = 'verified_downloads.jsonl'
+    # size of the blocks to stream downloads in
+    chunk_size = 1024 * 1024
+
+    def __init__(self, gi, download_dir, workers=4):
+        self.gi = gi
+        self.download_dir = download_dir
+        self.workers = workers
+        self.manifest = os.path.join(download_dir, self.manifest_name)
+        self.verified = {}
+        if os.path.exists(self.manifest):
+            with open(self.manifest) as i:
+                for line in i:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # last line may be truncated if an earlier run
+                        # got killed while writing it
+                        continue
+                    self.verified[entry['key']] = entry
+        self._manifest_lock = threading.Lock()
+
+    def is_verified(self, key, dataset_id):
+        """Check if a dataset has been verified for a record before.
+
+        The file downloaded for the record must still exist.
+        """
+
+        entry = self.verified.get(key)
+        return entry is not None and entry['dataset_id'] == dataset_id and (
+            os.path.exists(os.path.join(self.download_dir, entry['file']))
+        )
+
+    def check(self, downloads):
+        """Download and verify datasets concurrently.
+
+        `downloads` is an iterable of (key, dataset_id, file_name) tuples,
+        where key identifies the record the dataset belongs to. The tuples
+        can carry the dataset's info as returned by show_dataset() as a
+        fourth element if it has been retrieved before.
+
+        Returns a set of the keys of all verified records and a dictionary
+        mapping keys of records that could not be verified to the reason of
+        the failure.
+
+        Raises the first ConnectionError encountered after all other
+        downloads have been handled.
+        """
+
+        verified = set()
+        failed = {}
+        pending = []
+        for download in downloads:
+            key, dataset_id = download[:2]
+            if self.is_verified(key, dataset_id):
+                verified.add(key)
+            else:
+                pending.append(download)
+        connection_error = None
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {
+                executor.submit(self._verify, *download): download[0]
+                for download in pending
+            }
+            for n, (future, key) in enumerate(futures.items(), 1):
+                try:
+                    problem = future.result()
+                except (ConnectionError, requests.RequestException) as e:
+                    problem = 'Connection problem: {0}'.format(e)
+                    if connection_error is None:
+                        connection_error = e
+                if problem:
+                    failed[key] = problem
+                else:
+                    verified.add(key)
+                if n % 100 == 0 or n == len(futures):
+                    print(
+                        'Checked {0} of {1} new downloads ({2} failed)'
+                        .format(n, len(futures), len(failed))
+                    )
+        if connection_error is not None:
+            raise connection_error
+        return verified, failed
+
+    def _verify(self, key, dataset_id, file_name, dataset_info=None):
+        # Returns None if the dataset could be verified, or a description
+        # of the problem otherwise.
+        if dataset_info is None:
+            dataset_info = self.gi.datasets.show_dataset(dataset_id)
+        if dataset_info['state'] != 'ok':
+            return 'Dataset is in state "{0}"'.format(dataset_info['state'])
+        expected_size = dataset_info.get('file_size')
+        expected_hash = None
+        for h in dataset_info.get('hashes') or []:
+            if h['hash_function'].lower().replace('-', '') in (
+                'md5', 'sha1', 'sha256', 'sha512'
+            ):
+                expected_hash = h
+                break
+
+        path = os.path.join(self.download_dir, file_name)
+        if not self._matches(path, expected_size, expected_hash):
+            self._download(dataset_id, dataset_info['file_ext'], path)
+            if not self._matches(path, expected_size, expected_hash):
+                os.remove(path)
+                return 'Downloaded file does not match size or hash'
+        self._record(key, dataset_id, file_name)
+
+    def _matches(self, path, expected_size, expected_hash):
+        if not os.path.exists(path):
+            return False
+        if expected_size is not None and (
+            os.path.getsize(path) != expected_size
+        ):
+            return False
+        if expected_hash:
+            hasher = hashlib.new(
+                expected_hash['hash_function'].lower().replace('-', '')
+            )
+            with open(path, 'rb') as i:
+                for block in iter(lambda: i.read(self.chunk_size), b''):
+                    hasher.update(block)
+            if hasher.hexdigest() != expected_hash['hash_value']:
+                return False
+        return True
+
+    def _download(self, dataset_id, file_ext, path):
+        # Download to a temporary file, resuming a previous partial
+        # download if one exists and the server supports range requests.
+        part_path = path + '.part'
+        headers = dict(self.gi.json_headers)
+        if os.path.exists(part_path):
+            headers['Range'] = 'bytes={0}-'.format(os.path.getsize(part_path))
+        url = '{0}/api/datasets/{1}/display'.format(
+            self.gi.base_url, dataset_id
+        )
+        # the session applies the timeout for dataset downloads and retries
+        # failed connection attempts
+        with self.gi.session.get(
+            url, params={'to_ext': file_ext}, headers=headers,
+            verify=self.gi.verify, stream=True
+        ) as r:
+            if r.status_code == 416:
+                # requested range not satisfiable
+                # => the partial download is complete already
+                pass
+            else:
+                r.raise_for_status()
+                # servers ignoring the range request send the whole file
+                mode = 'ab' if r.status_code == 206 else 'wb'
+                with open(part_path, mode) as o:
+                    for block in r.iter_content(self.chunk_size):
+                        o.write(block)
+        os.replace(part_path, path)
+
+    def _record(self, key, dataset_id, file_name):
+        entry = {'key': key, 'dataset_id': dataset_id, 'file': file_name}
+        with self._manifest_lock:
+            with open(self.manifest, 'a') as o:
+                o.write(json.dumps(entry) + '\n')
+            self.verified[key] = entry
@@ -1,12 +1,19 @@
 import sys
 
-from bioblend import galaxy
-
 from find_by_tags import (
     slice_collections_by_elements_tags,
     find_histories_by_tags
 )
 from find_datasets import get_matching_datasets_from_histories
+from galaxy_client import get_galaxy_instance
+from instrumentation import get_recorder
+from link_scheduler import (
+    POLICIES,
+    collect_pending_batches,
+    format_metrics,
+    queue_metrics,
+    schedule_batches
+)
 
 
 def get_histories_chunk(gi, chunk_size=100):
@@ -44,7 +51,7 @@ def get_matching_slices_from_collections(gi, tags, collections, max_matching):
             yield ret
 
 
-if __name__ == '__main__':
+def main():
     import argparse
 
     parser = argparse.ArgumentParser()
@@ -56,6 +63,12 @@ if __name__ == '__main__':
         '-n', '--max-matching', type=int,
         help='Maximum number of matching histories/datasets to report'
     )
+    parser.add_argument(
+        '--schedule', choices=POLICIES,
+        help='Report matching elements across all collections in the order '
+             'defined by this scheduling policy instead of in history and '
+             'element order, and report queue metrics to stderr'
+    )
     parser.add_argument(
         '-g', '--galaxy-url', required=True,
         help='URL of the Galaxy instance to run query against'
@@ -92,10 +105,7 @@ if __name__ == '__main__':
     )
     args = parser.parse_args()
 
-    gi = galaxy.GalaxyInstance(
-        url=args.galaxy_url,
-        key=args.api_key
-    )
+    gi = get_galaxy_instance(args.galaxy_url, args.api_key)
 
     histories_matcher = (
         find_histories_by_tags(
@@ -117,12 +127,26 @@ if __name__ == '__main__':
             )
                 for collection in history_collections
     )
-    sliced_collections = get_matching_slices_from_collections(
-        gi,
-        args.collection_element_tags,
-        collections_matcher,
-        args.max_matching
-    )
+    if args.schedule:
+        # consider all matching elements, then pick in the order given by
+        # the scheduling policy
+        batches = list(collect_pending_batches(
+            gi, collections_matcher, args.collection_element_tags
+        ))
+        sys.stderr.write(format_metrics(queue_metrics(batches)) + '\n')
+        sliced_collections = [
+            batch['collection']
+            for batch in schedule_batches(
+                batches, args.schedule
+            )[:args.max_matching]
+        ]
+    else:
+        sliced_collections = get_matching_slices_from_collections(
+            gi,
+            args.collection_element_tags,
+            collections_matcher,
+            args.max_matching
+        )
 
     if args.ofile:
         out = open(args.ofile, 'w')
@@ -195,4 +219,15 @@ if __name__ == '__main__':
     finally:
         if out is not sys.stdout:
             out.close()
+    return args
 
+
+if __name__ == '__main__':
+    with get_recorder().span(
+        'discovery', script='find_collection_elements'
+    ) as span:
+        args = main()
+        span.update(
+            history_tags=args.history_tags,
+            collections=args.collection_names
+        )
@@ -1,8 +1,9 @@
 import re
 import sys
 
-from bioblend import galaxy
 from find_by_tags import find_histories_by_tags
+from galaxy_client import get_galaxy_instance
+from instrumentation import get_recorder
 
 
 def show_matching_dataset_info(
@@ -107,7 +108,7 @@ def get_matching_datasets_from_histories(
                 break
 
 
-if __name__ == '__main__':
+def main():
     import argparse
 
     parser = argparse.ArgumentParser()
@@ -166,10 +167,7 @@ if __name__ == '__main__':
     )
     args = parser.parse_args()
 
-    gi = galaxy.GalaxyInstance(
-        url=args.galaxy_url,
-        key=args.api_key
-    )
+    gi = get_galaxy_instance(args.galaxy_url, args.api_key)
 
     if args.history_id:
         history_ids = [args.history_id]
@@ -264,4 +262,15 @@ if __name__ == '__main__':
     finally:
         if out is not sys.stdout:
             out.close()
+    return args
+
 
+if __name__ == '__main__':
+    with get_recorder().span(
+        'discovery', script='find_datasets'
+    ) as span:
+        args = main()
+        span.update(
+            history_tags=args.history_tags, history_id=args.history_id,
+            datasets=args.dataset_names
+        )
@@ -9,7 +9,10 @@ import yaml
 
 from collections import Counter
 
-from bioblend import galaxy, ConnectionError
+from bioblend import ConnectionError
+
+from galaxy_client import get_galaxy_instance
+from instrumentation import get_recorder
 
 
 NON_OK_TERMINAL_STATES = {
@@ -120,6 +123,7 @@ class UploadManager():
     def upload_all(self):
         for unfinished in self.upload_from_links():
             pass
+        return self.links_dataset_ids
 
 class LinkCollection():
     pe_indicator_mapping = {
@@ -385,24 +389,29 @@ if __name__ == '__main__':
 
     args = parser.parse_args()
 
-    gi = galaxy.GalaxyInstance(args.galaxy_url, args.api_key)
+    gi = get_galaxy_instance(args.galaxy_url, args.api_key)
+    recorder = get_recorder()
 
-    data_specs = gi.datasets.download_dataset(
-        args.dataset_id
-    ).decode("utf-8").splitlines()[1:]
+    with recorder.span(
+        'upload', script='ftp_links_to_yaml', links=args.dataset_id
+    ):
+        data_specs = gi.datasets.download_dataset(
+            args.dataset_id
+        ).decode("utf-8").splitlines()[1:]
 
-    links = LinkCollection(data_specs, default_protocol=args.protocol)
-    uploads = UploadManager(
-        links, gi, args.history_id, args.upload_attempts, args.upload_timeout
-    )
+        links = LinkCollection(data_specs, default_protocol=args.protocol)
+        uploads = UploadManager(
+            links, gi, args.history_id, args.upload_attempts,
+            args.upload_timeout
+        )
 
-    yaml = records_to_yaml(
-        parse_fastq_links(
-            links,
-            uploads.upload_all()
-        ),
-        args.collection_name
-    )
+        yaml = records_to_yaml(
+            parse_fastq_links(
+                links,
+                uploads.upload_all()
+            ),
+            args.collection_name
+        )
 
     if args.output:
         with open(args.output, 'w') as f:
@@ -0,0 +1,310 @@
+"""
+Create GalaxyInstance objects that talk to the server through a shared,
+pooled HTTP session.
+
+Compared to a plain bioblend GalaxyInstance, which opens a new connection
+for every request and waits forever for slow responses, the session
+
+- keeps connections to the server alive and pools them, sized to the
+  number of threads using the instance,
+- retries idempotent requests (GET, PUT, DELETE) that failed with a
+  connection error, a 5xx or a 429 status with exponential backoff and
+  jitter, honoring Retry-After headers,
+- applies timeouts that depend on the API endpoint,
+- optionally lets concurrent identical GET requests share one response, and
+- reports every request attempt to a metrics hook, by default the process'
+  instrumentation recorder.
+"""
+
+import contextlib
+import json
+import random
+import re
+import threading
+import time
+
+from concurrent.futures import Future
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from bioblend import ConnectionError, galaxy
+
+from instrumentation import get_endpoint, get_recorder
+
+
+RETRY_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# seconds to wait for a connection to the server
+CONNECT_TIMEOUT = 10
+# seconds to wait for a response by endpoint; the first matching pattern
+# applies
+ENDPOINT_TIMEOUTS = [
+    # complete listings can take long for users with many histories
+    (r'/api/histories', 300),
+    (r'/api/histories/\{id\}/contents', 300),
+    # dataset downloads
+    (r'/api/datasets/\{id\}/display', 600),
+]
+DEFAULT_TIMEOUT = 120
+
+
+class GalaxySession(requests.Session):
+    """A requests session with retries, timeouts and GET deduplication."""
+
+    def __init__(
+        self, max_connections=10, max_retries=4, backoff=1, max_backoff=60,
+        timeouts=None, default_timeout=DEFAULT_TIMEOUT,
+        deduplicate=False, metrics_hook=None
+    ):
+        super().__init__()
+        adapter = HTTPAdapter(
+            pool_connections=max_connections, pool_maxsize=max_connections
+        )
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeouts = [
+            (re.compile(pattern + '$'), timeout)
+            for pattern, timeout in (
+                ENDPOINT_TIMEOUTS if timeouts is None else timeouts
+            )
+        ]
+        self.default_timeout = default_timeout
+        self.deduplicate = deduplicate
+        # called with the method, URL, duration and outcome of every attempt
+        self.metrics_hook = metrics_hook
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def get_timeout(self, url):
+        endpoint = get_endpoint(url)
+        for pattern, timeout in self.timeouts:
+            if pattern.match(endpoint):
+                return (CONNECT_TIMEOUT, timeout)
+        return (CONNECT_TIMEOUT, self.default_timeout)
+
+    def get_retry_window(self, method, url):
+        """Return the longest time a request may take including retries."""
+
+        connect_timeout, read_timeout = self.get_timeout(url)
+        retries = self.max_retries if method.upper() in RETRY_METHODS else 0
+        return (retries + 1) * (connect_timeout + read_timeout) + sum(
+            min(self.max_backoff, self.backoff * 2 ** attempt)
+            for attempt in range(retries)
+        )
+
+    @contextlib.contextmanager
+    def unshared(self):
+        """Send the GET requests of the current thread on their own.
+
+        Within the block, GET requests never reuse the response of an
+        identical request that another thread started earlier.
+        """
+
+        self._local.unshared = True
+        try:
+            yield
+        finally:
+            self._local.unshared = False
+
+    def get_retry_delay(self, attempt, response=None):
+        if response is not None:
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                return min(int(retry_after), self.max_backoff)
+        # "full jitter" keeps retrying clients from hitting the server in
+        # lockstep
+        return random.uniform(
+            0, min(self.max_backoff, self.backoff * 2 ** attempt)
+        )
+
+    def request(self, method, url, **kwargs):
+        method = method.upper()
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.get_timeout(url)
+        if (
+            self.deduplicate and method == 'GET'
+            and not kwargs.get('stream')
+            and not getattr(self._local, 'unshared', False)
+        ):
+            return self._shared_request(method, url, **kwargs)
+        return self._retried_request(method, url, **kwargs)
+
+    def _retried_request(self, method, url, **kwargs):
+        retries = self.max_retries if method in RETRY_METHODS else 0
+        attempt = 0
+        while True:
+            start = time.time()
+            try:
+                response = super().request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._report(method, url, start, type(e).__name__)
+                if attempt >= retries:
+                    raise
+                time.sleep(self.get_retry_delay(attempt))
+            else:
+                self._report(method, url, start, str(response.status_code))
+                if (
+                    response.status_code not in RETRY_STATUSES
+                    or attempt >= retries
+                ):
+                    return response
+                time.sleep(self.get_retry_delay(attempt, response))
+            attempt += 1
+
+    def _shared_request(self, method, url, **kwargs):
+        key = (
+            url,
+            json.dumps(kwargs.get('params'), sort_keys=True, default=str),
+            json.dumps(kwargs.get('headers'), sort_keys=True, default=str)
+        )
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            response = self._retried_request(method, url, **kwargs)
+            # read the body so that all waiting threads can use it
+            response.content
+            future.set_result(response)
+            return response
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def _report(self, method, url, start, outcome):
+        if self.metrics_hook:
+            self.metrics_hook(method, url, time.time() - start, outcome)
+
+
+def _decode(response):
+    # the same error handling as in bioblend for non-GET requests
+    if response.status_code == 200:
+        try:
+            return response.json()
+        except ValueError as e:
+            raise ConnectionError(
+                'Request was successful, but cannot decode the response '
+                f'content: {e}',
+                body=response.content,
+                status_code=response.status_code
+            )
+    raise ConnectionError(
+        f'Unexpected HTTP status code: {response.status_code}',
+        body=response.text,
+        status_code=response.status_code
+    )
+
+
+class PooledGalaxyInstance(galaxy.GalaxyInstance):
+    """A GalaxyInstance sending its API requests through a GalaxySession."""
+
+    def __init__(self, url, key, session):
+        super().__init__(url, key)
+        self.session = session
+
+    def _send(self, method, url, payload=None, params=None):
+        return self.session.request(
+            method, url,
+            params=params,
+            data=json.dumps(payload) if payload is not None else None,
+            headers=self.json_headers,
+            allow_redirects=False,
+            verify=self.verify
+        )
+
+    def make_get_request(self, url, **kwargs):
+        kwargs.setdefault('verify', self.verify)
+        return self.session.get(url, headers=self.json_headers, **kwargs)
+
+    def make_post_request(
+        self, url, payload=None, params=None, files_attached=False
+    ):
+        if files_attached:
+            # multipart uploads are left to bioblend
+            return super().make_post_request(
+                url, payload, params, files_attached
+            )
+        return _decode(self._send('POST', url, payload, params))
+
+    def make_delete_request(self, url, payload=None, params=None):
+        return self._send('DELETE', url, payload, params)
+
+    def make_put_request(self, url, payload=None, params=None):
+        return _decode(self._send('PUT', url, payload, params))
+
+    def make_patch_request(self, url, payload=None, params=None):
+        return _decode(self._send('PATCH', url, payload, params))
+
+
+def list_histories(gi, filters=None, keys=None):
+    """Return the user's histories, most recently updated first.
+
+    filters maps filters of the histories API to values, e.g.
+    {'tag': 'bot-go-report', 'update_time-gt': '2021-06-01T00:00:00'}, and
+    keys limits the returned attributes of each history.
+    """
+
+    # The public get_histories() of the bioblend version planemo depends on
+    # supports neither of these, which keep listings of thousands of
+    # histories cheap. This is the only place using its private _get().
+    params = {}
+    if filters:
+        params['q'] = list(filters)
+        params['qv'] = list(filters.values())
+    if keys:
+        params['keys'] = ','.join(keys)
+    return gi.histories._get(params=params)
+
+
+def get_retry_window(gi, method, url):
+    """Return the longest time a request through gi may take.
+
+    url can also be just the path of the API endpoint.
+
+    For instances not created by get_galaxy_instance, a single attempt with
+    the default timeouts is assumed.
+    """
+
+    if isinstance(getattr(gi, 'session', None), GalaxySession):
+        return gi.session.get_retry_window(method, url)
+    return CONNECT_TIMEOUT + DEFAULT_TIMEOUT
+
+
+def unshared_requests(gi):
+    """Return a context in which gi sends the current thread's GET
+    requests without deduplication."""
+
+    if isinstance(getattr(gi, 'session', None), GalaxySession):
+        return gi.session.unshared()
+    return contextlib.nullcontext()
+
+
+def get_galaxy_instance(
+    url, key, max_connections=10, deduplicate=False, **session_kwargs
+):
+    """Return a GalaxyInstance using a new pooled, retrying session.
+
+    max_connections should be at least the number of threads using the
+    instance concurrently. Further keyword arguments configure the
+    GalaxySession. API requests get reported to the process' recorder
+    unless another metrics_hook is given.
+    """
+
+    session_kwargs.setdefault('metrics_hook', get_recorder().record_api_call)
+    session = GalaxySession(
+        max_connections=max_connections, deduplicate=deduplicate,
+        **session_kwargs
+    )
+    return PooledGalaxyInstance(url, key, session)
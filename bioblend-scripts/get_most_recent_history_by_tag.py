@@ -1,6 +1,6 @@
 import sys
 
-from bioblend import galaxy
+from galaxy_client import get_galaxy_instance, list_histories
 
 if __name__ == '__main__':
     import argparse
@@ -20,7 +20,7 @@ if __name__ == '__main__':
     )
     args = parser.parse_args()
 
-    gi = galaxy.GalaxyInstance(args.galaxy_url, args.api_key)
-    tag_carrying_histories = gi.histories._get(params={'q': ['tag'], 'qv': [args.tag]})
+    gi = get_galaxy_instance(args.galaxy_url, args.api_key)
+    tag_carrying_histories = list_histories(gi, {'tag': args.tag})
     if tag_carrying_histories:
         sys.stdout.write(tag_carrying_histories[0]['id'])
@@ -0,0 +1,96 @@
+"""
+Hand histories over from upstream to downstream bots through a local SQLite
+database instead of only through tags.
+
+When a bot tags a new history with bot-go-* tags, it also records one
+handoff per tag in the database. Downstream bots in the same process get
+woken up right away, bots in other processes sharing the database file
+detect new handoffs by polling it, which does not cost any Galaxy API
+requests. The tags stay the source of truth: consumers still claim the
+history through its tags, and look for tagged ones among all histories
+after every refresh of the history listing, which then is needed only
+rarely, to pick up anything the queue missed.
+"""
+
+import contextlib
+import sqlite3
+import time
+
+
+# seconds for which handoffs that are done are kept for inspection
+KEEP_DONE = 7 * 86400
+# seconds after which bots stop waiting for the inputs of a handed over
+# history to show up; such histories are left to the scans of all histories
+HANDOFF_TIMEOUT = 600
+
+
+class HandoffQueue():
+    """Handoffs of histories to bots, keyed by the bots' trigger tags."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        # called with the trigger tag and history ID of every new handoff
+        # published through this object
+        self.listeners = []
+        with self._connect() as db:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS handoffs ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'trigger_tag TEXT NOT NULL, history_id TEXT NOT NULL, '
+                'created REAL NOT NULL, done REAL)'
+            )
+            db.execute(
+                'CREATE INDEX IF NOT EXISTS pending_handoffs '
+                'ON handoffs (trigger_tag, done)'
+            )
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # commits the transaction at the end of the block
+        with contextlib.closing(
+            sqlite3.connect(self.db_path, timeout=30)
+        ) as db:
+            with db:
+                yield db
+
+    def publish(self, history_id, trigger_tags):
+        """Record that a history got tagged for the bots with trigger_tags."""
+
+        now = time.time()
+        with self._connect() as db:
+            db.executemany(
+                'INSERT INTO handoffs (trigger_tag, history_id, created) '
+                'VALUES (?, ?, ?)',
+                [(tag, history_id, now) for tag in trigger_tags]
+            )
+        for tag in trigger_tags:
+            for listener in self.listeners:
+                listener(tag, history_id)
+
+    def pending(self, trigger_tag):
+        """Return the (handoff ID, history ID, creation time) of handoffs to
+        the bots with trigger_tag that are not done yet, oldest first."""
+
+        with self._connect() as db:
+            return db.execute(
+                'SELECT id, history_id, created FROM handoffs '
+                'WHERE trigger_tag = ? AND done IS NULL ORDER BY id',
+                (trigger_tag,)
+            ).fetchall()
+
+    def done(self, handoff_ids):
+        now = time.time()
+        with self._connect() as db:
+            db.executemany(
+                'UPDATE handoffs SET done = ? WHERE id = ?',
+                [(now, handoff_id) for handoff_id in handoff_ids]
+            )
+            db.execute(
+                'DELETE FROM handoffs WHERE done < ?', (now - KEEP_DONE,)
+            )
+
+    def last_id(self):
+        """Return the ID of the newest handoff, to detect new ones cheaply."""
+
+        with self._connect() as db:
+            return db.execute('SELECT MAX(id) FROM handoffs').fetchone()[0]
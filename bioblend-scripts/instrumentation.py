@@ -0,0 +1,262 @@
+"""
+Record how long the stages of the bot pipeline take and how much they ask
+of the Galaxy server.
+
+A Recorder collects
+
+- spans, i.e. timed stages like discovery, claim, upload, invocation and
+  handoff, with attributes identifying the data they worked on,
+- events, i.e. points in time like the upload of a batch of links,
+- counts and durations of Galaxy API requests by method and endpoint,
+  reported by the sessions of galaxy_client.py, and
+- gauges, like the number of pending batches.
+
+Spans and events get appended to a JSON-lines trace file, one record per
+line. Spans of the same batch are linked through their attributes: the
+variation bot's spans carry the links dataset ("links") and the new history
+("dest"), those of the downstream bots their input ("source") and new
+history ("dest"). Following these from a batch_queued event to the export
+bot's handoff gives the end-to-end latency of a batch.
+Counters and gauges get written to a file in the OpenMetrics text format
+for scraping by a local collector, e.g. the textfile collector of the
+Prometheus node exporter.
+
+Scripts started by the run_*.sh scripts append to the trace file named by
+the BOT_TRACE_FILE environment variable, if it is set.
+"""
+
+import atexit
+import contextlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+from urllib.parse import urlparse
+
+
+# encoded Galaxy IDs in API paths
+ID_PATTERN = re.compile(r'/[0-9a-f]{16,}(?=/|$)')
+
+
+def get_endpoint(url):
+    """Return the path of an API URL with IDs replaced by "{id}"."""
+
+    return ID_PATTERN.sub('/{id}', urlparse(url).path)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{0}="{1}"'.format(
+            key,
+            str(value).replace('\\', '\\\\').replace('"', '\\"')
+        ) for key, value in sorted(labels)
+    ) + '}'
+
+
+class Recorder():
+    """Collect spans, events, API request metrics and gauges."""
+
+    def __init__(self, trace_file=None, metrics_file=None):
+        self.trace_file = trace_file
+        self.metrics_file = metrics_file
+        self.process = '{0}[{1}]'.format(
+            os.path.basename(sys.argv[0]), os.getpid()
+        )
+        self._lock = threading.Lock()
+        # (method, endpoint, outcome) => [count, seconds]
+        self.api_calls = {}
+        # (stage name, bot or script) => [count, errors, seconds]
+        self.stages = {}
+        # (name, labels) => value
+        self.gauges = {}
+
+    def _write_record(self, record):
+        if not self.trace_file:
+            return
+        record['process'] = self.process
+        line = json.dumps(record, default=str) + '\n'
+        with self._lock:
+            with open(self.trace_file, 'a') as o:
+                o.write(line)
+
+    def event(self, name, timestamp=None, **attrs):
+        """Record that something happened at a point in time."""
+
+        self._write_record({
+            'type': 'event',
+            'name': name,
+            'time': time.time() if timestamp is None else timestamp,
+            'attrs': attrs,
+        })
+
+    @contextlib.contextmanager
+    def span(self, name, **attrs):
+        """Time the block as a stage of the pipeline.
+
+        The block can add attributes that only become known while it runs
+        to the yielded dict.
+        """
+
+        start = time.time()
+        status = 'ok'
+        try:
+            yield attrs
+        except BaseException:
+            status = 'error'
+            raise
+        finally:
+            end = time.time()
+            key = (name, attrs.get('bot') or attrs.get('script') or '')
+            with self._lock:
+                stage = self.stages.setdefault(key, [0, 0, 0.0])
+                stage[0] += 1
+                stage[1] += status == 'error'
+                stage[2] += end - start
+            self._write_record({
+                'type': 'span',
+                'name': name,
+                'start': start,
+                'end': end,
+                'duration': round(end - start, 3),
+                'status': status,
+                'attrs': attrs,
+            })
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self.gauges[(name, tuple(labels.items()))] = value
+
+    def record_api_call(self, method, url, seconds, outcome):
+        key = (method, get_endpoint(url), outcome)
+        with self._lock:
+            call = self.api_calls.setdefault(key, [0, 0.0])
+            call[0] += 1
+            call[1] += seconds
+
+    def format_metrics(self):
+        """Return all metrics in the OpenMetrics text format."""
+
+        with self._lock:
+            api_calls = dict(self.api_calls)
+            stages = dict(self.stages)
+            gauges = dict(self.gauges)
+        lines = [
+            '# TYPE galaxy_bot_api_requests counter',
+            '# HELP galaxy_bot_api_requests Galaxy API requests by endpoint '
+            'and response status',
+        ]
+        for (method, endpoint, outcome), (count, _) in sorted(
+            api_calls.items()
+        ):
+            labels = _format_labels([
+                ('method', method), ('endpoint', endpoint),
+                ('status', outcome)
+            ])
+            lines.append(f'galaxy_bot_api_requests_total{labels} {count}')
+        lines += [
+            '# TYPE galaxy_bot_api_request_seconds summary',
+            '# UNIT galaxy_bot_api_request_seconds seconds',
+        ]
+        for (method, endpoint, outcome), (count, seconds) in sorted(
+            api_calls.items()
+        ):
+            labels = _format_labels([
+                ('method', method), ('endpoint', endpoint),
+                ('status', outcome)
+            ])
+            lines.append(
+                f'galaxy_bot_api_request_seconds_count{labels} {count}'
+            )
+            lines.append(
+                f'galaxy_bot_api_request_seconds_sum{labels} {seconds:.3f}'
+            )
+        lines += [
+            '# TYPE galaxy_bot_stage_seconds summary',
+            '# UNIT galaxy_bot_stage_seconds seconds',
+        ]
+        for (name, bot), (count, errors, seconds) in sorted(stages.items()):
+            labels = _format_labels([('stage', name), ('bot', bot)])
+            lines.append(f'galaxy_bot_stage_seconds_count{labels} {count}')
+            lines.append(f'galaxy_bot_stage_seconds_sum{labels} {seconds:.3f}')
+        lines.append('# TYPE galaxy_bot_stage_errors counter')
+        for (name, bot), (count, errors, seconds) in sorted(stages.items()):
+            labels = _format_labels([('stage', name), ('bot', bot)])
+            lines.append(f'galaxy_bot_stage_errors_total{labels} {errors}')
+        families = {}
+        for (name, labels), value in sorted(
+            gauges.items(), key=lambda item: item[0]
+        ):
+            if value is None:
+                continue
+            families.setdefault(name, []).append(
+                f'galaxy_bot_{name}{_format_labels(labels)} {value}'
+            )
+        for name, samples in families.items():
+            lines.append(f'# TYPE galaxy_bot_{name} gauge')
+            lines += samples
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def write_metrics(self):
+        """Replace the metrics file with the current metrics."""
+
+        if not self.metrics_file:
+            return
+        tmp = self.metrics_file + '.tmp'
+        with open(tmp, 'w') as o:
+            o.write(self.format_metrics())
+        os.replace(tmp, self.metrics_file)
+
+    def write_api_summary(self):
+        # lets short-lived scripts report their API usage through the trace
+        with self._lock:
+            api_calls = [
+                {
+                    'method': method, 'endpoint': endpoint,
+                    'status': outcome, 'count': count,
+                    'seconds': round(seconds, 3)
+                }
+                for (method, endpoint, outcome), (count, seconds)
+                in sorted(self.api_calls.items())
+            ]
+        if api_calls:
+            self._write_record({
+                'type': 'api_calls',
+                'time': time.time(),
+                'calls': api_calls,
+            })
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_recorder():
+    """Return the recorder of the process.
+
+    Unless configured with configure(), it appends to the file named by the
+    BOT_TRACE_FILE environment variable, if set, and reports the API
+    requests of the process there at exit.
+    """
+
+    global _recorder
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = Recorder(os.environ.get('BOT_TRACE_FILE'))
+            atexit.register(_recorder.write_api_summary)
+        return _recorder
+
+
+def configure(trace_file=None, metrics_file=None):
+    """Set up the recorder of the process with the given files."""
+
+    recorder = get_recorder()
+    if trace_file:
+        recorder.trace_file = trace_file
+    recorder.metrics_file = metrics_file
+    return recorder
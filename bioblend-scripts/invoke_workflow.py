@@ -0,0 +1,150 @@
+"""
+Invoke a workflow on a Galaxy server with the inputs from a job yml file.
+
+Job yml files are expected in the format used by planemo run, with inputs
+referring to existing datasets and collections through their galaxy_id, and
+new collections built from existing datasets as produced by
+ftp_links_to_yaml.py.
+
+Unlike planemo run, this returns as soon as the workflow invocation has been
+created and leaves the scheduling of the workflow to Galaxy.
+"""
+
+import sys
+
+import yaml
+
+from galaxy_client import get_galaxy_instance
+from instrumentation import get_recorder
+
+
+def _element_identifiers(elements):
+    identifiers = []
+    for element in elements:
+        if element['class'] == 'File':
+            identifiers.append({
+                'name': element['identifier'],
+                'src': 'hda',
+                'id': element['galaxy_id']
+            })
+        elif 'galaxy_id' in element:
+            identifiers.append({
+                'name': element['identifier'],
+                'src': 'hdca',
+                'id': element['galaxy_id']
+            })
+        else:
+            identifiers.append({
+                'name': element['identifier'],
+                'src': 'new_collection',
+                'collection_type': element.get(
+                    'collection_type', element.get('type')
+                ),
+                'element_identifiers': _element_identifiers(
+                    element['elements']
+                )
+            })
+    return identifiers
+
+
+def prepare_inputs(gi, history_id, job):
+    """Turn a parsed job yml into workflow inputs by name.
+
+    Collections that are defined through their elements get built in the
+    history with the given ID.
+    """
+
+    inputs = {}
+    for name, value in job.items():
+        if not isinstance(value, dict) or 'class' not in value:
+            # a workflow parameter
+            inputs[name] = value
+        elif 'galaxy_id' in value:
+            inputs[name] = {
+                'src': 'hda' if value['class'] == 'File' else 'hdca',
+                'id': value['galaxy_id']
+            }
+        elif value['class'] == 'Collection' and 'elements' in value:
+            collection = gi.histories.create_dataset_collection(
+                history_id,
+                {
+                    'name': name,
+                    'collection_type': value['collection_type'],
+                    'element_identifiers': _element_identifiers(
+                        value['elements']
+                    )
+                }
+            )
+            inputs[name] = {'src': 'hdca', 'id': collection['id']}
+        else:
+            raise ValueError(
+                f'Input "{name}" does not refer to data on the Galaxy server'
+            )
+    return inputs
+
+
+def invoke_from_job(gi, workflow_id, job, history_name, tags=()):
+    """Invoke a workflow in a new history without waiting for its jobs.
+
+    The new history gets tagged before any input collections get built in
+    it and before the workflow gets invoked.
+    Returns the invocation, which includes the ID of the new history.
+    """
+
+    history = gi.histories.create_history(history_name)
+    if tags:
+        gi.histories.update_history(history['id'], tags=list(tags))
+    inputs = prepare_inputs(gi, history['id'], job)
+    return gi.workflows.invoke_workflow(
+        workflow_id,
+        inputs=inputs,
+        history_id=history['id'],
+        inputs_by='name',
+        allow_tool_state_corrections=True
+    )
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'workflow_id',
+        help='ID of the workflow to invoke'
+    )
+    parser.add_argument(
+        'job_yml',
+        help='Job yml file describing the workflow inputs'
+    )
+    parser.add_argument(
+        '--history-name', required=True,
+        help='Name of the new history to run the workflow in'
+    )
+    parser.add_argument(
+        '-t', '--tags', nargs='*', default=[],
+        help='Tags to put on the new history'
+    )
+    parser.add_argument(
+        '-g', '--galaxy-url', required=True,
+        help='URL of the Galaxy instance to run the workflow on'
+    )
+    parser.add_argument(
+        '-a', '--api-key', required=True,
+        help='API key to use for authenticating on the Galaxy server'
+    )
+    args = parser.parse_args()
+
+    gi = get_galaxy_instance(args.galaxy_url, args.api_key)
+    recorder = get_recorder()
+    with open(args.job_yml) as i:
+        job = yaml.safe_load(i)
+    with recorder.span(
+        'invocation', script='invoke_workflow',
+        workflow=args.workflow_id, history_name=args.history_name
+    ) as span:
+        invocation = invoke_from_job(
+            gi, args.workflow_id, job, args.history_name, args.tags
+        )
+        span['dest'] = invocation['history_id']
+    # report the new history's ID for use by the calling bot script
+    sys.stdout.write(invocation['history_id'] + '\n')
@@ -0,0 +1,135 @@
+"""
+Decide the order in which pending batches of download links get analyzed.
+
+A pending batch is an element of a links collection in a metadata history
+that has not been tagged by the variation bot yet. Supported policies are:
+
+- fifo: oldest upload first
+- priority: highest "priority:<n>" dataset tag first (untagged batches have
+  priority 0; a plain "priority" tag counts as 1), then oldest first
+- smallest: smallest links dataset first, which minimizes the time until
+  results become available for most batches
+- largest: largest links dataset first, which maximizes the amount of data
+  processed per workflow run
+"""
+
+import time
+
+from datetime import datetime, timezone
+
+
+POLICIES = ('fifo', 'priority', 'smallest', 'largest')
+
+
+def _is_priority_tag(tag):
+    return tag.partition(':')[0] == 'priority'
+
+
+def get_priority(tags):
+    priority = 0
+    for tag in tags:
+        name, _, value = tag.partition(':')
+        if name == 'priority':
+            try:
+                priority = max(priority, int(value) if value else 1)
+            except ValueError:
+                pass
+    return priority
+
+
+def _parse_time(value):
+    # Galaxy reports times in UTC without a time zone
+    if not value:
+        return None
+    return datetime.fromisoformat(value).replace(
+        tzinfo=timezone.utc
+    ).timestamp()
+
+
+def collect_pending_batches(gi, collections, element_tags=()):
+    """Yield the elements of links collections as batch dicts.
+
+    By default, only elements without tags other than priority tags are
+    considered pending. Otherwise, elements need to carry all element_tags.
+    Each batch has a "collection" with just the batch's element, in the
+    format used by find_collection_elements.py for filling job yml
+    templates.
+    """
+
+    for collection in collections:
+        if not collection.get('elements'):
+            collection = gi.histories.show_dataset_collection(
+                collection['history_id'],
+                collection['id']
+            )
+        for element in collection['elements']:
+            dataset = element['object']
+            tags = dataset.get('tags', [])
+            if element_tags:
+                if not set(element_tags).issubset(tags):
+                    continue
+            elif not all(_is_priority_tag(tag) for tag in tags):
+                continue
+            uploaded = _parse_time(
+                dataset.get('create_time') or collection.get('create_time')
+                or collection.get('update_time')
+            )
+            yield {
+                'history_id': collection['history_id'],
+                'collection': dict(collection, elements=[element]),
+                'name': element['element_identifier'],
+                'dataset_id': dataset['id'],
+                'uploaded': uploaded,
+                'size': dataset.get('file_size') or 0,
+                'priority': get_priority(tags),
+                'element_index': element['element_index'],
+            }
+
+
+def schedule_batches(batches, policy='fifo'):
+    """Return batches in the order in which they should be analyzed."""
+
+    if policy not in POLICIES:
+        raise ValueError(
+            f'Unknown scheduling policy "{policy}"; '
+            'choose one of: ' + ', '.join(POLICIES)
+        )
+
+    def age_key(batch):
+        # batches without a known upload time go last
+        return (
+            batch['uploaded'] is None,
+            batch['uploaded'] or 0,
+            batch['element_index']
+        )
+
+    if policy == 'priority':
+        return sorted(batches, key=lambda b: (-b['priority'], age_key(b)))
+    if policy == 'smallest':
+        return sorted(batches, key=lambda b: (b['size'], age_key(b)))
+    if policy == 'largest':
+        return sorted(batches, key=lambda b: (-b['size'], age_key(b)))
+    return sorted(batches, key=age_key)
+
+
+def queue_metrics(batches, now=None):
+    """Return the number of pending batches and the age of the oldest."""
+
+    if now is None:
+        now = time.time()
+    upload_times = [b['uploaded'] for b in batches if b['uploaded']]
+    return {
+        'queue_depth': len(batches),
+        'oldest_pending_age': (
+            round(now - min(upload_times)) if upload_times else None
+        ),
+        'pending_bytes': sum(b['size'] for b in batches),
+    }
+
+
+def format_metrics(metrics):
+    age = metrics['oldest_pending_age']
+    return '{0} pending batches ({1} bytes of links); oldest pending: {2}'.format(
+        metrics['queue_depth'], metrics['pending_bytes'],
+        'n/a' if age is None else f'{age}s'
+    )
@@ -3,14 +3,30 @@ Gather, process and store information about bot processing results distributed
 across multiple histories.
 """
 
+import os
 import json
+import re
 import subprocess
 
-from bioblend import galaxy
+from concurrent.futures import ThreadPoolExecutor
 
+from bioblend import ConnectionError
+
+from data_availability import DataAvailabilityChecker
 from find_datasets import show_matching_dataset_info
 from find_by_tags import filter_objects_by_tags
+from galaxy_client import get_galaxy_instance, list_histories
+from instrumentation import get_recorder
+from summary_store import SummaryStore
+from tag_history import update_history_tags
+
 
+# The state of incremental history discovery gets stored next to a summary
+# JSON file, in a file with the same name plus this suffix, so that consumers
+# of the summary only ever see analysis records.
+DISCOVERY_STATE_SUFFIX = '.state.json'
+# Key under which older versions stored the state inside the summary itself
+DISCOVERY_STATE_KEY = '__discovery_state__'
 
 def resolve_ena_record_duplicates(record_id, record_meta_lines):
     # metadata gets passed in as a list of (study, coll_date, erc) tuples
@@ -259,12 +275,95 @@ def add_batch_details(gi, discovered_batches):
             )
 
 
+# Keys to request for each history in history listings.
+# Besides the keys used for history discovery these include the importable
+# status needed for publishing histories.
+HISTORY_LISTING_KEYS = [
+    'id', 'name', 'tags', 'update_time', 'importable'
+]
+
+
+def get_history_listing(gi):
+    """List all histories with the keys needed by COGUKSummary methods."""
+
+    return list_histories(gi, keys=HISTORY_LISTING_KEYS)
+
+
+def index_collection_sources(
+    gi, history_ids, collection_sources, collection_name, indexed=None
+):
+    """Map collections found in histories to the IDs of these histories.
+
+    Lists the collections named `collection_name` in each of the histories
+    not indexed yet, and records the ID of the dataset collection underlying
+    each of them in the `collection_sources` dictionary.
+    Since history copies of a collection share the same underlying dataset
+    collection, the index can be used to trace any such copy back to the
+    history that the collection got created in.
+    An optional `indexed` set of history IDs records the histories indexed
+    so far, including those without any matching collection, which do not
+    get listed again.
+    """
+
+    name_pattern = re.compile(collection_name)
+    if indexed is None:
+        indexed = set()
+    indexed.update(collection_sources.values())
+    for history_id in history_ids:
+        if history_id in indexed:
+            continue
+        for hdca in gi.histories.show_history(
+            history_id, contents=True, deleted=False,
+            types=['dataset_collection']
+        ):
+            if hdca.get('collection_id') and name_pattern.fullmatch(
+                hdca['name']
+            ):
+                collection_sources[hdca['collection_id']] = history_id
+        indexed.add(history_id)
+
+
+def resolve_collection_source(gi, hdca, collection_sources):
+    """Return the ID of the history that a collection's datasets live in.
+
+    Tries, in this order, a lookup of the collection in the
+    `collection_sources` index, a query for just the first element of the
+    collection, and, for Galaxy servers that do not support element paging,
+    retrieval of the full collection.
+    Newly resolved collections get added to the index.
+    """
+
+    collection_id = hdca.get('collection_id')
+    if collection_id in collection_sources:
+        return collection_sources[collection_id]
+
+    source = None
+    if collection_id:
+        resp = gi.make_get_request(
+            '{0}/api/dataset_collections/{1}/contents/{2}?limit=1&offset=0'
+            .format(gi.base_url, hdca['id'], collection_id)
+        )
+        if resp.status_code == 200:
+            elements = resp.json()
+            if isinstance(elements, list) and elements:
+                source = elements[0]['object'].get('history_id')
+    if source is None:
+        source = gi.histories.show_dataset_collection(
+            hdca['history_id'], hdca['id']
+        )['elements'][0]['object']['history_id']
+    if collection_id:
+        collection_sources[collection_id] = source
+    return source
+
+
 class COGUKSummary():
     """Represent a bot analysis summary.
 
     Stores a `summary` of bot-performed SARS-CoV-2 genomics analyses
     as a dictionary, which can be populated from an existing JSON file, or
     be updated through a Galaxy server query.
+    Instead of a dictionary, a `summary_store.SummaryStore` can be used to
+    hold the summary in an SQLite database without loading it into memory.
 
     A `tags` and an `exclude_tags` dictionary can be provided to determine,
     which variation, reporting and consensus histories will be picked up during
@@ -276,14 +375,19 @@ class COGUKSummary():
         summary=None,
         tags=None,
         exclude_tags=None,
-        update_details_hook=None
+        update_details_hook=None,
+        discovery_state=None
     ):
         """Create a new instance.
 
         Optionally, populate its `summary` from an existing summary dictionary.
+
+        A `discovery_state` dictionary, as stored by a previous run, lets
+        updates skip the inspection of report and consensus histories that
+        have not changed since they got classified.
         """
 
-        if summary:
+        if summary is not None:
             self.summary = summary
         else:
             self.summary = {}
@@ -308,14 +412,77 @@ class COGUKSummary():
                 'report': ['bot-published']
             }
         self.update_details_hook = update_details_hook or add_batch_details
+        if discovery_state:
+            self.discovery_state = discovery_state
+            # states stored by older versions lack the collection index
+            self.discovery_state.setdefault('collection_sources', {})
+            self.discovery_state.setdefault('indexed_histories', [])
+        else:
+            self.discovery_state = self.new_discovery_state()
+
+    @staticmethod
+    def new_discovery_state():
+        """Return an empty history discovery state.
+
+        The state consists of the high-water mark of the `update_time` of
+        all histories seen during the last inspection pass, of a
+        `classified` dictionary that maps the IDs of all report and consensus
+        histories inspected so far to the ID of the variation history they
+        have been derived from, or to None for histories that got rejected,
+        of a `collection_sources` dictionary mapping the annotated
+        variants collections of incomplete records to their variation
+        histories, and of the list of `indexed_histories` whose collections
+        have been looked at for that index.
+        """
+
+        return {
+            'update_time': None,
+            'classified': {},
+            'collection_sources': {},
+            'indexed_histories': []
+        }
 
     @classmethod
     def from_file(cls, fname, **kwargs):
-        """Create an instance and populate its summary from a JSON file."""
+        """Create an instance and populate its summary from a JSON file.
+
+        The history discovery state gets read from the file's state file,
+        if there is one.
+        """
 
         with open(fname) as i:
             summary = json.load(i)
-        return cls(summary, **kwargs)
+        discovery_state = summary.pop(DISCOVERY_STATE_KEY, None)
+        if os.path.exists(fname + DISCOVERY_STATE_SUFFIX):
+            with open(fname + DISCOVERY_STATE_SUFFIX) as i:
+                discovery_state = json.load(i)
+        return cls(summary, discovery_state=discovery_state, **kwargs)
+
+    def merge_discovery_state(self, other_state):
+        """Merge a discovery state, e.g. from another summary file.
+
+        Classified histories get combined, but the older of the two
+        high-water marks is kept so that no history that changed since either
+        state was recorded escapes re-inspection.
+        """
+
+        if other_state is None:
+            other_state = self.new_discovery_state()
+        self.discovery_state['classified'].update(other_state['classified'])
+        self.discovery_state['collection_sources'].update(
+            other_state.get('collection_sources', {})
+        )
+        self.discovery_state['indexed_histories'] = sorted(
+            set(self.discovery_state['indexed_histories']).union(
+                other_state.get('indexed_histories', [])
+            )
+        )
+        own_time = self.discovery_state['update_time']
+        other_time = other_state['update_time']
+        if own_time is None or other_time is None:
+            self.discovery_state['update_time'] = None
+        else:
+            self.discovery_state['update_time'] = min(own_time, other_time)
 
     @property
     def sample_count(self):
@@ -323,7 +490,7 @@ class COGUKSummary():
 
         return sum(len(v.get('samples', [])) for v in self.summary.values())
 
-    def save(self, fname, drop_partial=True):
+    def save(self, fname, drop_partial=True, with_discovery_state=True):
         """Save the current summary to a JSON file.
 
         By default, only saves complete records,
@@ -332,21 +499,70 @@ class COGUKSummary():
 
         Use `drop_partial=False` to save also incomplete records.
 
+        Unless `with_discovery_state=False`, the current history discovery
+        state gets stored in a state file next to it (named like the JSON
+        file plus ".state.json"), so that the next update based on the file
+        can skip already classified histories.
+
         Returns the number of samples in the saved JSON.
         """
 
+        # Records are serialized one by one to avoid building the complete
+        # JSON document, or a filtered copy of the summary, in memory.
+        # The output is identical to json.dump(..., indent=2) of the whole.
+        records = self.summary.items()
         if drop_partial:
-            partial_records = set(self.get_problematic().keys())
-            records_to_write = self.__class__(
-                {
-                    k: v for k, v in self.summary.items()
-                    if k not in partial_records
-                }
-            )
-            return records_to_write.save(fname, drop_partial=False)
+            records = ((k, v) for k, v in records if self.is_complete(v))
+        sample_count = 0
         with open(fname, 'w') as o:
-            json.dump(self.summary, o, indent=2)
-        return self.sample_count
+            o.write('{')
+            sep = '\n'
+            for k, v in records:
+                sample_count += len(v.get('samples', []))
+                o.write(sep)
+                # strip the enclosing '{\n' and '\n}'
+                o.write(json.dumps({k: v}, indent=2)[2:-2])
+                sep = ',\n'
+            if sep != '\n':
+                o.write('\n')
+            o.write('}')
+        # written after the summary, so that the state never claims
+        # histories to be classified that the summary lacks
+        state_file = fname + DISCOVERY_STATE_SUFFIX
+        if with_discovery_state:
+            with open(state_file, 'w') as o:
+                json.dump(self.discovery_state, o)
+        elif os.path.exists(state_file):
+            # a state left from an earlier run does not match the new file
+            os.remove(state_file)
+        return sample_count
+
+    def _needs_inspection(self, history):
+        # A history needs to be inspected (again) if it has not been
+        # classified before, or if it has been updated after the last
+        # inspection pass.
+        watermark = self.discovery_state['update_time']
+        return (
+            history['id'] not in self.discovery_state['classified']
+        ) or (
+            watermark is None
+        ) or (
+            history.get('update_time') is None
+        ) or (
+            history['update_time'] > watermark
+        )
+
+    def _get_variation_source(self, gi, history, annotated_vars):
+        if annotated_vars['history_id'] != history['id']:
+            # This annotated_vars collection was found in the history's
+            # invocation inputs and is linked directly from the variation
+            # history.
+            return annotated_vars['history_id']
+        # The collection is a copy living in the inspected history itself
+        # => trace it back to its source history.
+        return resolve_collection_source(
+            gi, annotated_vars, self.discovery_state['collection_sources']
+        )
 
     def _update_partial_data(self, gi, histories, partial_data):
         # Note: this method intentionally walks *all* report and consensus
@@ -354,7 +570,22 @@ class COGUKSummary():
         # has completed all partial records.
         # This is to detect duplicate histories for any analysis batch before
         # adding the batch to self.summary.
-
+        # Histories classified during previous runs, which haven't been
+        # updated since, are not inspected again, but the variation history
+        # they are linked to is taken from self.discovery_state instead.
+
+        classified = self.discovery_state['classified']
+        collection_sources = self.discovery_state['collection_sources']
+        indexed_histories = set(self.discovery_state['indexed_histories'])
+        # Index the annotated variants collections of all variation histories
+        # in need of completion in bulk. This allows report and consensus
+        # histories holding copies of these collections to be linked to
+        # their variation history without looking into collection elements.
+        index_collection_sources(
+            gi, partial_data, collection_sources,
+            'Final \(SnpEff-\) annotated variants', indexed_histories
+        )
+        candidate_ids = set()
         known_report_ids = self.get_history_ids('report')
         histories_to_search = [
             h for h in filter_objects_by_tags(
@@ -366,45 +597,53 @@ class COGUKSummary():
         # add the links to the corresponding report histories
         # and record duplicates
         ids_with_duplicated_reports = set()
+        report_data_names = [
+            'Final \(SnpEff-\) annotated variants',
+            'Combined Variant Report by Sample',
+            'Variant-Frequency Plot.+'
+        ]
         for history in histories_to_search:
-            key_data = show_matching_dataset_info(
-                gi, history['id'],
-                [
-                    'Final \(SnpEff-\) annotated variants',
-                    'Combined Variant Report by Sample',
-                    'Variant-Frequency Plot.+'
-                ],
-                visible=True
-            )
-            if not all(key_data):
-                continue
+            candidate_ids.add(history['id'])
+            key_data = None
+            if self._needs_inspection(history):
+                key_data = show_matching_dataset_info(
+                    gi, history['id'],
+                    report_data_names,
+                    visible=True
+                )
+                if not all(key_data):
+                    classified[history['id']] = None
+                    continue
 
-            annotated_vars, by_sample_report, batch_plot = [
-                d[0] for d in key_data
-            ]
-            if annotated_vars['history_id'] == history['id']:
-                vcf_elements = gi.histories.show_dataset_collection(
-                    history['id'], annotated_vars['id']
-                )['elements']
-                variation_from = vcf_elements[0]['object']['history_id']
+                variation_from = self._get_variation_source(
+                    gi, history, key_data[0][0]
+                )
+                classified[history['id']] = variation_from
             else:
-                # This annotated_vars collection was found in the report
-                # history's invocation inputs and is linked directly from
-                # the variation history.
-                # No need to look into collection elements anymore.
-                variation_from = annotated_vars['history_id']
-                # postpone collection element extraction until we know
-                # that we want to use this history
-                vcf_elements = None
+                variation_from = classified[history['id']]
 
             if variation_from in partial_data:
-                if 'report' in partial_data:
+                if 'report' in partial_data[variation_from]:
                     ids_with_duplicated_reports.add(variation_from)
                 else:
-                    if vcf_elements is None:
-                        vcf_elements = gi.histories.show_dataset_collection(
-                            history['id'], annotated_vars['id']
-                        )['elements']
+                    if key_data is None:
+                        # history got classified during an earlier run
+                        # => we still need the details of its key datasets
+                        key_data = show_matching_dataset_info(
+                            gi, history['id'],
+                            report_data_names,
+                            visible=True
+                        )
+                        if not all(key_data):
+                            continue
+                    annotated_vars, by_sample_report, batch_plot = [
+                        d[0] for d in key_data
+                    ]
+                    # collection element extraction is postponed until we know
+                    # that we want to use this history
+                    vcf_elements = gi.histories.show_dataset_collection(
+                        history['id'], annotated_vars['id']
+                    )['elements']
                     sample_names = [e['element_identifier'] for e in vcf_elements]
                     partial_data[variation_from]['samples'] = sample_names
                     partial_data[variation_from]['time'] = by_sample_report['create_time']
@@ -426,9 +665,9 @@ class COGUKSummary():
             )
             print('Batch ID\tVariation History link')
             for record in ids_with_duplicated_reports:
-                partial_data[record].pop('time')
+                partial_data[record].pop('time', None)
                 partial_data[record].pop('report')
-                partial_data[record].pop('batch_plot')
+                partial_data[record].pop('batch_plot', None)
                 print('{0}\t{1}'.format(
                     partial_data[record]['batch_id'],
                     partial_data[record]['variation']
@@ -446,28 +685,26 @@ class COGUKSummary():
         # and record duplicates
         ids_with_duplicated_consensus = set()
         for history in histories_to_search:
-            annotated_vars_info = show_matching_dataset_info(
-                gi, history['id'],
-                ['Final \(SnpEff-\) annotated variants'],
-                types='dataset_collection'
-            )[0]
-            if not annotated_vars_info:
-                continue
+            candidate_ids.add(history['id'])
+            if self._needs_inspection(history):
+                annotated_vars_info = show_matching_dataset_info(
+                    gi, history['id'],
+                    ['Final \(SnpEff-\) annotated variants'],
+                    types='dataset_collection'
+                )[0]
+                if not annotated_vars_info:
+                    classified[history['id']] = None
+                    continue
 
-            if annotated_vars_info[0]['history_id'] == history['id']:
-                variation_from = gi.histories.show_dataset_collection(
-                    history['id'],
-                    annotated_vars_info[0]['id']
-                )['elements'][0]['object']['history_id']
+                variation_from = self._get_variation_source(
+                    gi, history, annotated_vars_info[0]
+                )
+                classified[history['id']] = variation_from
             else:
-                # This annotated_vars collection was found in the consensus
-                # history's invocation inputs and is linked directly from
-                # the variation history.
-                # No need to look into collection elements anymore.
-                variation_from = annotated_vars_info[0]['history_id']
+                variation_from = classified[history['id']]
 
             if variation_from in partial_data:
-                if 'consensus' in partial_data:
+                if 'consensus' in partial_data[variation_from]:
                     ids_with_duplicated_consensus.add(variation_from)
                 else:
                     partial_data[variation_from][
@@ -490,6 +727,27 @@ class COGUKSummary():
                     partial_data[record]['variation']
                 ))
 
+        # All candidate histories have been classified now.
+        # Forget about histories that are no longer candidates (they got
+        # published or are part of the summary by now) so that they would get
+        # re-inspected if they ever became candidates again, and advance the
+        # high-water mark to the most recent update seen in the listing.
+        self.discovery_state['classified'] = {
+            k: v for k, v in classified.items() if k in candidate_ids
+        }
+        self.discovery_state['collection_sources'] = {
+            k: v for k, v in collection_sources.items() if v in partial_data
+        }
+        self.discovery_state['indexed_histories'] = sorted(
+            h for h in indexed_histories if h in partial_data
+        )
+        update_times = [
+            h['update_time'] for h in histories if h.get('update_time')
+        ]
+        self.discovery_state['update_time'] = (
+            max(update_times) if update_times else None
+        )
+
     def update(self, gi, histories=None):
         """Update the current summary with analyses found on a Galaxy instance.
 
@@ -506,7 +764,7 @@ class COGUKSummary():
         """
 
         if not histories:
-            histories = gi.histories.get_histories()
+            histories = get_history_listing(gi)
         # collect the IDs and links to variation histories processed by
         # both the report and the consensus bot
         new_data = {}
@@ -573,13 +831,19 @@ class COGUKSummary():
                         ids.append(history_link.split('=')[-1])
         return ids
 
+    @staticmethod
+    def is_complete(record):
+        """Check whether a record has all expected keys."""
+
+        expected_keys = ['samples', 'report', 'consensus']
+        return all(expected_key in record for expected_key in expected_keys)
+
     def get_problematic(self):
         """Return only incomplete records in the summary."""
 
         problematic = {}
-        expected_keys = ['samples', 'report', 'consensus']
         for k, v in self.summary.items():
-            if any(expected_key not in v for expected_key in expected_keys):
+            if not self.is_complete(v):
                 problematic[k] = v
         return problematic
 
@@ -594,13 +858,15 @@ class COGUKSummary():
         if not problematic:
             return
         if not histories:
-            histories = gi.histories.get_histories()
+            histories = get_history_listing(gi)
 
         self._update_partial_data(gi, histories, problematic)
         self.summary.update(problematic)
         return self.__class__(problematic).get_problematic()
 
-    def make_accessible(self, gi, history_type=None, tag=None):
+    def make_accessible(
+        self, gi, history_type=None, tag=None, histories=None, workers=4
+    ):
         """Make histories in the current summary accessible.
 
         Checks all histories in the current summary that can be found on the
@@ -616,9 +882,17 @@ class COGUKSummary():
         to such histories during the operation.
         Note that using a history tag speeds up the method dramatically.
 
+        A prefetched list of histories, ideally as returned by
+        `get_history_listing`, can be passed in to avoid listing all
+        histories again. Without a tag, the `importable` status of histories
+        is read from the listing if it is available there.
+
+        The required history updates are sent by a pool of `workers` threads.
+        The tag is added to the current tags of each history, not to the ones
+        in the listing, which may be outdated by the time of the update.
+
         Returns the count of newly made accessible histories.
         """
-        updated_count = 0
         if not history_type:
             history_types = list(self.tags)
         else:
@@ -627,24 +901,53 @@ class COGUKSummary():
         for history_type in history_types:
             histories_to_check.update(self.get_history_ids(history_type, gi))
 
-        for h in gi.histories.get_histories():
+        if histories is None:
+            histories = get_history_listing(gi)
+        updates = []
+        for h in histories:
             if h['id'] in histories_to_check:
                 if not tag:
-                    history_data = gi.histories.show_history(h['id'])
-                    if not history_data['importable']:
-                        gi.histories.update_history(
-                            h['id'],
-                            importable=True
-                        )
-                        updated_count += 1
+                    if 'importable' in h:
+                        importable = h['importable']
+                    else:
+                        importable = gi.histories.show_history(
+                            h['id']
+                        )['importable']
+                    if not importable:
+                        updates.append((h['id'], {'importable': True}))
                 elif tag not in h['tags']:
-                    new_tags = h['tags'] + [tag]
-                    gi.histories.update_history(
-                        h['id'],
-                        importable=True,
-                        tags=new_tags
-                    )
+                    updates.append((h['id'], {'importable': True}))
+        if not updates:
+            return 0
+
+        def update_history(history_id, changes):
+            # retries are left to the Galaxy client session
+            gi.histories.update_history(history_id, **changes)
+            if tag:
+                update_history_tags(gi, history_id, [tag])
+
+        updated_count = 0
+        failed = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                (history_id, executor.submit(update_history, history_id, changes))
+                for history_id, changes in updates
+            ]
+            for n, (history_id, future) in enumerate(futures, 1):
+                try:
+                    future.result()
                     updated_count += 1
+                except ConnectionError as e:
+                    failed.append((history_id, e))
+                if n % 100 == 0 or n == len(futures):
+                    print(
+                        'Published {0} of {1} histories ({2} failed)'
+                        .format(updated_count, len(futures), len(failed))
+                    )
+        for history_id, e in failed:
+            print('Failed to make history {0} accessible: {1}'.format(
+                history_id, e
+            ))
         return updated_count
 
     def __sub__(self, other):
@@ -659,7 +962,6 @@ class COGUKSummary():
 
 if __name__ == '__main__':
     import argparse
-    import os
     import sys
 
     parser = argparse.ArgumentParser()
@@ -671,6 +973,15 @@ if __name__ == '__main__':
         '-u', '--use-existing-file', nargs='+',
         help='Preload data stored in the indicated JSON file(s).'
     )
+    parser.add_argument(
+        '--summary-db',
+        help='Keep the summary in the indicated SQLite database (created if '
+             'it does not exist) instead of in memory. New and changed '
+             'records get written to the database, and data from files '
+             'specified via -u gets imported into it. The output file '
+             'specified via -o is still written as an export of the '
+             'database contents.'
+    )
     parser.add_argument(
         '--fix-existing', action='store_true',
         help='Try to complete existing partial records read from file '
@@ -680,12 +991,24 @@ if __name__ == '__main__':
     parser.add_argument(
         '-d', '--discover-new-data', action='store_true',
         help='Search for new analysis batches on a Galaxy server. '
-             'Implied without -u. Requires -g and -a.'
+             'Implied without -u and --summary-db. Requires -g and -a.'
     )
     parser.add_argument(
         '--write-new-only', action='store_true',
         help='Write only newly discovered data. Requires -d.'
     )
+    parser.add_argument(
+        '--full-scan', action='store_true',
+        help='Ignore the history discovery state stored in files read via '
+             '-u and inspect all report and consensus histories again.'
+    )
+    parser.add_argument(
+        '--no-discovery-state', action='store_true',
+        help='Do not store the history discovery state in a state file next '
+             'to the JSON output (named like it plus ".state.json"). Without '
+             'it, the next run based on the output file will have to inspect '
+             'all report and consensus histories again.'
+    )
     parser.add_argument(
         '--make-accessible', action='store_true',
         help='Make all known histories accessible via their recorded links. '
@@ -717,7 +1040,14 @@ if __name__ == '__main__':
     parser.add_argument(
         '--data-download-dir',
         help='The path to the folder the data downloads triggered '
-             'by --check-data-availability should be saved to.'
+             'by --check-data-availability should be saved to. '
+             'A manifest of verified downloads is kept in the folder, and '
+             'records listed in it are not checked again.'
+    )
+    parser.add_argument(
+        '--download-workers', type=int, default=4,
+        help='Number of concurrent downloads to use with '
+             '--check-data-availability (default: 4)'
     )
     parser.add_argument(
         '-s', '--study-accession', nargs='*',
@@ -738,20 +1068,32 @@ if __name__ == '__main__':
     )
 
     args = parser.parse_args()
-    s = COGUKSummary()
+    if args.summary_db:
+        store = SummaryStore(args.summary_db)
+        s = COGUKSummary(
+            store, discovery_state=store.get_meta('discovery_state')
+        )
+    else:
+        store = None
+        s = COGUKSummary()
 
-    if not args.use_existing_file:
+    if not args.use_existing_file and not store:
         if args.fix_existing:
             sys.exit(
                 '--fix-existing requires reading a JSON file specified via -u'
             )
-    else:
-        for f in args.use_existing_file:
-            s.summary.update(
-                COGUKSummary.from_file(f).summary
-            )
+    elif args.use_existing_file:
+        for i, f in enumerate(args.use_existing_file):
+            s_from_file = COGUKSummary.from_file(f)
+            s.summary.update(s_from_file.summary)
+            if i == 0 and not store:
+                s.discovery_state = s_from_file.discovery_state
+            else:
+                s.merge_discovery_state(s_from_file.discovery_state)
+    if args.full_scan:
+        s.discovery_state = COGUKSummary.new_discovery_state()
 
-    if (not args.use_existing_file
+    if (not args.use_existing_file and not store
     ) or (args.discover_new_data
     ) or (args.make_accessible
     ) or (args.fix_existing
@@ -761,7 +1103,12 @@ if __name__ == '__main__':
                 'Getting data from a Galaxy server requires its URL and an '
                 'API key to be specified via the -g and -a options.'
             )
-        gi = galaxy.GalaxyInstance(args.galaxy_url, args.api_key)
+        gi = get_galaxy_instance(
+            args.galaxy_url, args.api_key,
+            max_connections=max(10, args.download_workers)
+        )
+        # list histories only once and use the listing for all operations
+        histories = get_history_listing(gi)
     if args.retain_incomplete and args.completed_only:
         sys.exit(
             '--retain-incomplete and --complete-only are mutually '
@@ -773,8 +1120,10 @@ if __name__ == '__main__':
                 '--fix-existing cannot meaningfully be combined '
                 'with --write-new-only'
             )
-        s.amend(gi)
-    if not args.use_existing_file or args.discover_new_data:
+        s.amend(gi, histories)
+    if (
+        not args.use_existing_file and not store
+    ) or args.discover_new_data:
         if args.study_accession:
             sys.exit(
                 'Cannot combine --study-accession with new data discovery. '
@@ -782,10 +1131,17 @@ if __name__ == '__main__':
                 'added data.'
             )
         if args.write_new_only:
-            old_summary = COGUKSummary(
-                {k:v for k, v in s.summary.items()}
-            )
-        new_records, problematic = s.update(gi)
+            if store:
+                # records changed from here on will be stamped with
+                # the new revision
+                new_revision = store.new_revision()
+            else:
+                old_summary = COGUKSummary(
+                    {k:v for k, v in s.summary.items()}
+                )
+        with get_recorder().span('summary', script='summarize') as span:
+            new_records, problematic = s.update(gi, histories)
+            span['new_batches'] = new_records
         if new_records:
             print('Found a total of {0} new batches.'.format(new_records))
             if not problematic:
@@ -814,8 +1170,18 @@ if __name__ == '__main__':
     elif args.write_new_only:
         sys.exit('--write-new-only works only in combination with -d')
 
+    # s may get replaced by filtered versions of itself from here on
+    # => remember the discovery state to store it with the final output
+    discovery_state = s.discovery_state
+    if store:
+        store.set_meta('discovery_state', discovery_state)
+        store.commit()
+
     if args.write_new_only:
-        s = s - old_summary
+        if store:
+            s = COGUKSummary(dict(store.changed_since(new_revision)))
+        else:
+            s = s - old_summary
 
     if args.study_accession:
         s = COGUKSummary(
@@ -834,11 +1200,17 @@ if __name__ == '__main__':
             }
         )
 
+    if args.check_data_availability:
+        checker = DataAvailabilityChecker(
+            gi, args.data_download_dir, workers=args.download_workers
+        )
+
     if args.check_data_availability or args.completed_only:
         # The by-sample report and the multi-fasta consensus datasets
         # checked here combine information from upstream collections.
         # If they are in an ok state, then everything before must be so, too.
         completed = {}
+        report_infos = {}
         for k, v in s.summary.items():
             # get the IDs of the variation, the report, and the consensus
             # histories in thise order
@@ -853,14 +1225,24 @@ if __name__ == '__main__':
                 continue
 
             dataset_id = v['report']['datamonkey_link'].split('/')[-2]
-            dataset_info = gi.datasets.show_dataset(dataset_id)
-            if dataset_info['state'] != 'ok':
-                print(
-                    'Skipping record for which by-sample report is not ready:',
-                    report_history_id,
-                    '(state: "{0}")'.format(dataset_info['state'])
-                )
-                continue
+            if args.check_data_availability and checker.is_verified(
+                k, dataset_id
+            ):
+                # the report got downloaded successfully before
+                # => it must be in ok state
+                pass
+            else:
+                dataset_info = gi.datasets.show_dataset(dataset_id)
+                # reused when checking the download
+                report_infos[k] = dataset_info
+                if dataset_info['state'] != 'ok':
+                    print(
+                        'Skipping record for which by-sample report is not '
+                        'ready:',
+                        report_history_id,
+                        '(state: "{0}")'.format(dataset_info['state'])
+                    )
+                    continue
             if args.completed_only:
                 # --check-data-availability does not care about the
                 # consensus history state, but --completed-only does.
@@ -886,37 +1268,27 @@ if __name__ == '__main__':
         s = COGUKSummary(completed)
 
     if args.check_data_availability:
-        checked_summary = {}
         # currently the only thing checked/downloaded are the datamonkey links
-        for k, v in s.summary.items():
-            dataset_id = v['report']['datamonkey_link'].split('/')[-2]
-            try:
-                gi.datasets.download_dataset(
-                    dataset_id,
-                    file_path=os.path.join(
-                        args.data_download_dir,
-                        k + '_variants_by_sample.tsv'
-                    ),
-                    use_default_filename=False,
-                    maxwait=0
-                )
-            except galaxy.datasets.DatasetStateException:
-                print(
-                    'Failed to verify datamonkey link for:',
-                    v['report']['history_link']
-                )
-                continue
-            except galaxy.histories.ConnectionError:
-                print(
-                    'Problem retrieving by_sample variant report for:',
-                    v['report']['history_link']
-                )
-                raise
-            checked_summary[k] = v
-        s = COGUKSummary(checked_summary)
+        verified, failed = checker.check(
+            (
+                k,
+                v['report']['datamonkey_link'].split('/')[-2],
+                k + '_variants_by_sample.tsv',
+                report_infos.get(k)
+            ) for k, v in s.summary.items()
+        )
+        for k, problem in failed.items():
+            print(
+                'Failed to verify datamonkey link for:',
+                s.summary[k]['report']['history_link'],
+                '({0})'.format(problem)
+            )
+        s = COGUKSummary(
+            {k: v for k, v in s.summary.items() if k in verified}
+        )
 
     if args.make_accessible:
-        s.make_accessible(gi, tag='bot-published')
+        s.make_accessible(gi, tag='bot-published', histories=histories)
 
     if args.retrieve_meta:
         batches_with_missing_meta = {
@@ -955,17 +1327,24 @@ if __name__ == '__main__':
                 if v.get('study_accession', '?') != '?':
                     study_accessions.add(v['study_accession'])
                 if 'collection_dates' not in v:
-                    s.summary[k]['collection_dates'] = [''] * len(
+                    v['collection_dates'] = [''] * len(
                         v['samples']
                     )
                 for i, sample in enumerate(v['samples']):
                     if sample in meta:
-                        s.summary[k]['collection_dates'][i] = meta[sample][1]
+                        v['collection_dates'][i] = meta[sample][1]
                         study_accessions.add(meta[sample][0])
                 if len(study_accessions) == 1:
-                    s.summary[k]['study_accession'] = study_accessions.pop()
+                    v['study_accession'] = study_accessions.pop()
                 else:
-                    s.summary[k]['study_accession'] = '?'
+                    v['study_accession'] = '?'
+                # records read from a summary store are copies
+                # => write modifications back
+                s.summary[k] = v
+        if store and s.summary is not store:
+            # s holds a filtered copy of the stored summary
+            # => persist the retrieved metadata in the store, too
+            store.update(s.summary)
 
     if args.format_tabular:
         sorted_keys = sorted(
@@ -1017,8 +1396,13 @@ if __name__ == '__main__':
                         file=o
                     )
     else:
-        if args.retain_incomplete:
-            n = s.save(args.ofile, drop_partial=False)
-        else:
-            n = s.save(args.ofile)
+        s.discovery_state = discovery_state
+        n = s.save(
+            args.ofile,
+            drop_partial=not args.retain_incomplete,
+            with_discovery_state=not args.no_discovery_state
+        )
         print('Saved metadata for {0} samples'.format(n))
+
+    if store:
+        store.close()
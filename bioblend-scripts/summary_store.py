@@ -0,0 +1,165 @@
+"""
+SQLite-backed storage for COGUKSummary records.
+
+An alternative to keeping a complete summary in memory and rewriting it as
+one JSON file on every run.
+"""
+
+import json
+import sqlite3
+
+from collections.abc import MutableMapping
+
+
+class SummaryStore(MutableMapping):
+    """A dictionary-like, lazily loading store of summary records.
+
+    Records are kept as JSON strings in an SQLite database and are only
+    deserialized when accessed. Writing a record upserts it, and leaves the
+    database untouched if the stored record is identical already.
+
+    Records returned from the store are independent copies. Modifications to
+    them need to be written back explicitly by assigning the modified record
+    to its key again.
+
+    Every upsert that changes a record stamps it with the store's current
+    `revision` so that changes made since any revision can be retrieved
+    without comparing whole summaries.
+    """
+
+    # Number of records to fetch per query when iterating over the store
+    page_size = 1000
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.conn = sqlite3.connect(fname)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS records (
+                id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                revision INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS records_by_revision
+                ON records (revision);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            """
+        )
+        self.revision = self.get_meta('revision', 0)
+        self.new_revision()
+
+    def new_revision(self):
+        """Start a new revision and return its number.
+
+        All records changed from now on will be stamped with the new
+        revision number.
+        """
+
+        self.revision += 1
+        self.set_meta('revision', self.revision)
+        self.commit()
+        return self.revision
+
+    def get_meta(self, key, default=None):
+        """Return a JSON-serializable value stored alongside the records."""
+
+        row = self.conn.execute(
+            'SELECT value FROM meta WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return default
+        return json.loads(row[0])
+
+    def set_meta(self, key, value):
+        """Store a JSON-serializable value alongside the records."""
+
+        self.conn.execute(
+            'INSERT INTO meta (key, value) VALUES (?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET value = excluded.value',
+            (key, json.dumps(value))
+        )
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def __getitem__(self, key):
+        row = self.conn.execute(
+            'SELECT data FROM records WHERE id = ?', (key,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row[0])
+
+    def __setitem__(self, key, value):
+        self.conn.execute(
+            'INSERT INTO records (id, data, revision) VALUES (?, ?, ?) '
+            'ON CONFLICT(id) DO UPDATE '
+            'SET data = excluded.data, revision = excluded.revision '
+            'WHERE records.data != excluded.data',
+            (key, json.dumps(value), self.revision)
+        )
+
+    def __delitem__(self, key):
+        cur = self.conn.execute('DELETE FROM records WHERE id = ?', (key,))
+        if not cur.rowcount:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return self.conn.execute(
+            'SELECT 1 FROM records WHERE id = ?', (key,)
+        ).fetchone() is not None
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM records').fetchone()[0]
+
+    def __iter__(self):
+        for key, _ in self._iter_rows('id'):
+            yield key
+
+    def _iter_rows(self, columns, where='', params=()):
+        # Page through the table by rowid instead of keeping a single cursor
+        # open so that records can safely be written back during iteration.
+        last_rowid = 0
+        while True:
+            rows = self.conn.execute(
+                'SELECT rowid, {0} FROM records WHERE rowid > ? {1} '
+                'ORDER BY rowid LIMIT ?'.format(columns, where),
+                (last_rowid,) + tuple(params) + (self.page_size,)
+            ).fetchall()
+            if not rows:
+                break
+            for row in rows:
+                yield row[1], row[2:]
+            last_rowid = rows[-1][0]
+
+    def items(self):
+        for key, (data,) in self._iter_rows('id, data'):
+            yield key, json.loads(data)
+
+    def values(self):
+        for _, value in self.items():
+            yield value
+
+    def update(self, other=(), **kwargs):
+        """Upsert several records in one transaction."""
+
+        with self.conn:
+            super().update(other, **kwargs)
+
+    def changed_since(self, revision):
+        """Yield (key, record) tuples of records changed since `revision`.
+
+        Changes made during `revision` itself are included.
+        """
+
+        for key, (data,) in self._iter_rows(
+            'id, data', 'AND revision >= ?', (revision,)
+        ):
+            yield key, json.loads(data)
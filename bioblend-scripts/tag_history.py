@@ -1,56 +1,92 @@
 import argparse
+import os
 
-from bioblend import galaxy
-
-parser = argparse.ArgumentParser()
-parser.add_argument(
-    'history_id',
-    help='ID of the history to work with'
-)
-parser.add_argument(
-    '--dataset-id', default=None,
-    help='ID of the dataset to modify tags for. '
-         'If not given, the history itself will get its tags modified.'
-)
-parser.add_argument(
-    '-t', '--history-tags', nargs='*', default=[],
-    help='One or more tags that should be attached to the history'
-)
-parser.add_argument(
-    '-r', '--remove-tags', nargs='*', default=[],
-    help='One or more tags that should be removed from the history'
-)
-parser.add_argument(
-    '-g', '--galaxy-url', required=True,
-    help='URL of the Galaxy instance to run query against'
-)
-parser.add_argument(
-    '-a', '--api-key', required=True,
-    help='API key to use for authenticating on the Galaxy server'
-)
-args = parser.parse_args()
-
-gi = galaxy.GalaxyInstance(
-        url=args.galaxy_url,
-        key=args.api_key
-    )
-
-if args.dataset_id:
+from galaxy_client import get_galaxy_instance
+from handoff_queue import HandoffQueue
+from instrumentation import get_recorder
+
+
+def update_history_tags(gi, history_id, add_tags=(), remove_tags=()):
+    history = gi.histories.show_history(history_id=history_id)
+    new_tags = list(
+        set(history['tags'] + list(add_tags)) - set(remove_tags)
+    )
+    gi.histories.update_history(history['id'], tags=new_tags)
+    return new_tags
+
+
+def update_dataset_tags(
+    gi, history_id, dataset_id, add_tags=(), remove_tags=()
+):
     dataset = gi.histories.show_dataset(
-        history_id=args.history_id,
-        dataset_id=args.dataset_id
+        history_id=history_id,
+        dataset_id=dataset_id
     )
     new_tags = list(
-        set(dataset['tags'] + args.history_tags) - set(args.remove_tags)
+        set(dataset['tags'] + list(add_tags)) - set(remove_tags)
     )
     gi.histories.update_dataset(
-        history_id=args.history_id,
+        history_id=history_id,
         dataset_id=dataset['id'],
         tags=new_tags
     )
-else:
-    history = gi.histories.show_history(history_id=args.history_id)
-    new_tags = list(
-        set(history['tags'] + args.history_tags) - set(args.remove_tags)
+    return new_tags
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'history_id',
+        help='ID of the history to work with'
     )
-    gi.histories.update_history(history['id'], tags=new_tags)
+    parser.add_argument(
+        '--dataset-id', default=None,
+        help='ID of the dataset to modify tags for. '
+             'If not given, the history itself will get its tags modified.'
+    )
+    parser.add_argument(
+        '-t', '--history-tags', nargs='*', default=[],
+        help='One or more tags that should be attached to the history'
+    )
+    parser.add_argument(
+        '-r', '--remove-tags', nargs='*', default=[],
+        help='One or more tags that should be removed from the history'
+    )
+    parser.add_argument(
+        '-g', '--galaxy-url', required=True,
+        help='URL of the Galaxy instance to run query against'
+    )
+    parser.add_argument(
+        '-a', '--api-key', required=True,
+        help='API key to use for authenticating on the Galaxy server'
+    )
+    args = parser.parse_args()
+
+    gi = get_galaxy_instance(args.galaxy_url, args.api_key)
+    recorder = get_recorder()
+
+    # tagging a history for downstream bots hands a batch over to them
+    handoff_tags = [
+        tag for tag in args.history_tags if tag.startswith('bot-go-')
+    ]
+    with recorder.span(
+        'handoff' if handoff_tags else 'tag',
+        script='tag_history', history_id=args.history_id,
+        dataset_id=args.dataset_id, tags=args.history_tags,
+        removed_tags=args.remove_tags
+    ):
+        if args.dataset_id:
+            update_dataset_tags(
+                gi, args.history_id, args.dataset_id,
+                args.history_tags, args.remove_tags
+            )
+        else:
+            update_history_tags(
+                gi, args.history_id, args.history_tags, args.remove_tags
+            )
+            # lets bots run by bot_daemon.py with the same --handoff-db pick
+            # up the history right away
+            if handoff_tags and os.environ.get('BOT_HANDOFF_DB'):
+                HandoffQueue(os.environ['BOT_HANDOFF_DB']).publish(
+                    args.history_id, handoff_tags
+                )
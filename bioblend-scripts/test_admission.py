@@ -0,0 +1,77 @@
+import pytest
+
+pytest.importorskip('bioblend')
+pytest.importorskip('requests')
+
+import admission  # noqa: E402
+from admission import AdmissionController  # noqa: E402
+
+
+def history(history_id, **states):
+    return {'id': history_id, 'state': 'ok', 'state_details': states}
+
+
+@pytest.fixture
+def listings(monkeypatch):
+    # histories by tag as returned by the histories API
+    listings = {}
+    monkeypatch.setattr(
+        admission, 'list_histories',
+        lambda gi, filters=None, keys=None: listings.get(filters['tag'], [])
+    )
+    return listings
+
+
+def make_controller(**kwargs):
+    return AdmissionController(
+        None, ['variation', 'consensus'], kwargs.pop('job_budget', 100),
+        **kwargs
+    )
+
+
+def test_estimate_from_completed_histories(listings):
+    listings['variation'] = [
+        history('v1', ok=10), history('v2', ok=20), history('v3', ok=30),
+        history('v4', ok=25, running=3, queued=2),
+    ]
+    # histories carrying both tags get counted once
+    listings['consensus'] = [
+        history('c1', ok=2, new=4), history('v4', ok=25, running=3, queued=2)
+    ]
+    controller = make_controller()
+    assert controller.estimate_load() == (5 + 4, 20)
+    assert controller.last_estimate['unscheduled_jobs'] == 0
+
+
+def test_unscheduled_jobs(listings):
+    listings['variation'] = [
+        history('v1', ok=20),
+        # just invoked
+        history('v2'),
+        history('v3', ok=2, queued=3),
+    ]
+    controller = make_controller()
+    outstanding, jobs_per_batch = controller.estimate_load(
+        unstarted_batches=2
+    )
+    assert jobs_per_batch == 20
+    assert controller.last_estimate['unscheduled_jobs'] == 20 + 15 + 2 * 20
+    assert outstanding == 3 + 20 + 15 + 2 * 20
+
+
+def test_admit(listings):
+    listings['variation'] = [history('v1', ok=20), history('v2', running=15)]
+    # 15 running + 5 unscheduled jobs leave room for 4 batches
+    assert make_controller(max_batches=10).admit(10) == 4
+    assert make_controller(max_batches=3).admit(10) == 3
+    assert make_controller(max_batches=10).admit(2) == 2
+    assert make_controller(max_batches=10).admit(10, 1) == 3
+    assert make_controller(job_budget=20).admit(10) == 0
+
+
+def test_admit_without_known_cost(listings):
+    listings['variation'] = [history('v1', running=5)]
+    assert make_controller(max_batches=10).admit(10) == 1
+    # no more batches until the cost of a batch is known
+    assert make_controller(max_batches=10).admit(10, 1) == 0
+    assert make_controller(jobs_per_batch=10, max_batches=10).admit(10) == 9
@@ -0,0 +1,42 @@
+import os
+import shutil
+
+import pytest
+
+pytest.importorskip('bioblend')
+pytest.importorskip('requests')
+
+import bots  # noqa: E402
+from bot_config import load_config  # noqa: E402
+
+
+TEMPLATE = os.path.join(
+    os.path.dirname(__file__), '..', 'job-yml-templates',
+    'consensus-job.yml.eu.sample'
+)
+
+
+class CountingBot(bots.Bot):
+    name = 'counting'
+
+    def tick(self):
+        return self.config.use_server
+
+
+def test_invalid_config_edit_keeps_previous_config(tmp_path):
+    path = str(tmp_path / 'consensus-job.yml')
+    shutil.copy(TEMPLATE, path)
+    config = load_config(path, 'consensus')
+    bot = CountingBot(
+        None, config, bots.HistoryCache(None), bots.BotState(None)
+    )
+    assert bot.safe_tick() == config.use_server
+
+    with open(path, 'w') as o:
+        o.write('#use_server: not a URL\n')
+    # make sure the edit is detected even on coarse-grained file systems
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    assert bot.safe_tick() == config.use_server
+    assert bot.config is config
@@ -0,0 +1,112 @@
+import time
+
+import pytest
+
+pytest.importorskip('bioblend')
+pytest.importorskip('requests')
+
+from claims import Lease, SqliteLeases, TagLeases  # noqa: E402
+
+
+PREFIX = 'test-bot-claim-'
+
+
+def make_tag(nonce, expires):
+    return f'{PREFIX}{nonce}-{expires}'
+
+
+@pytest.fixture
+def leases():
+    return TagLeases(None, PREFIX, settle_time=0)
+
+
+@pytest.fixture
+def sqlite_leases(tmp_path):
+    return SqliteLeases(
+        None, PREFIX, str(tmp_path / 'leases.db'), settle_time=0
+    )
+
+
+def test_parse(leases):
+    expires = int(time.time()) + 60
+    parsed = leases.parse('h1', [
+        'bot-go-test', make_tag('abc', expires), 'other-bot-claim-x-1'
+    ])
+    assert len(parsed) == 1
+    assert parsed[0].resource == 'h1'
+    assert parsed[0].nonce == 'abc'
+    assert parsed[0].expires == expires
+    assert parsed[0].tag == make_tag('abc', expires)
+
+
+@pytest.mark.parametrize('tag', [
+    PREFIX, PREFIX + 'abc', PREFIX + 'abc-', PREFIX + '-123',
+    PREFIX + 'abc-12x'
+])
+def test_parse_malformed_as_expired(leases, tag):
+    parsed = leases.parse('h1', [tag])
+    assert len(parsed) == 1
+    assert parsed[0].expires == 0
+    assert parsed[0].tag == tag
+    assert leases.expired([tag])
+    assert not leases.held([tag])
+
+
+def test_expired_and_held(leases):
+    now = int(time.time())
+    live, dead = make_tag('a', now + 60), make_tag('b', now - 60)
+    assert not leases.expired([])
+    assert not leases.held(['bot-go-test'])
+    assert leases.expired([dead])
+    assert not leases.held([dead])
+    assert not leases.expired([live, dead])
+    assert leases.held([live, dead])
+
+
+def test_holds_lowest_live_nonce(leases):
+    now = int(time.time())
+    ours = Lease('h1', PREFIX, 'b', now + 60)
+    assert leases.holds(ours, [ours.tag])
+    assert not leases.holds(ours, [])
+    assert not leases.holds(ours, [ours.tag, make_tag('a', now + 60)])
+    assert leases.holds(ours, [ours.tag, make_tag('a', now - 60)])
+    assert leases.holds(ours, [ours.tag, make_tag('c', now + 60)])
+
+
+def test_sqlite_reserve(sqlite_leases):
+    now = int(time.time())
+    first = Lease('h1', PREFIX, 'a', now + 60)
+    assert sqlite_leases._reserve(first)
+    assert not sqlite_leases._reserve(Lease('h1', PREFIX, 'b', now + 60))
+    # datasets are keyed by history and dataset ID
+    assert sqlite_leases._reserve(Lease(('h1', 'd1'), PREFIX, 'c', now + 60))
+    assert sqlite_leases._check({'h1': first}) == {'h1': first}
+
+
+def test_sqlite_reserve_replaces_expired(sqlite_leases):
+    now = int(time.time())
+    expired = Lease('h1', PREFIX, 'a', now - 1)
+    assert sqlite_leases._reserve(expired)
+    assert sqlite_leases._check({'h1': expired}) == {}
+    assert sqlite_leases._reserve(Lease('h1', PREFIX, 'b', now + 60))
+
+
+def test_sqlite_extend(sqlite_leases):
+    now = int(time.time())
+    lease = Lease('h1', PREFIX, 'a', now + 60)
+    sqlite_leases._reserve(lease)
+    extended = Lease('h1', PREFIX, 'a', now + 120)
+    assert sqlite_leases._extend(lease, extended)
+    assert sqlite_leases._check({'h1': extended}) == {'h1': extended}
+    # the old tag is no longer the lease's
+    assert not sqlite_leases._extend(lease, Lease('h1', PREFIX, 'a', now))
+
+
+def test_sqlite_forget(sqlite_leases):
+    now = int(time.time())
+    lease = Lease('h1', PREFIX, 'a', now + 60)
+    sqlite_leases._reserve(lease)
+    sqlite_leases._forget('h1', [make_tag('b', now + 60)])
+    assert not sqlite_leases._reserve(Lease('h1', PREFIX, 'c', now + 60))
+    sqlite_leases._forget('h1', [lease.tag])
+    assert sqlite_leases._reserve(Lease('h1', PREFIX, 'c', now + 60))
@@ -0,0 +1,49 @@
+import pytest
+
+from link_scheduler import get_priority, schedule_batches
+
+
+def batch(name, uploaded, size=0, priority=0, element_index=0):
+    return {
+        'name': name, 'uploaded': uploaded, 'size': size,
+        'priority': priority, 'element_index': element_index,
+    }
+
+
+BATCHES = [
+    batch('a', 300, size=10, priority=1),
+    batch('b', 100, size=30),
+    batch('c', None, size=20, priority=2),
+    batch('d', 200, size=10, priority=1),
+    batch('e', 100, size=40, element_index=1),
+]
+
+
+@pytest.mark.parametrize('policy, order', [
+    ('fifo', 'bedac'),
+    ('priority', 'cdabe'),
+    ('smallest', 'dacbe'),
+    ('largest', 'ebcda'),
+])
+def test_schedule_batches(policy, order):
+    scheduled = schedule_batches(BATCHES, policy)
+    assert ''.join(b['name'] for b in scheduled) == order
+
+
+def test_schedule_batches_unknown_policy():
+    with pytest.raises(ValueError):
+        schedule_batches(BATCHES, 'random')
+
+
+@pytest.mark.parametrize('tags, priority', [
+    ([], 0),
+    (['name:batch1'], 0),
+    (['priority'], 1),
+    (['priority:5'], 5),
+    (['priority:2', 'priority:7', 'priority'], 7),
+    (['priority:-3'], 0),
+    (['priority:high'], 0),
+    (['priority:high', 'priority:3'], 3),
+])
+def test_get_priority(tags, priority):
+    assert get_priority(tags) == priority
@@ -0,0 +1,215 @@
+"""
+Upload batch files with download links into a tagged metadata history.
+
+New link files get uploaded with a single request to Galaxy's fetch API per
+collection, which pastes their content into a list collection with the name
+expected by the variation bot. Batches already present in any collection of that name
+in a history with the metadata history tag are skipped.
+
+The metadata history tag gets added only after all uploads are complete, so
+uploads into histories that carry the tag already are refused.
+"""
+
+import argparse
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+
+from find_by_tags import find_histories_by_tags
+from find_collection_elements import get_histories_chunk
+from find_datasets import show_matching_dataset_info
+from galaxy_client import get_galaxy_instance
+from tag_history import update_history_tags
+
+
+def get_batch_id(link_file):
+    """Return the batch identifier encoded in a link file name."""
+
+    return os.path.splitext(os.path.basename(link_file))[0]
+
+
+def find_link_files(paths):
+    link_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            link_files.extend(
+                os.path.join(path, f) for f in sorted(os.listdir(path))
+                if f.endswith('.txt')
+            )
+        else:
+            link_files.append(path)
+    return link_files
+
+
+def get_known_batch_ids(gi, history_tag, collection_name):
+    """Collect the element identifiers of all link collections.
+
+    Only collections named collection_name in histories tagged with
+    history_tag are considered.
+    """
+
+    history_ids = [
+        history_id
+        for histories_chunk in get_histories_chunk(gi)
+        for history_id in find_histories_by_tags([history_tag], histories_chunk)
+    ]
+    known = set()
+    for history_id in history_ids:
+        collections = show_matching_dataset_info(
+            gi, history_id, [collection_name],
+            visible=True, types=['dataset_collection'],
+            include_invocation_inputs=False
+        )[0]
+        for collection in collections:
+            elements = gi.histories.show_dataset_collection(
+                history_id, collection['id']
+            )['elements']
+            known.update(element['element_identifier'] for element in elements)
+    return known
+
+
+def upload_link_collection(gi, history_id, collection_name, link_files):
+    """Paste link files into a new list collection with one API request.
+
+    Element identifiers are the batch identifiers derived from the file
+    names.
+    """
+
+    elements = []
+    for link_file in link_files:
+        with open(link_file) as i:
+            elements.append({
+                'src': 'pasted',
+                'paste_content': i.read(),
+                'name': get_batch_id(link_file),
+                'ext': 'txt'
+            })
+    payload = {
+        'history_id': history_id,
+        'targets': [{
+            'destination': {'type': 'hdca'},
+            'collection_type': 'list',
+            'name': collection_name,
+            'elements': elements
+        }]
+    }
+    return gi.make_post_request(
+        '{0}/api/tools/fetch'.format(gi.base_url), payload=payload
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'link_files', nargs='+',
+        help='Link files to upload, or directories with link files ending '
+             'in ".txt". A file\'s name without extension is used as the '
+             'batch identifier.'
+    )
+    parser.add_argument(
+        '-g', '--galaxy-url', required=True,
+        help='URL of the Galaxy instance to upload to'
+    )
+    parser.add_argument(
+        '-a', '--api-key', required=True,
+        help='API key to use for authenticating on the Galaxy server'
+    )
+    parser.add_argument(
+        '-t', '--history-tag', required=True,
+        help='Tag that identifies link histories to the variation bot '
+             '(metadata_history_tag in the bot config)'
+    )
+    parser.add_argument(
+        '-c', '--collection-name', required=True,
+        help='Name of the link collection expected by the variation bot '
+             '(metadata_collection_name in the bot config)'
+    )
+    parser.add_argument(
+        '-i', '--history-id',
+        help='ID of the history to upload to, which must not carry the '
+             'history tag yet. By default, a new history gets created.'
+    )
+    parser.add_argument(
+        '-n', '--history-name', default='Download links',
+        help='Name of the new history to create if no --history-id is given'
+    )
+    parser.add_argument(
+        '-m', '--max-elements', type=int,
+        help='Maximum number of link files per collection. Larger '
+             'submissions get uploaded concurrently as several collections '
+             'of the same name.'
+    )
+    parser.add_argument(
+        '-w', '--workers', type=int, default=4,
+        help='Maximum number of collections to upload concurrently '
+             '(default: 4)'
+    )
+    parser.add_argument(
+        '--no-skip-known', action='store_false', dest='skip_known',
+        help='Upload link files even if a batch of the same name exists in '
+             'a tagged history already'
+    )
+    args = parser.parse_args()
+
+    gi = get_galaxy_instance(
+        args.galaxy_url, args.api_key, max_connections=max(10, args.workers)
+    )
+    if args.history_id:
+        history = gi.histories.show_history(args.history_id)
+        if args.history_tag in history['tags']:
+            # the bot would see collections that are still being filled
+            parser.error(
+                f'History {args.history_id} is tagged with '
+                f'"{args.history_tag}" already; upload to a new history '
+                'instead'
+            )
+
+    link_files = {}
+    for link_file in find_link_files(args.link_files):
+        batch_id = get_batch_id(link_file)
+        if batch_id in link_files:
+            raise ValueError(
+                f'Duplicate batch identifier "{batch_id}" in link files'
+            )
+        link_files[batch_id] = link_file
+    if args.skip_known:
+        for batch_id in get_known_batch_ids(
+            gi, args.history_tag, args.collection_name
+        ):
+            if link_files.pop(batch_id, None):
+                print(f'Skipping known batch: {batch_id}')
+    if not link_files:
+        print('No new batches to upload.')
+        raise SystemExit
+
+    if not args.history_id:
+        history = gi.histories.create_history(args.history_name)
+
+    new_files = list(link_files.values())
+    chunk_size = args.max_elements or len(new_files)
+    chunks = [
+        new_files[i:i + chunk_size]
+        for i in range(0, len(new_files), chunk_size)
+    ]
+
+    def upload_chunk(chunk):
+        r = upload_link_collection(
+            gi, history['id'], args.collection_name, chunk
+        )
+        # wait for the pasted datasets to become ready so that the bot
+        # does not pick up links that are still being uploaded
+        for collection in r['output_collections']:
+            gi.dataset_collections.wait_for_dataset_collection(
+                collection['id']
+            )
+        return chunk
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for chunk in executor.map(upload_chunk, chunks):
+            print(
+                'Uploaded {0} batches to collection "{1}" in history {2}'
+                .format(len(chunk), args.collection_name, history['id'])
+            )
+
+    # tag the history only after the upload to make it visible to the bot
+    update_history_tags(gi, history['id'], [args.history_tag])
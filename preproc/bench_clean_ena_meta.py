@@ -0,0 +1,144 @@
+"""
+Compare the filter engines of clean_ena_meta on a synthetic ENA export.
+
+Generates a metadata file with a realistic mix of valid and invalid records,
+cleans it with every engine and reports run times after verifying that all
+engines produced identical output.
+"""
+
+import argparse
+import contextlib
+import hashlib
+import io
+import os
+import random
+import tempfile
+import time
+
+import clean_ena_meta
+
+
+COLUMNS = [
+    'study_accession', 'accession', 'experiment_accession', 'run_accession',
+    'checklist', 'collection_date', 'library_layout', 'library_strategy',
+    'library_construction_protocol', 'instrument_platform',
+    'instrument_model', 'library_name', 'run_alias', 'sample_alias',
+    'fastq_ftp', 'fastq_md5'
+]
+
+
+def make_links(rng, run):
+    base = f'ftp.sra.ebi.ac.uk/vol1/fastq/{run[:6]}/{run}/{run}'
+    kind = rng.choices(
+        ['paired', 'paired+unpaired', 'single', 'paired_1_only'],
+        [80, 8, 10, 2]
+    )[0]
+    if kind == 'paired':
+        return [f'{base}_1.fastq.gz', f'{base}_2.fastq.gz']
+    if kind == 'paired+unpaired':
+        return [f'{base}.fastq.gz', f'{base}_1.fastq.gz', f'{base}_2.fastq.gz']
+    if kind == 'single':
+        return [f'{base}.fastq.gz']
+    return [f'{base}_1.fastq.gz']
+
+
+def write_synthetic_export(fname, nrecords, seed=1):
+    rng = random.Random(seed)
+    with open(fname, 'w') as o:
+        o.write('\t'.join(COLUMNS) + '\n')
+        for i in range(nrecords):
+            run = f'ERR{5000000 + i}'
+            links = make_links(rng, run)
+            layout = 'SINGLE' if len(links) == 1 else 'PAIRED'
+            if rng.random() < 0.02:
+                # layout does not match the links
+                layout = 'SINGLE' if layout == 'PAIRED' else 'PAIRED'
+            record = [
+                'PRJEB37886',
+                # some samples have more than one run
+                f'SAMEA{7000000 + i - (rng.random() < 0.01)}',
+                f'ERX{4000000 + i}',
+                run,
+                'ERC000033' if rng.random() < 0.95 else '',
+                rng.choice(
+                    [f'2021-{rng.randint(1, 12):02}-{rng.randint(1, 28):02}']
+                    * 18 + ['2020-01-01', '']
+                ),
+                layout,
+                rng.choice(['AMPLICON'] * 9 + ['WGS']),
+                rng.choice(['ARTIC v3', 'ARTIC v4', 'ARTIC v4.1', '']),
+                rng.choice(['ILLUMINA'] * 4 + ['OXFORD_NANOPORE']),
+                rng.choice(['Illumina MiSeq', 'NextSeq 500', 'NovaSeq 6000']),
+                f'B{i // 384:05} / {i % 384}',
+                f'COG{i} - CENTRE:{i // 384}:x',
+                f'COG{i}',
+                ';'.join(links),
+                ';'.join(f'{rng.getrandbits(128):032x}' for _ in links)
+            ]
+            o.write('\t'.join(record) + '\n')
+
+
+def run_engine(fname, engine, processes, **kwargs):
+    out = io.StringIO()
+    start = time.perf_counter()
+    with open(fname) as i, contextlib.redirect_stdout(io.StringIO()):
+        s = clean_ena_meta.main(
+            i, out, verbose=False, processes=processes, engine=engine,
+            **kwargs
+        )
+    elapsed = time.perf_counter() - start
+    checksum = hashlib.md5(out.getvalue().encode()).hexdigest()
+    return elapsed, checksum, s
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-n', '--records', type=int, default=2000000,
+        help='Number of records in the synthetic export'
+    )
+    parser.add_argument(
+        '-p', '--processes', type=int, nargs='+', default=[1],
+        help='Numbers of worker processes to benchmark'
+    )
+    parser.add_argument(
+        '--engines', nargs='+', choices=list(clean_ena_meta.ENGINES),
+        default=list(clean_ena_meta.ENGINES)
+    )
+    parser.add_argument(
+        '--ll', '--library-layout', default=None,
+        help='library_layout to filter for'
+    )
+    parser.add_argument(
+        '--ls', '--library-strategy', default=None,
+        help='library_strategy to filter for'
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fname = os.path.join(tmp_dir, 'ena_export.tsv')
+        print(f'Generating {args.records} records ...')
+        write_synthetic_export(fname, args.records)
+        size = os.path.getsize(fname)
+        print(f'Size of export: {size / 2 ** 20:.1f} MiB')
+
+        results = {}
+        for engine in args.engines:
+            for processes in args.processes:
+                elapsed, checksum, s = run_engine(
+                    fname, engine, processes,
+                    filter_by_library_layout=args.ll,
+                    filter_by_library_strategy=args.ls
+                )
+                results[engine, processes] = (
+                    checksum, s.skipped_by_reason,
+                    s.features_by_column, s.sample_count
+                )
+                print(
+                    f'{engine:>10} x{processes:<3} {elapsed:8.2f} s '
+                    f'{args.records / elapsed:12.0f} records/s '
+                    f'{size / 2 ** 20 / elapsed:8.1f} MiB/s'
+                )
+    if len(set(map(repr, results.values()))) > 1:
+        raise SystemExit('Engines produced different results!')
+    print('All engines produced identical results.')
@@ -1,80 +1,825 @@
 import argparse
+import contextlib
+import cProfile
+import csv
+import gzip
+import hashlib
+import heapq
+import importlib
+import io
+import itertools
+import json
+import math
+import os
+import re
+import resource
+import stat
+import sys
+import time
 
-from collections import Counter
+from array import array
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+
+from filter_expressions import compile_filter
+from seen_index import SeenIndex
+
+
+# Size of read and write buffers for metadata files
+IO_BUFFER_SIZE = 1024 * 1024
+
+# Magic numbers of supported compression formats
+# bgzip output is a series of gzip members and handled like gzip.
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+def _import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError(
+            'Reading or writing zstd-compressed files requires the '
+            'zstandard package'
+        )
+    return zstandard
+
+
+def _timed(iterable, timings, stage):
+    # Pass through the items of iterable adding the time spent on
+    # producing them to timings[stage].
+    it = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(it)
+        except StopIteration:
+            timings[stage] += time.perf_counter() - start
+            return
+        timings[stage] += time.perf_counter() - start
+        yield item
+
+
+def _import_pandas():
+    try:
+        import pandas
+    except ImportError:
+        raise ImportError(
+            'The columnar filter engine requires the pandas package'
+        )
+    return pandas
+
+
+def open_input(path):
+    """Open a metadata file for reading text.
+
+    gzip-, bgzip- and zstd-compressed input is detected from its first bytes
+    and decompressed on the fly. A path of "-" reads from standard input.
+    """
+
+    if path == '-':
+        raw = sys.stdin.buffer
+    else:
+        raw = open(path, 'rb', buffering=IO_BUFFER_SIZE)
+    magic = raw.peek(4)[:4]
+    if magic[:2] == GZIP_MAGIC:
+        if path == '-':
+            raw = gzip.GzipFile(fileobj=raw)
+        else:
+            # a GzipFile does not close a file object passed to it, so let
+            # it open the file itself
+            raw.close()
+            raw = gzip.open(path, 'rb')
+        raw = io.BufferedReader(raw, IO_BUFFER_SIZE)
+    elif magic == ZSTD_MAGIC:
+        zstandard = _import_zstandard()
+        raw = io.BufferedReader(
+            zstandard.ZstdDecompressor().stream_reader(
+                raw, read_size=IO_BUFFER_SIZE, read_across_frames=True,
+                closefd=True
+            ),
+            IO_BUFFER_SIZE
+        )
+    return io.TextIOWrapper(raw, encoding='utf-8')
+
+
+def open_output(path):
+    """Open a file for writing text.
+
+    Output gets gzip- or zstd-compressed if the path ends in ".gz" or ".zst",
+    respectively. A path of "-" writes to standard output.
+    """
+
+    if path == '-':
+        return sys.stdout
+    if path.endswith('.gz'):
+        raw = gzip.open(path, 'wb', compresslevel=6)
+    elif path.endswith('.zst'):
+        zstandard = _import_zstandard()
+        raw = zstandard.ZstdCompressor().stream_writer(
+            open(path, 'wb'), closefd=True
+        )
+    else:
+        raw = open(path, 'wb')
+    return io.TextIOWrapper(
+        io.BufferedWriter(raw, IO_BUFFER_SIZE), encoding='utf-8'
+    )
+
+
+# Columns for which value frequencies get reported
+REPORTED_COLUMNS = [
+    'library_layout',
+    'library_strategy',
+    'library_construction_protocol',
+    'instrument_platform',
+    'instrument_model'
+]
+
+
+class AccessionCounter():
+    """Compact exact counter of accession occurrences.
+
+    Accessions of the usual letter-prefix plus digits form are packed into
+    64-bit integers and kept in an array, i.e. they take up 8 bytes per
+    occurrence. Anything else is counted in a regular Counter.
+    The array gets sorted in place in chunks of sort_chunk_size codes, so
+    sorting needs only a bounded amount of additional memory.
+    """
+
+    accession_pattern = re.compile(r'([A-Z]{1,8})(\d{1,12})')
+    # sorting goes through a list of Python ints, which takes about 36 bytes
+    # per code
+    sort_chunk_size = 1 << 20
+
+    def __init__(self):
+        self._codes = array('q')
+        self._prefixes = {}
+        self._prefix_list = []
+        # number of distinct codes and the codes seen more than once
+        self._summary = (0, [])
+        self.other = Counter()
+
+    def add(self, accession):
+        m = self.accession_pattern.fullmatch(accession)
+        if m is None:
+            self.other[accession] += 1
+            return
+        prefix, digits = m.groups()
+        prefix_idx = self._prefixes.get(prefix)
+        if prefix_idx is None:
+            prefix_idx = self._prefixes[prefix] = len(self._prefix_list)
+            self._prefix_list.append(prefix)
+        # the number of digits is part of the code so that accessions
+        # differing only in leading zeros stay distinct
+        self._codes.append(
+            (prefix_idx << 44) | (len(digits) << 40) | int(digits)
+        )
+        self._summary = None
+
+    def update(self, other):
+        """Add all occurrences counted by another AccessionCounter."""
+
+        for prefix in other._prefix_list:
+            if prefix not in self._prefixes:
+                self._prefixes[prefix] = len(self._prefix_list)
+                self._prefix_list.append(prefix)
+        if self._prefix_list[:len(other._prefix_list)] == other._prefix_list:
+            # prefixes are encoded the same way in both counters
+            self._codes.extend(other._codes)
+        else:
+            remap = [self._prefixes[prefix] for prefix in other._prefix_list]
+            self._codes.extend(
+                (remap[code >> 44] << 44) | (code & (2 ** 44 - 1))
+                for code in other._codes
+            )
+        self.other.update(other.other)
+        self._summary = None
+
+    def _decode(self, code):
+        ndigits = (code >> 40) & 0xF
+        return self._prefix_list[code >> 44] + str(
+            code & (2 ** 40 - 1)
+        ).zfill(ndigits)
+
+    def _iter_sorted(self):
+        # sort the codes in place chunk by chunk and merge the chunks
+        codes = self._codes
+        bounds = []
+        for start in range(0, len(codes), self.sort_chunk_size):
+            end = min(start + self.sort_chunk_size, len(codes))
+            codes[start:end] = array('q', sorted(codes[start:end]))
+            bounds.append((start, end))
+        if len(bounds) <= 1:
+            return iter(codes)
+        return heapq.merge(*(
+            (codes[i] for i in range(start, end)) for start, end in bounds
+        ))
+
+    def _summarize(self):
+        # count distinct codes and collect duplicates in a single pass
+        if self._summary is None:
+            distinct, duplicates = 0, []
+            last, count = None, 0
+            for code in self._iter_sorted():
+                if code == last:
+                    count += 1
+                    if count == 2:
+                        duplicates.append(code)
+                else:
+                    distinct += 1
+                    last, count = code, 1
+            self._summary = distinct, duplicates
+        return self._summary
+
+    def __len__(self):
+        """The number of distinct accessions."""
+
+        return self._summarize()[0] + len(self.other)
+
+    def duplicates(self):
+        """Return the accessions seen more than once."""
+
+        return [
+            self._decode(code) for code in self._summarize()[1]
+        ] + [acc for acc, count in self.other.items() if count > 1]
+
+
+class HyperLogLog():
+    """Approximate counter of distinct values with fixed memory use."""
+
+    def __init__(self, p=14):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(self.m)
+
+    def add(self, value):
+        x = int.from_bytes(
+            hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big'
+        )
+        idx = x >> (64 - self.p)
+        rest = x & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def update(self, other):
+        """Merge the registers of another HyperLogLog of the same size."""
+
+        self.registers = bytearray(
+            max(a, b) for a, b in zip(self.registers, other.registers)
+        )
+
+    def __len__(self):
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m ** 2 / sum(
+            2.0 ** -r for r in self.registers
+        )
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.m and zeros:
+            # small range correction
+            estimate = self.m * math.log(self.m / zeros)
+        return int(round(estimate))
 
 
 class ENAMetaSummary():
+    # number of records between progress reports
+    progress_interval = 100000
+    # upper limit for the size of the input chunks handled by worker
+    # processes in parallel mode
+    max_chunk_size = 64 * 1024 * 1024
+
     def __init__(
         self, meta_in,
         filter_by_library_layout=None,
         filter_by_library_strategy=None,
-        check_fastqs=True
+        check_fastqs=True,
+        count_distinct=None,
+        processes=1,
+        header=None,
+        seen_index=None,
+        only_new=False,
+        filter_expression=None,
+        time_stages=False
     ):
         self.meta_in = meta_in
         self.filter_by_library_layout = filter_by_library_layout
         self.filter_by_library_strategy = filter_by_library_strategy
         self.check_fastqs = check_fastqs
-        self.header = meta_in.readline()
+        self.count_distinct = count_distinct
+        self.processes = processes
+        self.seen_index = seen_index
+        self.only_new = only_new
+        self.filter_expression = filter_expression
+        # accumulated seconds spent per processing stage
+        self.time_stages = time_stages
+        self.timings = Counter()
+        self.parallel = False
+        if header is None:
+            header = meta_in.readline()
+        self.header = header
         self.col_lookup = {
             name: idx for idx, name in enumerate(
                 self.header.strip().split('\t')
             )
         }
+        if filter_expression:
+            self.record_filter = compile_filter(
+                filter_expression, self.col_lookup
+            )
+        else:
+            self.record_filter = None
+        # Keep value frequencies only for the columns that get reported.
+        # Counting every column would let memory grow with rows x columns
+        # because of unique-per-row fields like fastq_ftp or run_accession.
         self.features_by_column = {
-            name: Counter() for name in self.col_lookup
+            name: Counter() for name in REPORTED_COLUMNS
+            if name in self.col_lookup
+        }
+        self.accessions = AccessionCounter()
+        # optional approximate distinct counts for any other columns
+        for name in count_distinct or []:
+            if name not in self.col_lookup:
+                raise ValueError(
+                    f'Cannot count distinct values of unknown column "{name}"'
+                )
+        self.distinct_by_column = {
+            name: HyperLogLog() for name in count_distinct or []
         }
+        self.records_read = 0
         self.skipped_records = 0
+        self.skipped_by_reason = Counter()
+        self.records_seen = 0
+        # index keys of written records not added to the seen_index yet
+        self.written_keys = []
 
     def __iter__(self):
-        for line in self.meta_in:
+        for line, fields in self.iter_records():
+            yield line
+            # the consumer asks for the next line only after writing this one
+            self.mark_written(fields)
+
+    def mark_written(self, fields):
+        """Remember that a record has been written to the output.
+
+        Only written records get added to the seen_index, so records
+        dropped after the filters, e.g. by a country hook, get passed on
+        again by the next run.
+        """
+
+        if self.seen_index is None:
+            return
+        self.written_keys.extend(
+            self.seen_index.record_keys(
+                fields[self.col_lookup['run_accession']],
+                fields[self.col_lookup['fastq_md5']]
+                if 'fastq_md5' in self.col_lookup else ''
+            )
+        )
+
+    def flush_written(self):
+        """Add the keys of written records to the seen_index.
+
+        The keys are not committed; that is up to the owner of the index,
+        once the output is complete.
+        """
+
+        if self.seen_index is not None and self.written_keys:
+            self.seen_index.add(self.written_keys)
+            self.written_keys = []
+
+    def iter_records(self):
+        """Yield (line, fields) tuples of all kept records."""
+
+        records = self._iter_kept()
+        if self.seen_index is not None:
+            records = self._check_seen(records)
+        if self.time_stages:
+            records = _timed(records, self.timings, 'records')
+        yield from records
+
+    def stage_timings(self):
+        """Return the seconds spent on parsing and filtering records.
+
+        Input reading and decompression count as parsing. In parallel mode,
+        times are summed over all worker processes.
+        """
+
+        if self.parallel:
+            filter_time = self.timings['filter']
+        else:
+            filter_time = self.timings['records'] - self.timings['parse']
+        return {'parse': self.timings['parse'], 'filter': filter_time}
+
+    def _check_seen(self, records):
+        # Look up records in batches in the index of records seen in earlier
+        # runs and drop seen records if requested. New records get added to
+        # the index through mark_written.
+        run_col = self.col_lookup['run_accession']
+        md5_col = self.col_lookup.get('fastq_md5')
+        while True:
+            batch = list(itertools.islice(records, 10000))
+            if not batch:
+                break
+            batch_keys = [
+                self.seen_index.record_keys(
+                    fields[run_col],
+                    fields[md5_col] if md5_col is not None else ''
+                ) for line, fields in batch
+            ]
+            # records of the previous batches written by now count as seen
+            self.flush_written()
+            seen = self.seen_index.lookup(set().union(*batch_keys))
+            for record, keys in zip(batch, batch_keys):
+                if not seen.isdisjoint(keys):
+                    self.records_seen += 1
+                    if self.only_new:
+                        self.skipped_records += 1
+                        self.skipped_by_reason['seen_before'] += 1
+                        continue
+                yield record
+
+    def _iter_kept(self):
+        # yield (line, fields) tuples of all records passing the filters
+        path = self._get_chunkable_path()
+        if path and self.processes > 1:
+            self.parallel = True
+            yield from self._filter_parallel(path)
+        else:
+            lines = self.meta_in
+            if self.time_stages:
+                lines = _timed(lines, self.timings, 'parse')
+            next_report = self.progress_interval
+            for record in self._filter_lines(lines):
+                yield record
+                if self.records_read >= next_report:
+                    self._report_progress()
+                    next_report += self.progress_interval * (
+                        1 + (self.records_read - next_report)
+                        // self.progress_interval
+                    )
+        self._report_progress()
+
+    def _report_progress(self):
+        print(
+            f'Records processed: {self.records_read}, '
+            f'skipped: {self.skipped_records}'
+        )
+
+    def _filter_lines(self, lines):
+        for line in lines:
             trunc_line = line.strip('\n\r')
             if trunc_line:
+                self.records_read += 1
                 self.skipped_records += 1
-                fields = line.split('\t')
+                fields = trunc_line.split('\t')
                 if not fields[self.col_lookup['checklist']]:
-                    print('-', end='')
+                    self.skipped_by_reason['no_checklist'] += 1
                     continue
                 coll_date = fields[self.col_lookup['collection_date']]
                 if coll_date == '2020-01-01' or not coll_date:
-                    print('!', end='')
+                    self.skipped_by_reason['bad_collection_date'] += 1
                     continue
                 library_layout = fields[self.col_lookup['library_layout']]
                 library_strategy = fields[self.col_lookup['library_strategy']]
-                library_construction_protocol = fields[self.col_lookup['library_construction_protocol']]
                 link_field = fields[self.col_lookup['fastq_ftp']]
-                links = link_field.split(';')
                 if self.check_fastqs:
+                    link_count = link_field.count(';') + 1
                     if library_layout == 'SINGLE':
-                        if len(links) != 1:
+                        if link_count != 1:
+                            self.skipped_by_reason['single_link_count'] += 1
                             continue
                     elif library_layout == 'PAIRED':
-                        if len(links) < 2 or len(links) > 3:
-                            print('o', end='')
+                        if link_count < 2 or link_count > 3:
+                            self.skipped_by_reason['paired_link_count'] += 1
                             continue
                         elif '_1' not in link_field or '_2' not in link_field:
-                            print('f', end='')
+                            self.skipped_by_reason['paired_link_names'] += 1
                             continue
 
                 # record is technically ok
+                self.accessions.add(fields[self.col_lookup['accession']])
                 for feature in self.features_by_column:
                     self.features_by_column[feature][
                         fields[self.col_lookup[feature]]
                     ] += 1
+                for column, counter in self.distinct_by_column.items():
+                    counter.add(fields[self.col_lookup[column]])
                 if self.filter_by_library_layout:
                     if library_layout != self.filter_by_library_layout:
+                        self.skipped_by_reason['library_layout'] += 1
                         continue
                 if self.filter_by_library_strategy:
                     if library_strategy != self.filter_by_library_strategy:
+                        self.skipped_by_reason['library_strategy'] += 1
                         continue
+                if self.record_filter and not self.record_filter(fields):
+                    self.skipped_by_reason['filter_expression'] += 1
+                    continue
 
                 # record is of a class that we want to keep
                 self.skipped_records -= 1
-                yield line
-        print()
+                yield line, fields
+
+    def _get_chunkable_path(self):
+        # Return the path of the input if it is an uncompressed regular file
+        # that can be split into byte ranges, None otherwise.
+        raw = getattr(getattr(self.meta_in, 'buffer', None), 'raw', None)
+        if isinstance(raw, io.FileIO) and isinstance(raw.name, str):
+            if os.path.isfile(raw.name):
+                return raw.name
+        return None
+
+    def _get_chunks(self, path):
+        # Split the data part of the file into byte ranges that end
+        # on line boundaries.
+        with open(path, 'rb') as f:
+            f.readline()
+            start = f.tell()
+            size = os.fstat(f.fileno()).st_size
+            chunk_size = max(
+                1024 * 1024,
+                min(
+                    self.max_chunk_size,
+                    (size - start) // (self.processes * 4) + 1
+                )
+            )
+            chunks = []
+            while start < size:
+                f.seek(min(start + chunk_size, size))
+                f.readline()
+                end = min(f.tell(), size)
+                chunks.append((start, end))
+                start = end
+        return chunks
+
+    def _filter_parallel(self, path):
+        options = {
+            'filter_by_library_layout': self.filter_by_library_layout,
+            'filter_by_library_strategy': self.filter_by_library_strategy,
+            'check_fastqs': self.check_fastqs,
+            'count_distinct': self.count_distinct,
+            'header': self.header,
+            'filter_expression': self.filter_expression,
+            'time_stages': self.time_stages
+        }
+        chunks = self._get_chunks(path)
+        with ProcessPoolExecutor(max_workers=self.processes) as executor:
+            # Keep only a limited number of chunks in flight and consume
+            # results in submission order to write records in input order.
+            pending = deque()
+            chunks = iter(chunks)
+            for start, end in itertools.islice(chunks, self.processes * 2):
+                pending.append(
+                    executor.submit(
+                        _filter_chunk, type(self), path, start, end, options
+                    )
+                )
+            while pending:
+                kept_lines, chunk_summary = pending.popleft().result()
+                for start, end in itertools.islice(chunks, 1):
+                    pending.append(
+                        executor.submit(
+                            _filter_chunk, type(self), path, start, end,
+                            options
+                        )
+                    )
+                self._merge(chunk_summary)
+                for line in kept_lines:
+                    yield line, line.rstrip('\n').split('\t')
+                if pending:
+                    self._report_progress()
+
+    def _merge(self, other):
+        # add the statistics collected by another instance
+        self.records_read += other.records_read
+        self.skipped_records += other.skipped_records
+        self.skipped_by_reason.update(other.skipped_by_reason)
+        self.timings.update(other.timings)
+        self.accessions.update(other.accessions)
+        for column, counter in self.features_by_column.items():
+            counter.update(other.features_by_column[column])
+        for column, counter in self.distinct_by_column.items():
+            counter.update(other.distinct_by_column[column])
 
     @property
     def sample_count(self):
-        return len(self.features_by_column['accession'])
+        return len(self.accessions)
+
+
+class ColumnarENAMetaSummary(ENAMetaSummary):
+    """ENAMetaSummary variant applying its filters to batches of records.
+
+    Batches of input lines are parsed into pandas data frames holding only
+    the columns needed for filtering and for the summary. Filters are
+    applied as vectorized masks, and value frequencies are computed per
+    batch. The kept records are the original input lines so the output is
+    identical to that of the line-based ENAMetaSummary.
+
+    Requires pandas.
+    """
+
+    # number of records per batch
+    batch_size = 100000
+
+    def __init__(self, *args, **kwargs):
+        self.pd = _import_pandas()
+        super().__init__(*args, **kwargs)
+        self.columns = self.header.strip().split('\t')
+        self.usecols = sorted(
+            set(
+                ['accession', 'checklist', 'collection_date',
+                 'library_layout', 'library_strategy', 'fastq_ftp']
+            ) | set(self.features_by_column) | set(self.distinct_by_column)
+            | set(self.record_filter.columns if self.record_filter else []),
+            key=self.col_lookup.get
+        )
+
+    def _filter_lines(self, lines):
+        lines = iter(lines)
+        while True:
+            batch = [
+                line for line in itertools.islice(lines, self.batch_size)
+                if line.strip('\n\r')
+            ]
+            if not batch:
+                break
+            start = time.perf_counter()
+            df = self._parse_batch(batch)
+            self.timings['parse'] += time.perf_counter() - start
+            keep = self._filter_batch(df)
+            for line, kept in zip(batch, keep):
+                if kept:
+                    yield line, line.strip('\n\r').split('\t')
+
+    def _parse_batch(self, batch):
+        return self.pd.read_csv(
+            io.StringIO(''.join(batch)),
+            sep='\t', header=None, names=self.columns, usecols=self.usecols,
+            index_col=False, dtype=str, na_filter=False,
+            quoting=csv.QUOTE_NONE
+        )
+
+    def _count_skipped(self, keep, mask, reason):
+        # drop records failing mask from those kept so far and count them
+        failing = int((keep & ~mask).sum())
+        if failing:
+            self.skipped_by_reason[reason] += failing
+        return keep & mask
+
+    def _filter_batch(self, df):
+        # returns a boolean numpy array of the records to keep
+        keep = self.pd.Series(True, index=df.index)
+        keep = self._count_skipped(keep, df['checklist'] != '', 'no_checklist')
+        coll_date = df['collection_date']
+        keep = self._count_skipped(
+            keep, (coll_date != '2020-01-01') & (coll_date != ''),
+            'bad_collection_date'
+        )
+        library_layout = df['library_layout']
+        if self.check_fastqs:
+            link_field = df['fastq_ftp']
+            link_count = link_field.str.count(';') + 1
+            single = library_layout == 'SINGLE'
+            paired = library_layout == 'PAIRED'
+            keep = self._count_skipped(
+                keep, ~single | (link_count == 1), 'single_link_count'
+            )
+            keep = self._count_skipped(
+                keep, ~paired | ((link_count >= 2) & (link_count <= 3)),
+                'paired_link_count'
+            )
+            keep = self._count_skipped(
+                keep,
+                ~paired | (
+                    link_field.str.contains('_1', regex=False)
+                    & link_field.str.contains('_2', regex=False)
+                ),
+                'paired_link_names'
+            )
+
+        # records that are technically ok
+        ok = df[keep]
+        for accession in ok['accession']:
+            self.accessions.add(accession)
+        for feature, counter in self.features_by_column.items():
+            # grouping without sorting preserves the order of first
+            # occurrence like counting record by record does
+            values = ok[feature]
+            counter.update(values.groupby(values, sort=False).size().to_dict())
+        for column, counter in self.distinct_by_column.items():
+            for value in ok[column].unique():
+                counter.add(value)
+
+        if self.filter_by_library_layout:
+            keep = self._count_skipped(
+                keep, library_layout == self.filter_by_library_layout,
+                'library_layout'
+            )
+        if self.filter_by_library_strategy:
+            keep = self._count_skipped(
+                keep,
+                df['library_strategy'] == self.filter_by_library_strategy,
+                'library_strategy'
+            )
+        if self.record_filter:
+            keep = self._count_skipped(
+                keep, self.record_filter.mask(df), 'filter_expression'
+            )
+
+        self.records_read += len(df)
+        self.skipped_records += len(df) - int(keep.sum())
+        return keep.to_numpy()
+
+
+# Summary classes implementing the available filter engines
+ENGINES = {
+    'lines': ENAMetaSummary,
+    'columnar': ColumnarENAMetaSummary
+}
+
+
+def _filter_chunk(summary_class, path, start, end, options):
+    # Worker process function filtering the records in a byte range
+    # of the input file.
+    # Returns the kept lines and the summary with the collected statistics.
+    read_start = time.perf_counter()
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    # Universal newlines mode like for regular text file input
+    chunk_in = io.StringIO(data.decode('utf-8'), newline=None)
+    s = summary_class(chunk_in, **options)
+    s.timings['parse'] += time.perf_counter() - read_start
+    lines = chunk_in
+    if s.time_stages:
+        lines = _timed(lines, s.timings, 'parse')
+    filter_start = time.perf_counter()
+    parse_time = s.timings['parse']
+    kept_lines = [line for line, fields in s._filter_lines(lines)]
+    s.timings['filter'] += (
+        time.perf_counter() - filter_start
+        - (s.timings['parse'] - parse_time)
+    )
+    s.meta_in = None
+    # the pandas module cannot be pickled
+    s.__dict__.pop('pd', None)
+    return kept_lines, s
+
+
+# Batch-id hooks of country-specific wrapper modules by country name
+COUNTRY_HOOKS = {}
+
+
+def register_country(name):
+    """Register the batch-id hook of a country.
+
+    Use as a decorator on a function that gets called once with the
+    col_lookup of the metadata and returns a function computing the
+    batch_id of a record from its list of fields. Records for which that
+    function returns None get dropped.
+    """
+
+    def register(hook):
+        COUNTRY_HOOKS[name] = hook
+        return hook
+    return register
+
+
+def get_country_hook(name):
+    """Return the registered hook of a country.
+
+    Hooks are looked up in the clean_<name>_meta module, which gets
+    imported if necessary.
+    """
+
+    if name not in COUNTRY_HOOKS:
+        try:
+            importlib.import_module(f'clean_{name}_meta')
+        except ImportError:
+            pass
+    if name not in COUNTRY_HOOKS:
+        raise ValueError(f'No batch-id hook registered for country "{name}"')
+    return COUNTRY_HOOKS[name]
+
+
+def make_batch_id_modifier(country):
+    """Return a main mod_func that prepends the batch_id of the country.
+
+    The batch-id function works on the fields of records as parsed by the
+    summary already, so records are not split a second time.
+    """
+
+    hook = get_country_hook(country)
+
+    def prepend_batch_id(s):
+        get_batch_id = hook(s.col_lookup)
+        yield 'batch_id\t' + s.header
+        for record_line, fields in s.iter_records():
+            batch_id = get_batch_id(fields)
+            if batch_id is not None:
+                yield batch_id + '\t' + record_line
+                s.mark_written(fields)
+    return prepend_batch_id
 
 
 def main(
@@ -84,33 +829,75 @@ def main(
     check_fastqs=True,
     skip_dups=False,
     mod_func=None,
-    verbose=True
+    verbose=True,
+    count_distinct=None,
+    processes=1,
+    engine='lines',
+    seen_index=None,
+    only_new=False,
+    filter_expression=None,
+    time_stages=False
 ):
-    """Call this function from importing code that defines custom modifiers."""
+    """Call this function from importing code that defines custom modifiers.
+
+    seen_index can be the path of an index file, which gets committed and
+    closed after all records have been written to meta_out, or an open
+    SeenIndex, which the caller should commit once the output is complete.
+    A mod_func has to call mark_written(fields) on the summary for every
+    record it passes on for the record to get added to the index.
+    """
 
-    s = ENAMetaSummary(
+    if only_new and seen_index is None:
+        raise ValueError('only_new requires a seen_index')
+    if seen_index is None or isinstance(seen_index, SeenIndex):
+        index = seen_index
+    else:
+        index = SeenIndex(seen_index)
+    s = ENGINES[engine](
         meta_in,
         filter_by_library_layout,
         filter_by_library_strategy,
-        check_fastqs
+        check_fastqs,
+        count_distinct,
+        processes,
+        seen_index=index,
+        only_new=only_new,
+        filter_expression=filter_expression,
+        time_stages=time_stages
     )
     if mod_func:
         it = mod_func(s)
     else:
         it = s
         meta_out.write(s.header)
-    for record_line in it:
-        meta_out.write(record_line)
+    if time_stages:
+        # time the pipeline, the writing and, by difference, the hook
+        timings = Counter()
+        for record_line in _timed(it, timings, 'pipeline'):
+            start = time.perf_counter()
+            meta_out.write(record_line)
+            timings['write'] += time.perf_counter() - start
+        s.timings['write'] = timings['write']
+        s.timings['hook'] = (
+            timings['pipeline'] - s.timings['records'] if mod_func else 0.0
+        )
+    else:
+        for record_line in it:
+            meta_out.write(record_line)
+    s.flush_written()
+    if index is not None and index is not seen_index:
+        meta_out.flush()
+        index.close()
 
     if verbose:
         print('Valid samples in file:', s.sample_count)
         print('Skipped records:', s.skipped_records)
+        for reason, count in sorted(s.skipped_by_reason.items()):
+            print(f'\t{reason}\t{count}')
+        if index is not None:
+            print('Records seen in earlier runs:', s.records_seen)
         print('Checking for duplicate samples ...', end=' ')
-        duplicate_accs = [
-            acc for acc, count in
-            s.features_by_column['accession'].items()
-            if count > 1
-        ]
+        duplicate_accs = s.accessions.duplicates()
         if duplicate_accs:
             print('Duplicates found!')
             print(
@@ -141,17 +928,29 @@ def main(
         for model, count in s.features_by_column['instrument_model'].items():
             print(f'\t{model}\t{count}')
 
+        if s.distinct_by_column:
+            print('Approximate numbers of distinct values:')
+            for column, counter in s.distinct_by_column.items():
+                print(f'\t{column}\t{len(counter)}')
+
     return s
 
 
 parser = argparse.ArgumentParser()
+parser.add_argument(
+    '--country',
+    help='Prepend a batch_id column computed by the hook registered for '
+         'this country (e.g. "uk", "greek" or "estonian")'
+)
 parser.add_argument(
     'ifile',
-    help='Name of the metadata input file'
+    help='Name of the metadata input file, which may be gzip-, bgzip- or '
+         'zstd-compressed. Use "-" to read from standard input.'
 )
 parser.add_argument(
     '-o', '--ofile', required=True,
-    help='Name of the output file'
+    help='Name of the output file. Output gets compressed if the name ends '
+         'in ".gz" or ".zst". Use "-" to write to standard output.'
 )
 parser.add_argument(
     '--ll', '--library-layout', default=None,
@@ -170,7 +969,179 @@ parser.add_argument(
          'e.g. "AMPLICON"'
 )
 
-if __name__ == '__main__':
+parser.add_argument(
+    '-p', '--processes', type=int, default=1,
+    help='Number of worker processes to filter records with. '
+         'Parallel filtering requires uncompressed file input.'
+)
+parser.add_argument(
+    '--engine', choices=list(ENGINES), default='lines',
+    help='Filter records line by line or in batches of parsed columns. '
+         'The columnar engine requires pandas and yields identical output.'
+)
+parser.add_argument(
+    '--filter', metavar='EXPRESSION',
+    help='Keep only records matching this filter expression, e.g. '
+         '"instrument_platform == \'ILLUMINA\' and '
+         'collection_date >= \'2021-06-01\'". Expressions can compare '
+         'column values to strings or numbers, test membership with "in" '
+         'and combine tests with "and", "or" and "not".'
+)
+parser.add_argument(
+    '--seen-index', metavar='FILE',
+    help='SQLite index of the run accessions and fastq checksums of '
+         'records seen in earlier runs. Gets created if it does not exist '
+         'and is updated with the new records of this run.'
+)
+parser.add_argument(
+    '--only-new', action='store_true',
+    help='Keep only records whose run accession and fastq checksums are '
+         'not in the --seen-index yet'
+)
+parser.add_argument(
+    '--count-distinct', nargs='+', metavar='COLUMN',
+    help='Report approximate numbers of distinct values in the retained '
+         'records for these columns'
+)
+parser.add_argument(
+    '--stats-json', metavar='FILE',
+    help='Write run statistics, i.e. record counts per skip reason, '
+         'throughput, peak memory use and time spent per processing stage, '
+         'to this file as JSON'
+)
+parser.add_argument(
+    '--profile', metavar='FILE',
+    help='Profile the run with cProfile and dump the profiling data to '
+         'this file'
+)
+
+def get_input_size(meta_in):
+    """Return the size in bytes of a regular input file, None otherwise.
+
+    For compressed input this is the compressed size.
+    """
+
+    try:
+        st = os.fstat(meta_in.fileno())
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+    return st.st_size if stat.S_ISREG(st.st_mode) else None
+
+
+def get_run_stats(s, wall_time, input_size=None):
+    """Collect machine-readable statistics about a finished run."""
+
+    records_kept = s.records_read - s.skipped_records
+    # ru_maxrss is reported in kilobytes on Linux
+    rusage_self = resource.getrusage(resource.RUSAGE_SELF)
+    rusage_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    stages = s.stage_timings()
+    stages['hook'] = s.timings['hook']
+    stages['write'] = s.timings['write']
+    return {
+        'records_read': s.records_read,
+        'records_kept': records_kept,
+        'records_skipped': s.skipped_records,
+        'skipped_by_reason': dict(sorted(s.skipped_by_reason.items())),
+        'records_seen_before': s.records_seen,
+        'valid_samples': s.sample_count,
+        'columns': len(s.col_lookup),
+        'wall_time_seconds': wall_time,
+        'records_per_second': s.records_read / wall_time if wall_time else None,
+        'input_bytes': input_size,
+        'bytes_per_second': (
+            input_size / wall_time if input_size and wall_time else None
+        ),
+        'peak_rss_bytes': rusage_self.ru_maxrss * 1024,
+        'peak_rss_children_bytes': rusage_children.ru_maxrss * 1024,
+        'stage_seconds': stages,
+        'features_by_column': {
+            column: dict(counter)
+            for column, counter in s.features_by_column.items()
+        }
+    }
+
+
+def run_from_args(args, **kwargs):
+    """Run main with files opened as specified on the command line.
+
+    Any keyword arguments are passed on to main.
+    Statistics and profiling data get written as requested by the
+    --stats-json and --profile options.
+    """
+
+    i = open_input(args.ifile)
+    o = open_output(args.ofile)
+    input_size = get_input_size(i)
+    index = None
+    if kwargs.get('seen_index'):
+        # committed only once the output is complete
+        index = kwargs['seen_index'] = SeenIndex(kwargs['seen_index'])
+    if args.stats_json:
+        kwargs['time_stages'] = True
+    profiler = cProfile.Profile() if args.profile else None
+    start = time.perf_counter()
+    try:
+        if profiler:
+            profiler.enable()
+        if o is sys.stdout:
+            # keep standard output clean for the records
+            with contextlib.redirect_stdout(sys.stderr):
+                s = main(i, o, **kwargs)
+        else:
+            s = main(i, o, **kwargs)
+    except BaseException:
+        if index is not None:
+            index.discard()
+        raise
+    finally:
+        if profiler:
+            profiler.disable()
+        i.close()
+        if o is sys.stdout:
+            o.flush()
+        else:
+            o.close()
+    if index is not None:
+        index.close()
+    wall_time = time.perf_counter() - start
+    if profiler:
+        profiler.dump_stats(args.profile)
+    if args.stats_json:
+        with open(args.stats_json, 'w') as stats_out:
+            json.dump(
+                get_run_stats(s, wall_time, input_size),
+                stats_out, indent=2
+            )
+    return s
+
+
+def run_cli(country=None):
+    """Entry point shared by this module and the country wrappers.
+
+    A country passed here is used unless --country is given.
+    """
+
+    if country:
+        parser.set_defaults(country=country)
     args = parser.parse_args()
-    with open(args.ifile) as i, open(args.ofile, 'w') as o:
-        _ = main(i, o, args.ll, args.ls, args.check_fastqs)
+    return run_from_args(
+        args,
+        mod_func=make_batch_id_modifier(args.country) if args.country else None,
+        filter_by_library_layout=args.ll,
+        filter_by_library_strategy=args.ls,
+        check_fastqs=args.check_fastqs,
+        count_distinct=args.count_distinct,
+        processes=args.processes,
+        engine=args.engine,
+        seen_index=args.seen_index,
+        only_new=args.only_new,
+        filter_expression=args.filter
+    )
+
+
+if __name__ == '__main__':
+    # Make country modules importing this module while it runs as a script
+    # register their hooks here instead of in a second copy of the module.
+    sys.modules.setdefault('clean_ena_meta', sys.modules[__name__])
+    _ = run_cli()
@@ -1,14 +1,16 @@
 import clean_ena_meta
 
 
-def prepend_batch_id(s):
-    yield 'batch_id\t' + s.header
-    for record_line in s:
-        batch_id = 'EST' + record_line.split('\t')[s.col_lookup['library_name']]
-        yield batch_id + '\t' + record_line
+@clean_ena_meta.register_country('estonian')
+def get_batch_id_func(col_lookup):
+    library_name_col = col_lookup['library_name']
+
+    def get_batch_id(fields):
+        return 'EST' + fields[library_name_col]
+    return get_batch_id
 
-if __name__ == '__main__':
-    args = clean_ena_meta.parser.parse_args()
 
-    with open(args.ifile) as i, open(args.ofile, 'w') as o:
-        _ = clean_ena_meta.main(i, o, args.ll, args.ls, args.check_fastqs, mod_func=prepend_batch_id)
+prepend_batch_id = clean_ena_meta.make_batch_id_modifier('estonian')
+
+if __name__ == '__main__':
+    _ = clean_ena_meta.run_cli(country='estonian')
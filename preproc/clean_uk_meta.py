@@ -1,16 +1,17 @@
 import clean_ena_meta
 
 
-def prepend_batch_id(s):
-    yield 'batch_id\t' + s.header
-    for record_line in s:
-        run_alias = record_line.split('\t')[s.col_lookup['library_name']]
-        batch_id = run_alias.partition(' / ')[0]
-        if batch_id:
-            yield batch_id + '\t' + record_line
+@clean_ena_meta.register_country('uk')
+def get_batch_id_func(col_lookup):
+    library_name_col = col_lookup['library_name']
+
+    def get_batch_id(fields):
+        batch_id = fields[library_name_col].partition(' / ')[0]
+        return batch_id or None
+    return get_batch_id
 
-if __name__ == '__main__':
-    args = clean_ena_meta.parser.parse_args()
 
-    with open(args.ifile) as i, open(args.ofile, 'w') as o:
-        _ = clean_ena_meta.main(i, o, args.ll, mod_func=prepend_batch_id)
+prepend_batch_id = clean_ena_meta.make_batch_id_modifier('uk')
+
+if __name__ == '__main__':
+    _ = clean_ena_meta.run_cli(country='uk')
@@ -0,0 +1,228 @@
+"""
+A small expression language for filtering metadata records.
+
+Expressions use Python syntax restricted to column names, string and number
+literals, comparisons, "in"/"not in" tests and the boolean operators "and",
+"or" and "not", e.g.:
+
+    instrument_platform == 'ILLUMINA' and collection_date >= '2021-06-01'
+    library_strategy in ('AMPLICON', 'WGS') and not 'v3' in library_construction_protocol
+    read_count > 100000
+
+Comparisons to numbers compare column values numerically. Values that are
+not numbers never compare equal, less or greater than a number. "<literal>
+in <column>" tests for substrings.
+
+Expressions are validated and compiled once, with column indexes resolved
+up front, into a plain Python function over the fields of a record, or into
+vectorized masks over pandas data frames.
+"""
+
+import ast
+import math
+import operator
+
+
+COMPARISON_OPERATORS = {
+    ast.Eq: ('==', operator.eq),
+    ast.NotEq: ('!=', operator.ne),
+    ast.Lt: ('<', operator.lt),
+    ast.LtE: ('<=', operator.le),
+    ast.Gt: ('>', operator.gt),
+    ast.GtE: ('>=', operator.ge),
+}
+
+
+def _as_number(value):
+    try:
+        return float(value)
+    except ValueError:
+        return math.nan
+
+
+class RecordFilter():
+    """A compiled filter expression.
+
+    Calling an instance with the list of fields of a record returns whether
+    the record passes the filter.
+    """
+
+    def __init__(self, expression, col_lookup):
+        self.expression = expression
+        self.col_lookup = col_lookup
+        try:
+            self.tree = ast.parse(expression.strip(), mode='eval').body
+        except SyntaxError as e:
+            raise ValueError(
+                f'Invalid filter expression "{expression}": {e.msg}'
+            )
+        self.columns = []
+        # literal values referenced by the generated source as _c[<index>];
+        # not every value has a repr that evaluates back to it, e.g. inf
+        self.constants = []
+        source = self._to_source(self.tree)
+        self._predicate = eval(
+            compile(f'lambda f: bool({source})', '<filter>', 'eval'),
+            {
+                '__builtins__': {}, 'bool': bool, '_as_number': _as_number,
+                '_c': tuple(self.constants)
+            }
+        )
+
+    def __call__(self, fields):
+        return self._predicate(fields)
+
+    def __getstate__(self):
+        # compiled functions cannot be pickled => recompile on unpickling
+        return {'expression': self.expression, 'col_lookup': self.col_lookup}
+
+    def __setstate__(self, state):
+        self.__init__(state['expression'], state['col_lookup'])
+
+    def _error(self, node, problem):
+        return ValueError(
+            'Invalid filter expression "{0}": {1} at "{2}"'.format(
+                self.expression, problem, ast.unparse(node)
+            )
+        )
+
+    def _column(self, node):
+        if node.id not in self.col_lookup:
+            raise self._error(node, 'unknown column')
+        if node.id not in self.columns:
+            self.columns.append(node.id)
+        return self.col_lookup[node.id]
+
+    def _constant(self, node):
+        if isinstance(node, ast.Constant) and isinstance(
+            node.value, (str, int, float)
+        ) and not isinstance(node.value, bool):
+            return node.value
+        raise self._error(node, 'expected a string or number')
+
+    def _literal(self, value):
+        # Return source code referring to a literal value.
+        self.constants.append(value)
+        return f'_c[{len(self.constants) - 1}]'
+
+    def _constants(self, node):
+        if isinstance(node, (ast.Tuple, ast.List, ast.Set)):
+            return tuple(self._constant(elt) for elt in node.elts)
+        raise self._error(node, 'expected a tuple or list of values')
+
+    def _to_source(self, node):
+        # Translate a validated expression into Python source code operating
+        # on a list f of record fields.
+        if isinstance(node, ast.BoolOp):
+            op = ' and ' if isinstance(node.op, ast.And) else ' or '
+            return '(' + op.join(
+                self._to_source(value) for value in node.values
+            ) + ')'
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            return f'(not {self._to_source(node.operand)})'
+        if isinstance(node, ast.Compare):
+            comparisons = []
+            left = node.left
+            for op, right in zip(node.ops, node.comparators):
+                comparisons.append(self._comparison_source(left, op, right))
+                left = right
+            return '(' + ' and '.join(comparisons) + ')'
+        raise self._error(node, 'unsupported syntax')
+
+    def _comparison_source(self, left, op, right):
+        if isinstance(op, (ast.In, ast.NotIn)):
+            negate = 'not ' if isinstance(op, ast.NotIn) else ''
+            if isinstance(left, ast.Name):
+                values = tuple(str(v) for v in self._constants(right))
+                return (
+                    f'({negate}f[{self._column(left)}] in '
+                    f'{self._literal(values)})'
+                )
+            if isinstance(right, ast.Name):
+                substring = self._constant(left)
+                return (
+                    f'({negate}{self._literal(str(substring))} in '
+                    f'f[{self._column(right)}])'
+                )
+            raise self._error(left, 'expected a column name')
+        if type(op) not in COMPARISON_OPERATORS:
+            raise self._error(left, 'unsupported comparison')
+        symbol = COMPARISON_OPERATORS[type(op)][0]
+        if isinstance(left, ast.Name) and isinstance(right, ast.Name):
+            return (
+                f'(f[{self._column(left)}] {symbol} f[{self._column(right)}])'
+            )
+        if isinstance(right, ast.Name):
+            # normalize to <column> <op> <value>
+            left, right = right, left
+            symbol = {'<': '>', '<=': '>=', '>': '<', '>=': '<='}.get(
+                symbol, symbol
+            )
+        if not isinstance(left, ast.Name):
+            raise self._error(left, 'expected a column name')
+        value = self._literal(self._constant(right))
+        if isinstance(self.constants[-1], str):
+            return f'(f[{self._column(left)}] {symbol} {value})'
+        return f'(_as_number(f[{self._column(left)}]) {symbol} {value})'
+
+    def mask(self, df):
+        """Evaluate the expression on a data frame of records.
+
+        The data frame must have string columns named like the metadata
+        columns. Returns a boolean Series.
+        """
+
+        return self._mask(self.tree, df)
+
+    def _mask(self, node, df):
+        # the expression is known to be valid at this point
+        if isinstance(node, ast.BoolOp):
+            masks = [self._mask(value, df) for value in node.values]
+            result = masks[0]
+            for mask in masks[1:]:
+                if isinstance(node.op, ast.And):
+                    result = result & mask
+                else:
+                    result = result | mask
+            return result
+        if isinstance(node, ast.UnaryOp):
+            return ~self._mask(node.operand, df)
+        result = None
+        left = node.left
+        for op, right in zip(node.ops, node.comparators):
+            mask = self._comparison_mask(left, op, right, df)
+            result = mask if result is None else result & mask
+            left = right
+        return result
+
+    def _comparison_mask(self, left, op, right, df):
+        if isinstance(op, (ast.In, ast.NotIn)):
+            if isinstance(left, ast.Name):
+                mask = df[left.id].isin(
+                    [str(v) for v in self._constants(right)]
+                )
+            else:
+                mask = df[right.id].str.contains(
+                    str(self._constant(left)), regex=False
+                )
+            return ~mask if isinstance(op, ast.NotIn) else mask
+        compare = COMPARISON_OPERATORS[type(op)][1]
+        if isinstance(left, ast.Name) and isinstance(right, ast.Name):
+            return compare(df[left.id], df[right.id])
+        if isinstance(right, ast.Name):
+            # evaluate <value> <op> <column> directly
+            value, column, swapped = self._constant(left), right.id, True
+        else:
+            value, column, swapped = self._constant(right), left.id, False
+        values = df[column]
+        if not isinstance(value, str):
+            values = values.map(_as_number).astype(float)
+        if swapped:
+            return compare(value, values)
+        return compare(values, value)
+
+
+def compile_filter(expression, col_lookup):
+    """Compile a filter expression for records with the given columns."""
+
+    return RecordFilter(expression, col_lookup)
@@ -0,0 +1,89 @@
+"""
+Persistent index of the sequencing runs seen in earlier metadata cleaning
+runs.
+
+Weekly ENA exports overlap to a large extent. Checking cleaned records
+against this index allows to pass on only the records of runs that have not
+been seen before.
+"""
+
+import sqlite3
+
+
+class SeenIndex():
+    """An SQLite-backed set of run accessions and fastq checksums.
+
+    Keys are stored as "<kind>:<value>" strings, e.g. "run:ERR5000000" or
+    "md5:e4b06ce60741c7a87ce42c8218072e8c".
+    """
+
+    # Maximum number of keys per lookup query
+    # (SQLite limits the number of parameters of a statement)
+    lookup_size = 500
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.conn = sqlite3.connect(fname)
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('PRAGMA synchronous = NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS seen (key TEXT PRIMARY KEY) '
+            'WITHOUT ROWID'
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def record_keys(run_accession, fastq_md5=''):
+        """Return the index keys of a record.
+
+        fastq_md5 is the ";"-separated list of checksums of the record's
+        fastq files as found in ENA metadata.
+        """
+
+        keys = []
+        if run_accession:
+            keys.append('run:' + run_accession)
+        keys.extend(
+            'md5:' + checksum for checksum in fastq_md5.split(';') if checksum
+        )
+        return keys
+
+    def lookup(self, keys):
+        """Return the subset of keys that are in the index."""
+
+        keys = list(keys)
+        found = set()
+        for i in range(0, len(keys), self.lookup_size):
+            chunk = keys[i:i + self.lookup_size]
+            found.update(
+                row[0] for row in self.conn.execute(
+                    'SELECT key FROM seen WHERE key IN ({0})'.format(
+                        ', '.join('?' * len(chunk))
+                    ),
+                    chunk
+                )
+            )
+        return found
+
+    def add(self, keys):
+        self.conn.executemany(
+            'INSERT OR IGNORE INTO seen (key) VALUES (?)',
+            ((key,) for key in keys)
+        )
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM seen').fetchone()[0]
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def discard(self):
+        """Close the index without committing keys added since the last
+        commit."""
+
+        self.conn.rollback()
+        self.conn.close()
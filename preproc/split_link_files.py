@@ -0,0 +1,234 @@
+"""
+Turn cleaned metadata with a batch_id column into per-batch link files.
+
+Writes one file of "<sample_id>: <link>" lines per batch as expected by
+ftp_links_to_yaml.py. Batches with more samples than a configurable maximum
+get split into several files.
+
+Records are grouped by batch with an external sort, so that the number of
+batches, and the size of the input, is not limited by the number of files
+that can be open at the same time or by the available memory.
+"""
+
+import argparse
+import heapq
+import itertools
+import os
+import re
+import tempfile
+
+from clean_ena_meta import open_input
+
+
+class LinkFileSplitter():
+    """Group link records by batch and write them to link files."""
+
+    def __init__(
+        self, out_dir,
+        id_column='run_accession',
+        link_column='fastq_ftp',
+        max_batch_size=None,
+        buffer_size=500000,
+        max_open_files=64
+    ):
+        self.out_dir = out_dir
+        self.id_column = id_column
+        self.link_column = link_column
+        self.max_batch_size = max_batch_size
+        # number of records to sort in memory before spilling to disk
+        self.buffer_size = buffer_size
+        # maximum number of sorted runs to merge at once
+        self.max_open_files = max(2, max_open_files)
+        self.files_written = []
+        # batch IDs by the names of the link files written for them
+        self.batch_ids_written = {}
+
+    def split(self, meta_in):
+        """Write link files for all records of a cleaned metadata file.
+
+        Returns the list of link files written.
+        """
+
+        header = meta_in.readline()
+        col_lookup = {
+            name: idx for idx, name in enumerate(
+                header.strip('\n\r').split('\t')
+            )
+        }
+        for column in ('batch_id', self.id_column, self.link_column):
+            if column not in col_lookup:
+                raise ValueError(
+                    f'Column "{column}" not found in metadata header'
+                )
+        records = self._iter_records(meta_in, col_lookup)
+        with tempfile.TemporaryDirectory(dir=self.out_dir) as tmp_dir:
+            self._write_link_files(self._sort(records, tmp_dir))
+        return self.files_written
+
+    def _iter_records(self, meta_in, col_lookup):
+        # yield (batch_id, link lines) tuples of all records
+        batch_col = col_lookup['batch_id']
+        id_col = col_lookup[self.id_column]
+        link_col = col_lookup[self.link_column]
+        for line in meta_in:
+            fields = line.strip('\n\r').split('\t')
+            if len(fields) <= max(batch_col, id_col, link_col):
+                continue
+            links = [link for link in fields[link_col].split(';') if link]
+            if len(links) > 2:
+                # paired data with an additional file of unpaired reads
+                links = [
+                    link for link in links
+                    if re.search(r'_[12]\.[^/]+$', link)
+                ]
+            if links:
+                yield fields[batch_col], [
+                    f'{fields[id_col]}: {link}' for link in links
+                ]
+
+    def _sort(self, records, tmp_dir):
+        # Sort records by batch_id keeping the input order within batches.
+        # Sorted runs that do not fit into memory get spilled to disk and
+        # are merged afterwards.
+        runs = []
+        while True:
+            buffer = list(itertools.islice(records, self.buffer_size))
+            if not buffer:
+                break
+            buffer.sort(key=lambda record: record[0])
+            if not runs and len(buffer) < self.buffer_size:
+                # everything fits into memory
+                return iter(buffer)
+            runs.append(self._write_run(buffer, tmp_dir))
+        # merge runs in several passes if there are too many to open at once
+        while len(runs) > self.max_open_files:
+            merged = []
+            for i in range(0, len(runs), self.max_open_files):
+                group = runs[i:i + self.max_open_files]
+                merged.append(
+                    self._write_run(self._merge_runs(group), tmp_dir)
+                )
+            runs = merged
+        return self._merge_runs(runs)
+
+    def _write_run(self, records, tmp_dir):
+        fd, path = tempfile.mkstemp(dir=tmp_dir, suffix='.run')
+        with open(fd, 'w') as o:
+            for batch_id, link_lines in records:
+                # link lines cannot contain tabs since they are TSV fields
+                o.write(batch_id + '\t' + '\t'.join(link_lines) + '\n')
+        return path
+
+    def _read_run(self, path):
+        with open(path) as i:
+            for line in i:
+                batch_id, *link_lines = line.rstrip('\n').split('\t')
+                yield batch_id, link_lines
+        os.remove(path)
+
+    def _merge_runs(self, runs):
+        # heapq.merge is stable so records from earlier runs come first
+        return heapq.merge(
+            *(self._read_run(path) for path in runs),
+            key=lambda record: record[0]
+        )
+
+    def _write_link_files(self, sorted_records):
+        for batch_id, batch_records in itertools.groupby(
+            sorted_records, key=lambda record: record[0]
+        ):
+            if self.max_batch_size:
+                parts = iter(lambda: list(
+                    itertools.islice(batch_records, self.max_batch_size)
+                ), [])
+            else:
+                parts = [batch_records]
+            for part_no, part in enumerate(parts, 1):
+                name = self.get_link_file_name(batch_id, part_no)
+                if name in self.batch_ids_written:
+                    # the batch ID gets derived from the file name when
+                    # uploading, so one batch would replace the other
+                    raise ValueError(
+                        'Batches "{0}" and "{1}" would both be written to '
+                        '{2}'.format(
+                            self.batch_ids_written[name], batch_id, name
+                        )
+                    )
+                self.batch_ids_written[name] = batch_id
+                path = os.path.join(self.out_dir, name)
+                with open(path, 'w') as o:
+                    o.write(f'{self.id_column}: {self.link_column}\n')
+                    for _, link_lines in part:
+                        for link_line in link_lines:
+                            o.write(link_line + '\n')
+                self.files_written.append(path)
+
+    @staticmethod
+    def get_link_file_name(batch_id, part_no=1):
+        safe_batch_id = re.sub(r'[^\w.-]', '_', batch_id) or 'no_batch_id'
+        if part_no > 1:
+            return f'{safe_batch_id}-{part_no}.txt'
+        return f'{safe_batch_id}.txt'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'ifile',
+        help='Cleaned metadata file with a batch_id column as produced by '
+             'the clean_*_meta.py scripts. Use "-" to read from standard '
+             'input.'
+    )
+    parser.add_argument(
+        '-o', '--out-dir', required=True,
+        help='Directory to write link files to'
+    )
+    parser.add_argument(
+        '--id-column', default='run_accession',
+        help='Metadata column with the sample IDs to use in link files'
+    )
+    parser.add_argument(
+        '--link-column', default='fastq_ftp',
+        help='Metadata column with ";"-separated download links'
+    )
+    parser.add_argument(
+        '-m', '--max-batch-size', type=int,
+        help='Maximum number of samples per link file. Larger batches get '
+             'split into files named <batch_id>-2.txt, <batch_id>-3.txt, ...'
+    )
+    parser.add_argument(
+        '--force', action='store_true',
+        help='Write link files even if the output directory is not empty, '
+             'replacing files of the same name'
+    )
+    parser.add_argument(
+        '--buffer-size', type=int, default=500000,
+        help='Number of records to group in memory before spilling sorted '
+             'records to temporary files'
+    )
+    parser.add_argument(
+        '--max-open-files', type=int, default=64,
+        help='Maximum number of temporary files to merge at once'
+    )
+    args = parser.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    if os.listdir(args.out_dir) and not args.force:
+        parser.error(
+            f'Output directory {args.out_dir} is not empty; use --force to '
+            'write link files to it anyway'
+        )
+    splitter = LinkFileSplitter(
+        args.out_dir,
+        id_column=args.id_column,
+        link_column=args.link_column,
+        max_batch_size=args.max_batch_size,
+        buffer_size=args.buffer_size,
+        max_open_files=args.max_open_files
+    )
+    with open_input(args.ifile) as i:
+        try:
+            files_written = splitter.split(i)
+        except ValueError as e:
+            parser.exit(1, f'{e}\n')
+    print(f'Wrote {len(files_written)} link files to {args.out_dir}')
@@ -0,0 +1,66 @@
+import io
+
+import clean_ena_meta
+
+from bench_clean_ena_meta import write_synthetic_export
+
+
+@clean_ena_meta.register_country('test_odd_runs')
+def keep_odd_runs(col_lookup):
+    run_col = col_lookup['run_accession']
+
+    def get_batch_id(fields):
+        # drops the records of even-numbered runs
+        return 'odd' if int(fields[run_col][3:]) % 2 else None
+    return get_batch_id
+
+
+@clean_ena_meta.register_country('test_all_runs')
+def keep_all_runs(col_lookup):
+    return lambda fields: 'all'
+
+
+def run(fname, country, seen_index):
+    out = io.StringIO()
+    with open(fname) as i:
+        clean_ena_meta.main(
+            i, out, verbose=False, check_fastqs=False,
+            mod_func=clean_ena_meta.make_batch_id_modifier(country),
+            seen_index=seen_index, only_new=True
+        )
+    return {
+        line.split('\t')[4] for line in out.getvalue().splitlines()[1:]
+    }
+
+
+def test_records_dropped_by_hook_are_not_seen(tmp_path):
+    fname = tmp_path / 'export.tsv'
+    seen_index = str(tmp_path / 'seen.db')
+    write_synthetic_export(fname, 200)
+
+    first = run(fname, 'test_odd_runs', seen_index)
+    assert first
+    assert all(int(run[3:]) % 2 for run in first)
+
+    second = run(fname, 'test_all_runs', seen_index)
+    assert second
+    assert all(int(run[3:]) % 2 == 0 for run in second)
+    assert not first & second
+
+    assert run(fname, 'test_all_runs', seen_index) == set()
+
+
+def test_accession_counter_sorts_in_chunks():
+    counter = clean_ena_meta.AccessionCounter()
+    counter.sort_chunk_size = 3
+    accessions = [
+        'ERR5', 'ERR3', 'SRR01', 'ERR5', 'SRR1', 'ERR4', 'ERR3', 'ERR5',
+        'odd-1', 'odd-1'
+    ]
+    for accession in accessions:
+        counter.add(accession)
+    assert len(counter) == 6
+    assert sorted(counter.duplicates()) == ['ERR3', 'ERR5', 'odd-1']
+    counter.add('ERR4')
+    assert len(counter) == 6
+    assert sorted(counter.duplicates()) == ['ERR3', 'ERR4', 'ERR5', 'odd-1']
@@ -0,0 +1,7 @@
+from filter_expressions import compile_filter
+
+
+def test_overflowing_number_literal():
+    record_filter = compile_filter('read_count < 1e999', {'read_count': 0})
+    assert record_filter(['100000'])
+    assert not record_filter(['inf'])
@@ -0,0 +1,39 @@
+import io
+
+import pytest
+
+from split_link_files import LinkFileSplitter
+
+
+def make_meta(*records):
+    return io.StringIO(
+        'run_accession\tfastq_ftp\tbatch_id\n' + ''.join(
+            f'{run}\t{run}_1.fastq.gz;{run}_2.fastq.gz\t{batch_id}\n'
+            for run, batch_id in records
+        )
+    )
+
+
+@pytest.mark.parametrize('records, max_batch_size', [
+    ([('R1', 'A/1'), ('R2', 'A_1')], None),
+    ([('R1', 'X'), ('R2', 'X'), ('R3', 'X-2')], 1),
+])
+def test_colliding_link_file_names(tmp_path, records, max_batch_size):
+    splitter = LinkFileSplitter(str(tmp_path), max_batch_size=max_batch_size)
+    with pytest.raises(ValueError, match='would both be written'):
+        splitter.split(make_meta(*records))
+
+
+def test_split_batches(tmp_path):
+    splitter = LinkFileSplitter(str(tmp_path), max_batch_size=2)
+    splitter.split(make_meta(
+        ('R1', 'A'), ('R2', 'B'), ('R3', 'A'), ('R4', 'A')
+    ))
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        'A-2.txt', 'A.txt', 'B.txt'
+    ]
+    assert (tmp_path / 'A-2.txt').read_text() == (
+        'run_accession: fastq_ftp\n'
+        'R4: R4_1.fastq.gz\n'
+        'R4: R4_2.fastq.gz\n'
+    )
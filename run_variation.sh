@@ -6,17 +6,18 @@ BOT_SIGNAL4='bot-failed'
 DEST_BOT_TAGS='bot-go-report bot-go-consensus'
 JOB_YML='variation-job.yml'
 
-# read bot config
+# read and validate bot config
 JOB_YML_DIR='job-yml-templates'
-GALAXY_SERVER=$(grep '#use_server:' "$JOB_YML_DIR/$JOB_YML" | cut -d ' ' -f 2-)
-DEST_NAME_BASE=$(grep '#new_history_base_name:' "$JOB_YML_DIR/$JOB_YML" | cut -d ' ' -f 2-)
-DEST_TAG=$(grep '#new_history_tag:' "$JOB_YML_DIR/$JOB_YML" | cut -d ' ' -f 2-)
+BOT_CONFIG=$(python bioblend-scripts/bot_config.py "$JOB_YML_DIR/$JOB_YML" --shell) || exit 1
+eval "$BOT_CONFIG"
+GALAXY_SERVER=$USE_SERVER
+DEST_NAME_BASE=$NEW_HISTORY_BASE_NAME
+DEST_TAG=$NEW_HISTORY_TAG
 # variation bot-only config
-DOWNLOAD_HISTORY=$(grep '#history_for_downloads:' "$JOB_YML_DIR/$JOB_YML" | cut -d ' ' -f 2-)
-LINKS_HISTORY_TAG=$(grep '#metadata_history_tag:' "$JOB_YML_DIR/$JOB_YML" | cut -d ' ' -f 2-)
-LINKS_COLLECTION_NAME=$(grep '#metadata_collection_name:' "$JOB_YML_DIR/$JOB_YML" | cut -d ' ' -f 2-)
-DEFAULT_PROTOCOL=$(grep '#download_protocol:' "$JOB_YML_DIR/$JOB_YML" | cut -d ' ' -f 2-)
-MIN_RUN_DELTA=$(grep '#min_run_delta:' "$JOB_YML_DIR/$JOB_YML" | cut -d ' ' -f 2-)
+DOWNLOAD_HISTORY=$HISTORY_FOR_DOWNLOADS
+LINKS_HISTORY_TAG=$METADATA_HISTORY_TAG
+LINKS_COLLECTION_NAME=$METADATA_COLLECTION_NAME
+DEFAULT_PROTOCOL=$DOWNLOAD_PROTOCOL
 
 # start processing
 WORKDIR=$DEST_TAG'_run_'$(date '+%s')
@@ -30,26 +31,36 @@ if [ -n "$SCHEDULING" ]; then
     exit 0
 fi
 # no scheduling WF invocation found => proceed
-PREVIOUS_HISTORY=`python bioblend-scripts/get_most_recent_history_by_tag.py -g "$GALAXY_SERVER" -a $API_KEY --tag $DEST_TAG`
-if [ -n "$PREVIOUS_HISTORY" ]; then
-    echo "Previous history ID is: '$PREVIOUS_HISTORY'"
-    # this bot has run before
-    # => check if the history generated by its last run has progressed sufficiently
-    python bioblend-scripts/check_history.py -g "$GALAXY_SERVER" -a $API_KEY -p $MIN_RUN_DELTA $PREVIOUS_HISTORY || exit 0
+if [ -n "$JOB_BUDGET" ]; then
+    # check that the outstanding jobs in all bot histories leave room for another batch
+    ADMITTED=$(python bioblend-scripts/admission.py $DEST_TAG $LOAD_HISTORY_TAGS -b $JOB_BUDGET ${JOBS_PER_BATCH:+-j $JOBS_PER_BATCH} -g "$GALAXY_SERVER" -a $API_KEY) || exit 0
+    if [ "$ADMITTED" -eq 0 ]; then
+        echo "Job budget exhausted. Not starting another batch."
+        exit 0
+    fi
+else
+    PREVIOUS_HISTORY=`python bioblend-scripts/get_most_recent_history_by_tag.py -g "$GALAXY_SERVER" -a $API_KEY --tag $DEST_TAG`
+    if [ -n "$PREVIOUS_HISTORY" ]; then
+        echo "Previous history ID is: '$PREVIOUS_HISTORY'"
+        # this bot has run before
+        # => check if the history generated by its last run has progressed sufficiently
+        python bioblend-scripts/check_history.py -g "$GALAXY_SERVER" -a $API_KEY -p $MIN_RUN_DELTA $PREVIOUS_HISTORY || exit 0
+    fi
 fi
 
-# start building the job.yml needed by planemo run from its template
-cat "$JOB_YML_DIR/$JOB_YML" | python bioblend-scripts/find_collection_elements.py "$LINKS_COLLECTION_NAME" -g "$GALAXY_SERVER" -a $API_KEY -t "$LINKS_HISTORY_TAG" -n 1 --from-template -o "$WORKDIR/$JOB_YML"
+# start building the job.yml needed for invoking the WF from its template
+cat "$JOB_YML_DIR/$JOB_YML" | python bioblend-scripts/find_collection_elements.py "$LINKS_COLLECTION_NAME" -g "$GALAXY_SERVER" -a $API_KEY -t "$LINKS_HISTORY_TAG" -n 1 --schedule "${SCHEDULE_POLICY:-fifo}" --from-template -o "$WORKDIR/$JOB_YML"
 if [ ! -s "$WORKDIR/$JOB_YML" ]; then
     echo "No history tagged with $LINKS_HISTORY_TAG has a collection named $LINKS_COLLECTION_NAME. Nothing to do."
     exit 0
 fi
 
 # ------------- main actions: get data and run workflow -------------------
-SOURCE_HISTORY_ID=$(grep '#from_history_id:' "$WORKDIR/$JOB_YML" | cut -d ' ' -f 2-)
-SOURCE_HISTORY_NAME=$(grep '#from_history_name:' "$WORKDIR/$JOB_YML" | cut -d ' ' -f 2-)
-ENA_LINKS=$(grep '#from_ena_links_in:' "$WORKDIR/$JOB_YML" | cut -d ' ' -f 2-)
-DEST_NAME_SUFFIX=$(grep '#batch_name:' "$WORKDIR/$JOB_YML" | cut -d ' ' -f 2-)
+eval "$(python bioblend-scripts/bot_config.py "$WORKDIR/$JOB_YML" --shell)"
+SOURCE_HISTORY_ID=$FROM_HISTORY_ID
+SOURCE_HISTORY_NAME=$FROM_HISTORY_NAME
+ENA_LINKS=$FROM_ENA_LINKS_IN
+DEST_NAME_SUFFIX=$BATCH_NAME
 echo "Going to work on links discovered in dataset ID: '$ENA_LINKS' of history ID: '$SOURCE_HISTORY_ID'"
 # put a bot reserved tag on the input dataset to prevent it from being processed again
 # this will be changed as the analysis proceeds
@@ -68,35 +79,35 @@ mv "$WORKDIR/$JOB_YML" "$WORKDIR/$JOB_YML".tmp &&
 # now detect the type of workflow to run from the structure of the generated job yml file
 # and modify the yml's collection name to match the input collection name expected by the workflow
 if grep "list:paired" "$WORKDIR/$JOB_YML".tmp; then
-    WF_ID=$(grep '#pe_workflow_id:' "$WORKDIR/$JOB_YML".tmp | cut -d ' ' -f 2-) &&
-    INPUT_REPLACE=$(grep '#pe_collection_name:' "$WORKDIR/$JOB_YML".tmp | cut -d ' ' -f 2-) &&
+    WF_ID=$PE_WORKFLOW_ID &&
+    INPUT_REPLACE=$PE_COLLECTION_NAME &&
     sed "s/$INPUT_COLLECTION:/$INPUT_REPLACE:/" "$WORKDIR/$JOB_YML".tmp > "$WORKDIR/$JOB_YML"
 else
     NUM_LIST_LIST=$(grep -c "list:list" "$WORKDIR/$JOB_YML".tmp) &&
     if [ $NUM_LIST_LIST -eq 2 ]; then
-        WF_ID=$(grep '#nested_pe_workflow_id:' "$WORKDIR/$JOB_YML".tmp | cut -d ' ' -f 2-) &&
-        INPUT_REPLACE_FW=$(grep '#nested_pe_collection_name_fw:' "$WORKDIR/$JOB_YML".tmp | cut -d ' ' -f 2-) &&
-        INPUT_REPLACE_RV=$(grep '#nested_pe_collection_name_rv:' "$WORKDIR/$JOB_YML".tmp | cut -d ' ' -f 2-) &&
+        WF_ID=$NESTED_PE_WORKFLOW_ID &&
+        INPUT_REPLACE_FW=$NESTED_PE_COLLECTION_NAME_FW &&
+        INPUT_REPLACE_RV=$NESTED_PE_COLLECTION_NAME_RV &&
         sed "s/""$INPUT_COLLECTION""_fw:/$INPUT_REPLACE_FW:/;s/""$INPUT_COLLECTION""_rv:/$INPUT_REPLACE_RV:/" "$WORKDIR/$JOB_YML".tmp > "$WORKDIR/$JOB_YML"
     elif [ $NUM_LIST_LIST -eq 1 ]; then
-        WF_ID=$(grep '#nested_se_workflow_id:' "$WORKDIR/$JOB_YML".tmp | cut -d ' ' -f 2-) &&
-        INPUT_REPLACE=$(grep '#nested_se_collection_name:' "$WORKDIR/$JOB_YML".tmp | cut -d ' ' -f 2-) &&
+        WF_ID=$NESTED_SE_WORKFLOW_ID &&
+        INPUT_REPLACE=$NESTED_SE_COLLECTION_NAME &&
         sed "s/$INPUT_COLLECTION:/$INPUT_REPLACE:/" "$WORKDIR/$JOB_YML".tmp > "$WORKDIR/$JOB_YML"
     else
-        WF_ID=$(grep '#se_workflow_id:' "$WORKDIR/$JOB_YML".tmp | cut -d ' ' -f 2-) &&
-        INPUT_REPLACE=$(grep '#se_collection_name:' "$WORKDIR/$JOB_YML".tmp | cut -d ' ' -f 2-) &&
+        WF_ID=$SE_WORKFLOW_ID &&
+        INPUT_REPLACE=$SE_COLLECTION_NAME &&
         sed "s/$INPUT_COLLECTION:/$INPUT_REPLACE:/" "$WORKDIR/$JOB_YML".tmp > "$WORKDIR/$JOB_YML"
     fi
 fi
-# data should be downloaded at this point, time to let planemo handle the rest!
+# data should be downloaded at this point, time to invoke the WF!
 python bioblend-scripts/tag_history.py $SOURCE_HISTORY_ID --dataset-id $ENA_LINKS -g "$GALAXY_SERVER" -a $API_KEY -t $BOT_SIGNAL2 -r $BOT_SIGNAL1 &&
 # bot-downloading tag has been removed from links dataset, no need to handle this on errors anymore
 trap - err &&
-# run the WF
-planemo -v run $WF_ID "$WORKDIR/$JOB_YML" --history_name "$DEST_NAME_BASE $DEST_NAME_SUFFIX" --tags $DEST_TAG --galaxy_url "$GALAXY_SERVER" --galaxy_user_key $API_KEY --engine external_galaxy 2>&1 > /dev/null | grep -o 'GET /api/histories/[^?]*\?' > "$WORKDIR/run_info.txt" &&
+# invoke the WF
+python bioblend-scripts/invoke_workflow.py $WF_ID "$WORKDIR/$JOB_YML" --history-name "$DEST_NAME_BASE $DEST_NAME_SUFFIX" -t $DEST_TAG -g "$GALAXY_SERVER" -a $API_KEY > "$WORKDIR/run_info.txt" &&
 # on successful completion of the WF invocation inform downstream bots
 # by tagging the new history accordingly
-DEST_HISTORY_ID=$(grep -m1 -o 'histories/[0-9a-f]*' "$WORKDIR/run_info.txt" | cut -d / -f 2) &&
+DEST_HISTORY_ID=$(cat "$WORKDIR/run_info.txt") &&
 python bioblend-scripts/tag_history.py $DEST_HISTORY_ID -g "$GALAXY_SERVER" -a $API_KEY -t $DEST_BOT_TAGS &&
 # mark the source history ENA links dataset as processed
 python bioblend-scripts/tag_history.py $SOURCE_HISTORY_ID --dataset-id $ENA_LINKS -g "$GALAXY_SERVER" -a $API_KEY -t $BOT_SIGNAL3 -r $BOT_SIGNAL1 $BOT_SIGNAL2